@@ -0,0 +1,91 @@
+"""Run the benchmarks from the command line.
+
+    python -m moneyplot.benchmarks --scale departement
+    python -m moneyplot.benchmarks --scale region --stages rollups grid queries
+"""
+
+import argparse
+import logging
+import sys
+from dataclasses import asdict
+from pathlib import Path
+
+from moneyplot.benchmarks.harness import (
+    BENCHMARK_DIR,
+    REGRESSION_THRESHOLD,
+    RESULTS_DIRNAME,
+    SCALES,
+    STAGES,
+    compare_runs,
+    load_previous,
+    run_benchmark,
+)
+from moneyplot.benchmarks.synthetic import SyntheticSpec
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m moneyplot.benchmarks",
+        description="Benchmark the pipeline and dashboard queries on synthetic DVF/DPE data.",
+    )
+    parser.add_argument("--scale", choices=SCALES, default="departement")
+    parser.add_argument("--departments", nargs="+", help="override the scale's departments")
+    parser.add_argument("--years", nargs="+", help="override the scale's years")
+    parser.add_argument("--rows-per-file", type=int, help="CSV lines per department-year")
+    parser.add_argument("--dpe-rows", type=int, help="diagnostics per department")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, help="run only these stages")
+    parser.add_argument("--base-dir", type=Path, default=BENCHMARK_DIR)
+    parser.add_argument("--regenerate", action="store_true", help="rewrite the synthetic files")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument(
+        "--fail-on-regression",
+        action="store_true",
+        help="exit with status 1 if a stage regressed since the previous run",
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+
+    scale = asdict(SCALES[args.scale])
+    overrides = {
+        "departments": args.departments,
+        "years": args.years,
+        "rows_per_file": args.rows_per_file,
+        "dpe_rows_per_department": args.dpe_rows,
+    }
+    spec = SyntheticSpec(
+        **{k: v if v is not None else scale[k] for k, v in overrides.items()}, seed=args.seed
+    )
+
+    run = run_benchmark(args.scale, spec, args.stages, args.base_dir, args.regenerate)
+
+    print(f"\n{'stage':<34} {'seconds':>9} {'peak MB':>9} {'rows':>12} {'rows/s':>12}")
+    for stage in run["stages"]:
+        print(
+            f"{stage['name']:<34} {stage['seconds']:>9.2f} {stage['peak_rss_mb']:>9.0f} "
+            f"{stage['rows']:>12,} {stage['rows_per_second']:>12,.0f}"
+        )
+        for query, seconds in stage["details"].items():
+            print(f"  {query:<32} {seconds:>9.3f}")
+
+    previous = load_previous(run, args.base_dir / RESULTS_DIRNAME)
+    if previous is None:
+        print("\nNo previous run at this scale to compare with.")
+        return 0
+
+    changes = compare_runs(run, previous, args.threshold)
+    print(f"\nCompared with the run of {previous['started_at']}:")
+    print(f"{'stage':<42} {'metric':<12} {'before':>9} {'after':>9} {'change':>8}")
+    for c in changes:
+        flag = "  REGRESSION" if c["regression"] else ""
+        print(
+            f"{c['stage']:<42} {c['metric']:<12} {c['previous']:>9.3f} {c['current']:>9.3f} "
+            f"{c['change']:>+8.1%}{flag}"
+        )
+    regressions = sum(c["regression"] for c in changes)
+    print(f"\n{regressions} regression(s) above {args.threshold:.0%}.")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,476 @@
+"""Benchmark harness — time the pipeline stages and dashboard queries on synthetic data.
+
+A run generates (or reuses) synthetic DVF and DPE files at a given scale, then
+runs each stage on a fresh database in its own child process, so the peak RSS
+reported for a stage is that stage's alone. Stages run in pipeline order, each
+on the output of the previous ones. The results (wall time, peak RSS, rows/s
+per stage, plus the time of each dashboard query) are saved as JSON and
+compared with the previous run at the same scale.
+"""
+
+import json
+import logging
+import multiprocessing
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+
+import duckdb
+
+from moneyplot.benchmarks.synthetic import SyntheticSpec, generate
+from moneyplot.ingestion.dvf import ALL_DEPTS, YEARS
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_DIR = Path(__file__).resolve().parents[3] / "data" / "benchmarks"
+
+# Synthetic data and the benchmark database, one directory per scale
+WORK_DIRNAME = "work"
+
+# Saved runs, one JSON file per run
+RESULTS_DIRNAME = "results"
+
+# Relative slowdown (or memory growth) from the previous run reported as a regression
+REGRESSION_THRESHOLD = 0.10
+
+# Differences below these are noise, never regressions
+MIN_SECONDS_DELTA = 0.05
+MIN_RSS_DELTA_MB = 20
+
+# Comparable-sales searches timed by the comparables stage, around sampled sales
+COMPARABLES_SEARCHES = 200
+
+
+@dataclass
+class Scale:
+    """A synthetic dataset size: which departments and years, and how many rows each."""
+
+    departments: list[str]
+    years: list[str]
+    rows_per_file: int = 40_000  # CSV lines per department-year, as in an average department
+    dpe_rows_per_department: int = 100_000
+
+
+# From one department-year to all of France over every DVF year (~24M CSV lines)
+SCALES = {
+    "departement": Scale(["75"], ["2024"]),
+    "region": Scale(["75", "77", "78", "91", "92", "93", "94", "95"], YEARS[-3:]),
+    "france": Scale(ALL_DEPTS, YEARS),
+}
+
+
+@dataclass
+class StageResult:
+    """Measurements of one stage. ``details`` holds sub-timings (e.g. per query)."""
+
+    name: str
+    seconds: float
+    peak_rss_mb: float
+    rows: int
+    rows_per_second: float
+    details: dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class Workspace:
+    """Paths of a benchmark run."""
+
+    root: Path
+
+    @property
+    def raw_dvf(self) -> Path:
+        return self.root / "raw" / "dvf"
+
+    @property
+    def raw_dpe(self) -> Path:
+        return self.root / "raw" / "dpe"
+
+    @property
+    def dvf_clean(self) -> Path:
+        return self.root / "processed" / "dvf_clean"
+
+    @property
+    def db_path(self) -> Path:
+        return self.root / "benchmark.duckdb"
+
+    def spec(self) -> SyntheticSpec:
+        return SyntheticSpec(**json.loads((self.root / "raw" / "synthetic.json").read_text()))
+
+
+# ── Stages ───────────────────────────────────────────────────────────────────
+# Each stage runs in a child process and returns the number of rows it read
+# (rows returned, for the dashboard queries) and optionally sub-timings.
+
+
+def _stage_clean_dvf(ws: Workspace) -> tuple[int, dict]:
+    from moneyplot.transform.dvf_clean import clean_dvf
+
+    clean_dvf(raw_dir=ws.raw_dvf, output_dir=ws.dvf_clean)
+    # Throughput of the cleaning is measured on the CSV lines it reads
+    return ws.spec().dvf_rows, {}
+
+
+def _stage_clean_dvf_sharded(ws: Workspace) -> tuple[int, dict]:
+    from moneyplot.transform.dvf_clean import clean_dvf_sharded
+
+    # Same output as clean_dvf, one worker process per department at a time
+    clean_dvf_sharded(raw_dir=ws.raw_dvf, output_dir=ws.dvf_clean)
+    return ws.spec().dvf_rows, {}
+
+
+def _stage_load_dvf(ws: Workspace) -> tuple[int, dict]:
+    from moneyplot.transform.dvf_clean import load_parquet_to_duckdb
+
+    with _connect(ws) as con:
+        stats = load_parquet_to_duckdb(con, dataset_dir=ws.dvf_clean)
+    return stats.row_count, {}
+
+
+def _stage_load_dpe(ws: Workspace) -> tuple[int, dict]:
+    from moneyplot.ingestion.dpe import load_dpe_increment
+
+    fetched = 0
+    with _connect(ws) as con:
+        for path in sorted(ws.raw_dpe.glob("dpe_*.parquet")):
+            dept = path.stem.removeprefix("dpe_")
+            fetched += load_dpe_increment(con, dept, path)[0]
+    return fetched, {}
+
+
+def _stage_enrich(ws: Workspace) -> tuple[int, dict]:
+    from moneyplot.transform.enrich import enrich_mutations_with_dpe
+
+    with _connect(ws) as con:
+        enrich_mutations_with_dpe(con)
+        rows = con.execute("SELECT count(*) FROM mutations_enriched").fetchone()[0]
+    return rows, {}
+
+
+def _stage_rollups(ws: Workspace) -> tuple[int, dict]:
+    from moneyplot.transform.rollups import refresh_rollups
+
+    with _connect(ws) as con:
+        refresh_rollups(con)
+        return _mutations_count(con), {}
+
+
+def _stage_grid(ws: Workspace) -> tuple[int, dict]:
+    from moneyplot.transform.rollups import refresh_price_grid
+
+    with _connect(ws) as con:
+        refresh_price_grid(con)
+        return _mutations_count(con), {}
+
+
+def _stage_communes(ws: Workspace) -> tuple[int, dict]:
+    from moneyplot.transform.communes import refresh_communes
+
+    with _connect(ws) as con:
+        refresh_communes(con)
+        return _mutations_count(con), {}
+
+
+def _stage_geo(ws: Workspace) -> tuple[int, dict]:
+    from moneyplot.transform.geo import refresh_geo_index
+
+    with _connect(ws) as con:
+        refresh_geo_index(con)
+        return _mutations_count(con), {}
+
+
+def _stage_queries(ws: Workspace) -> tuple[int, dict]:
+    """Run every dashboard query once, uncached; rows are the rows returned."""
+    from moneyplot.storage import queries
+    from moneyplot.storage.cache import get_cache
+
+    with _connect(ws) as con:
+        # The busiest department and its busiest communes, as a user would pick them
+        dept, communes = con.execute("""
+            SELECT code_departement, list(code_commune ORDER BY n DESC)[:3]
+            FROM (
+                SELECT code_departement, code_commune, count(*) AS n,
+                    sum(count(*)) OVER (PARTITION BY code_departement) AS n_dept
+                FROM mutations
+                GROUP BY code_departement, code_commune
+            )
+            GROUP BY code_departement, n_dept
+            ORDER BY n_dept DESC
+            LIMIT 1
+        """).fetchone()
+        annee = con.execute("SELECT max(annee) FROM mutations").fetchone()[0]
+        lat, lon = con.execute(
+            "SELECT latitude, longitude FROM mutations WHERE code_commune = ? "
+            "AND latitude IS NOT NULL AND longitude IS NOT NULL LIMIT 1",
+            [communes[0]],
+        ).fetchone()
+        sizes = queries.price_grid_sizes(con)
+        calls: dict[str, Callable[[], object]] = {
+            "mutations_summary": lambda: queries.mutations_summary(con),
+            "list_departements": lambda: queries.list_departements(con),
+            "list_types_local": lambda: queries.list_types_local(con),
+            "list_annees": lambda: queries.list_annees(con),
+            "search_communes": lambda: queries.search_communes(con, "saint"),
+            "commune_names": lambda: queries.commune_names(con, communes),
+            "commune_prices": lambda: queries.commune_prices(con, dept, annee=annee),
+            "commune_prices_france": lambda: queries.commune_prices(con, limit=20),
+            "price_grid_sizes": lambda: queries.price_grid_sizes(con, annee=annee),
+            "price_grid": lambda: queries.price_grid(con, queries.pick_grid_size(sizes)),
+            "price_grid_departement": lambda: queries.price_grid(con, 2, dept),
+            "departement_quarterly": lambda: queries.departement_quarterly(con, [dept]),
+            "commune_quarterly": lambda: queries.commune_quarterly(con, communes),
+            "commune_metrics": lambda: queries.commune_metrics(con, communes),
+            "commune_prix_m2_histogram": lambda: queries.commune_prix_m2_histogram(con, communes),
+            "commune_prix_m2_percentiles": lambda: queries.commune_prix_m2_percentiles(
+                con, communes
+            ),
+            "sales_near": lambda: queries.sales_near(con, lat, lon, 500),
+        }
+        rows, details = 0, {}
+        for name, call in calls.items():
+            get_cache().clear()
+            start = time.perf_counter()
+            result = call()
+            details[name] = round(time.perf_counter() - start, 4)
+            rows += len(result)
+    return rows, details
+
+
+def _stage_comparables(ws: Workspace) -> tuple[int, dict]:
+    """Build the comparable-sales trees, then time searches around sampled sales."""
+    from moneyplot.transform.comparables import TYPES, ComparablesIndex, refresh_comparables
+
+    directory = ws.root / "comparables"
+    shutil.rmtree(directory, ignore_errors=True)
+    with _connect(ws) as con:
+        indexed = refresh_comparables(con, directory=directory)
+        probes = con.execute(
+            f"""
+            SELECT latitude, longitude, surface_reelle_bati, nombre_pieces, type_local,
+                date_mutation
+            FROM mutations
+            WHERE type_local IN (SELECT unnest(?::VARCHAR[])) AND prix_m2 IS NOT NULL
+                AND latitude IS NOT NULL AND longitude IS NOT NULL
+                AND nombre_pieces IS NOT NULL
+            USING SAMPLE reservoir({COMPARABLES_SEARCHES} ROWS) REPEATABLE (42)
+            """,
+            [list(TYPES)],
+        ).fetchall()
+
+    index = ComparablesIndex(directory)
+    timings = []
+    for lat, lon, surface, pieces, type_local, on in probes:
+        start = time.perf_counter()
+        index.search(lat, lon, surface, pieces, type_local, on)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    details = {}
+    if timings:
+        details = {
+            "search_p50": round(timings[len(timings) // 2], 4),
+            "search_p95": round(timings[int(len(timings) * 0.95)], 4),
+            "search_max": round(timings[-1], 4),
+        }
+    return indexed, details
+
+
+# Pipeline order. Dashboard queries run twice: on the raw tables (the fallback
+# before the first refresh), then on the rollups, grid, communes and geo index.
+STAGES: dict[str, Callable[[Workspace], tuple[int, dict]]] = {
+    "clean_dvf": _stage_clean_dvf,
+    "clean_dvf_sharded": _stage_clean_dvf_sharded,
+    "load_dvf": _stage_load_dvf,
+    "load_dpe": _stage_load_dpe,
+    "enrich": _stage_enrich,
+    "queries_raw": _stage_queries,
+    "rollups": _stage_rollups,
+    "grid": _stage_grid,
+    "communes": _stage_communes,
+    "geo": _stage_geo,
+    "queries": _stage_queries,
+    "comparables": _stage_comparables,
+}
+
+
+def run_benchmark(
+    scale: str,
+    spec: SyntheticSpec | None = None,
+    stages: list[str] | None = None,
+    base_dir: Path | None = None,
+    regenerate: bool = False,
+) -> dict:
+    """Run the benchmark stages on synthetic data and save the results.
+
+    ``spec`` overrides the data size of ``scale`` (the name is kept to label and
+    compare runs). ``stages`` restricts the run to some stages, which still need
+    the output of the earlier ones: a partial run starts from the database left
+    by the previous run at this scale. Returns the run (see ``save_results``).
+    """
+    base = base_dir or BENCHMARK_DIR
+    spec = spec or SyntheticSpec(**asdict(SCALES[scale]))
+    ws = Workspace(base / WORK_DIRNAME / scale)
+    selected = stages or list(STAGES)
+    unknown = set(selected) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    start = time.perf_counter()
+    generated = generate(spec, ws.root / "raw", force=regenerate)
+    generate_seconds = time.perf_counter() - start
+    if stages is None:
+        # A full run starts from an empty database and dataset
+        shutil.rmtree(ws.dvf_clean, ignore_errors=True)
+        for path in ws.root.glob(f"{ws.db_path.name}*"):
+            path.unlink()
+
+    results = []
+    for name in STAGES:
+        if name not in selected:
+            continue
+        logger.info("Benchmark %s: running %s", scale, name)
+        result = _run_isolated(name, ws)
+        logger.info(
+            "Benchmark %s: %s took %.2f s, peak RSS %.0f MB, %.0f rows/s",
+            scale, name, result.seconds, result.peak_rss_mb, result.rows_per_second,
+        )
+        results.append(result)
+
+    run = {
+        "scale": scale,
+        "spec": asdict(spec),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "environment": _environment(),
+        "generate_seconds": round(generate_seconds, 2) if generated else None,
+        "stages": [asdict(r) for r in results],
+    }
+    save_results(run, base / RESULTS_DIRNAME)
+    return run
+
+
+def save_results(run: dict, results_dir: Path) -> Path:
+    """Write a run to ``{scale}-{timestamp}.json`` in ``results_dir``."""
+    results_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.fromisoformat(run["started_at"]).strftime("%Y%m%dT%H%M%S")
+    path = results_dir / f"{run['scale']}-{stamp}.json"
+    path.write_text(json.dumps(run, indent=2))
+    logger.info("Saved benchmark results to %s", path)
+    return path
+
+
+def load_previous(run: dict, results_dir: Path) -> dict | None:
+    """Return the latest saved run before ``run`` with the same scale and data size."""
+    # Timestamps are fixed-width: name order is run order
+    for path in sorted(results_dir.glob(f"{run['scale']}-*.json"), reverse=True):
+        previous = json.loads(path.read_text())
+        if previous["started_at"] < run["started_at"] and previous["spec"] == run["spec"]:
+            return previous
+    return None
+
+
+def compare_runs(
+    run: dict, previous: dict, threshold: float = REGRESSION_THRESHOLD
+) -> list[dict]:
+    """Compare each stage (and query) of ``run`` with ``previous``.
+
+    Returns one entry per measure present in both runs: stage, metric
+    ("seconds" or "peak_rss_mb"), previous and current values, relative change
+    and whether it is a regression (worse by more than ``threshold`` and by more
+    than the noise floor).
+    """
+    before = {s["name"]: s for s in previous["stages"]}
+    rows = []
+    for stage in run["stages"]:
+        old = before.get(stage["name"])
+        if old is None:
+            continue
+        name = stage["name"]
+        measures = [
+            (name, "seconds", old["seconds"], stage["seconds"], MIN_SECONDS_DELTA),
+            (name, "peak_rss_mb", old["peak_rss_mb"], stage["peak_rss_mb"], MIN_RSS_DELTA_MB),
+        ]
+        measures += [
+            (f"{name}.{query}", "seconds", old["details"][query], seconds, MIN_SECONDS_DELTA)
+            for query, seconds in stage["details"].items()
+            if query in old["details"]
+        ]
+        for measure, metric, was, now, noise in measures:
+            change = (now - was) / was if was else 0.0
+            rows.append({
+                "stage": measure,
+                "metric": metric,
+                "previous": was,
+                "current": now,
+                "change": round(change, 4),
+                "regression": change > threshold and now - was > noise,
+            })
+    return rows
+
+
+def _run_isolated(name: str, ws: Workspace) -> StageResult:
+    """Run one stage in a fresh process and collect its measurements."""
+    # spawn, not fork: the child must not inherit this process's memory
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(_measure, name, ws).result()
+
+
+def _measure(name: str, ws: Workspace) -> StageResult:
+    """Child-process side of ``_run_isolated``: run the stage, time it, read the peak RSS."""
+    logging.basicConfig(level=logging.WARNING)
+    start = time.perf_counter()
+    rows, details = STAGES[name](ws)
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS. Stages that run
+    # worker processes report their largest process, the stage or a worker.
+    unit = 1 if sys.platform == "darwin" else 1024
+    maxrss = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    peak = maxrss * unit / (1024 * 1024)
+    return StageResult(
+        name=name,
+        seconds=round(seconds, 3),
+        peak_rss_mb=round(peak, 1),
+        rows=rows,
+        rows_per_second=round(rows / seconds, 1) if seconds else 0.0,
+        details=details,
+    )
+
+
+def _mutations_count(con: duckdb.DuckDBPyConnection) -> int:
+    """Rows scanned by the stages that rebuild derived tables from ``mutations``."""
+    return con.execute("SELECT count(*) FROM mutations").fetchone()[0]
+
+
+def _connect(ws: Workspace) -> duckdb.DuckDBPyConnection:
+    from moneyplot.storage.schemas import create_tables
+
+    con = duckdb.connect(str(ws.db_path))
+    create_tables(con)
+    return con
+
+
+def _environment() -> dict:
+    """What a result depends on besides the code: machine and library versions."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, cwd=Path(__file__).parent, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "duckdb": duckdb.__version__,
+        "platform": platform.platform(),
+        "cpu_count": multiprocessing.cpu_count(),
+    }
@@ -0,0 +1,379 @@
+"""Synthetic DVF and DPE files, shaped like the real sources, for benchmarks.
+
+``generate_dvf`` writes ``dvf_{year}_{dept}.csv.gz`` files in the geo-dvf
+layout (``DVF_CSV_COLUMNS``), ``generate_dpe`` writes ``dpe_{dept}.parquet``
+files in the harvest layout (``DPE_SCHEMA``), so both go through the same
+cleaning and loading code as downloaded data. The content mimics what the
+pipeline has to cope with: several lines per mutation (lots, dependencies),
+non-sale natures, other property types, missing surfaces and coordinates,
+price outliers, communes of very uneven size and DPE surfaces close to the
+sales' ones.
+
+Values are derived from hashes of the row number and ``seed`` rather than
+from ``random()``, so a given seed and size always produce the same files,
+whatever the number of DuckDB threads.
+"""
+
+import json
+import logging
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import duckdb
+from tqdm import tqdm
+
+from moneyplot.transform.dvf_clean import DVF_CSV_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Parameters of the last generation, written once all its files are complete
+MANIFEST_NAME = "synthetic.json"
+
+# Average number of CSV lines per mutation (extra lots and dependencies)
+LINES_PER_MUTATION = 1.4
+
+# Communes per department, the smallest ones getting the fewest sales
+COMMUNES_PER_DEPT = 350
+
+# Mainland bounding box in which department centres are drawn (lon, lat)
+LON_RANGE = (-4.5, 7.5)
+LAT_RANGE = (42.5, 50.5)
+
+# Commune names: a prefix, a root and a suffix, picked by commune number
+NAME_PREFIXES = ["", "", "", "Saint-", "Sainte-", "Le ", "La ", "Les "]
+NAME_ROOTS = [
+    "Étienne", "Mont", "Villeneuve", "Beaumont", "Châteauneuf", "Fontaine", "Rochefort",
+    "Œuilly", "Bourg", "Neuville", "Montreuil", "Valence", "Aubigny", "Champagne",
+    "Lagny", "Brétigny", "Ivry", "Auxerre", "Pontoise", "Ambérieu",
+]
+NAME_SUFFIXES = ["", "-sur-Mer", "-sur-Loire", "-en-Bray", "-les-Bains", "-le-Château"]
+
+# Mutation natures and their shares; only 'Vente' is kept by the cleaning
+NATURES = [
+    ("Vente", 0.88),
+    ("Vente en l'état futur d'achèvement", 0.06),
+    ("Echange", 0.02),
+    ("Adjudication", 0.02),
+    ("Expropriation", 0.02),
+]
+
+# DPE energy classes and their shares
+DPE_CLASSES = [
+    ("A", 0.02), ("B", 0.04), ("C", 0.15), ("D", 0.33), ("E", 0.25), ("F", 0.13), ("G", 0.08),
+]
+
+# Uniform draw in [0, 1) from a row number and a salt, a standard normal draw, and
+# the index (1-based) of the bucket a uniform draw falls in, given cumulative shares
+_MACROS = """
+    CREATE OR REPLACE TEMP MACRO u(i, salt) AS hash(i, salt, {seed}) / 18446744073709551616.0;
+    CREATE OR REPLACE TEMP MACRO z(i, salt) AS
+        sqrt(-2 * ln(greatest(u(i, salt || '#1'), 1e-12))) * cos(2 * pi() * u(i, salt || '#2'));
+    CREATE OR REPLACE TEMP MACRO pick(x, cumulative) AS
+        list_position(list_transform(cumulative, c -> x < c), true);
+"""
+
+# One department-year: mutations, then their lines. A commune's position in the
+# department sets its size (quadratic skew), price level and location.
+_DVF_SELECT = """
+    WITH mutations AS (
+        SELECT
+            i,
+            '{year}-' || '{dept}' || '-' || i AS id_mutation,
+            DATE '{year}-01-01' + floor(u(i, 'date') * 365)::INTEGER AS date_mutation,
+            {natures}[pick(u(i, 'nature'), {nature_weights})] AS nature_mutation,
+            least(({n_communes} * u(i, 'commune') ^ 2)::INTEGER, {n_communes} - 1) AS c,
+            1 + (u(i, 'lots') < 0.3)::INTEGER + (u(i, 'lots2') < 0.1)::INTEGER AS nb_lignes
+        FROM range({n_mutations}) t(i)
+    ),
+    communes AS (
+        SELECT
+            c,
+            '{dept}' || lpad(c::VARCHAR, {code_digits}, '0') AS code_commune,
+            {prefixes}[1 + c % {n_prefixes}]
+                || {roots}[1 + (c // {n_prefixes} + {dept_offset}) % {n_roots}]
+                || {suffixes}[1 + (c // ({n_prefixes} * {n_roots})) % {n_suffixes}]
+                || CASE WHEN c >= {n_names} THEN ' ' || (c // {n_names} + 1) ELSE '' END
+                AS nom_commune,
+            exp(ln(2500) + 0.45 * z(c, '{dept}-price')) AS prix_m2_commune,
+            {lon0} + 0.25 * z(c, '{dept}-lon') AS lon_commune,
+            {lat0} + 0.18 * z(c, '{dept}-lat') AS lat_commune,
+            u(c, '{dept}-urban') AS urbain
+        FROM range({n_communes}) t(c)
+    ),
+    lines AS (
+        SELECT
+            m.*,
+            cm.* EXCLUDE (c),
+            j,
+            hash(m.i, j) AS r
+        FROM mutations m
+        JOIN communes cm USING (c),
+        unnest(range(m.nb_lignes)) l(j)
+    ),
+    typed AS (
+        SELECT
+            *,
+            CASE
+                WHEN j = 0 THEN
+                    CASE WHEN u(r, 'type') < 0.3 + 0.5 * urbain THEN 'Appartement' ELSE 'Maison' END
+                WHEN u(r, 'type') < 0.7 THEN 'Dépendance'
+                WHEN u(r, 'type') < 0.8 THEN 'Local industriel. commercial ou assimilé'
+                ELSE CASE WHEN u(r, 'type2') < 0.5 THEN 'Appartement' ELSE 'Maison' END
+            END AS type_local
+        FROM lines
+    ),
+    measured AS (
+        SELECT
+            *,
+            CASE
+                WHEN type_local = 'Dépendance' OR u(r, 'no_surface') < 0.02 THEN NULL
+                WHEN type_local = 'Maison' THEN round(exp(ln(100) + 0.35 * z(r, 'surface')))
+                ELSE round(exp(ln(55) + 0.45 * z(r, 'surface')))
+            END AS surface_reelle_bati
+        FROM typed
+    ),
+    priced AS (
+        SELECT
+            *,
+            CASE
+                WHEN u(i, 'outlier') < 0.002 THEN round(u(i, 'outlier2') * 50000000, 2)
+                ELSE round(
+                    prix_m2_commune * (1 + 0.03 * ({year} - 2020))
+                    * CASE WHEN j = 0 THEN coalesce(surface_reelle_bati, 60) ELSE 0 END
+                    * exp(0.25 * z(i, 'noise')),
+                    2
+                )
+            END AS valeur_principale
+        FROM measured
+    )
+    SELECT
+        id_mutation,
+        date_mutation,
+        (j + 1)::VARCHAR AS numero_disposition,
+        nature_mutation,
+        -- Every line of a mutation repeats its total price, as in DVF
+        max(valeur_principale) OVER (PARTITION BY id_mutation) AS valeur_fonciere,
+        (1 + u(r, 'numero') * 120)::INTEGER::VARCHAR AS adresse_numero,
+        NULL AS adresse_suffixe,
+        'RUE DE LA ' || upper({roots}[1 + (r % {n_roots})::INTEGER]) AS adresse_nom_voie,
+        lpad((r % 9999)::VARCHAR, 4, '0') AS adresse_code_voie,
+        rpad('{dept}', 2, '0') || lpad((c_postal * 10)::VARCHAR, 3, '0') AS code_postal,
+        code_commune,
+        nom_commune,
+        '{dept}' AS code_departement,
+        NULL AS ancien_code_commune,
+        NULL AS ancien_nom_commune,
+        code_commune || '000' || chr(65 + (r % 26)::INTEGER) || chr(65 + (r // 26 % 26)::INTEGER)
+            || lpad((r % 9999)::VARCHAR, 4, '0') AS id_parcelle,
+        NULL AS ancien_id_parcelle,
+        NULL AS numero_volume,
+        CASE WHEN type_local = 'Appartement' THEN (r % 500)::VARCHAR END AS lot1_numero,
+        CASE WHEN type_local = 'Appartement' AND u(r, 'carrez') < 0.8
+            THEN round(surface_reelle_bati * 0.95, 2) END AS lot1_surface_carrez,
+        NULL AS lot2_numero,
+        NULL AS lot2_surface_carrez,
+        NULL AS lot3_numero,
+        NULL AS lot3_surface_carrez,
+        NULL AS lot4_numero,
+        NULL AS lot4_surface_carrez,
+        NULL AS lot5_numero,
+        NULL AS lot5_surface_carrez,
+        (type_local = 'Appartement')::INTEGER AS nombre_lots,
+        CASE type_local
+            WHEN 'Maison' THEN '1' WHEN 'Appartement' THEN '2' WHEN 'Dépendance' THEN '3'
+            ELSE '4'
+        END AS code_type_local,
+        type_local,
+        surface_reelle_bati,
+        CASE WHEN surface_reelle_bati IS NOT NULL
+            THEN greatest(1, round(surface_reelle_bati / 22))::INTEGER END
+            AS nombre_pieces_principales,
+        CASE WHEN type_local = 'Maison' THEN 'S' END AS code_nature_culture,
+        CASE WHEN type_local = 'Maison' THEN 'sols' END AS nature_culture,
+        NULL AS code_nature_culture_speciale,
+        NULL AS nature_culture_speciale,
+        CASE WHEN type_local = 'Maison'
+            THEN round(exp(ln(600) + 0.8 * z(r, 'terrain'))) END AS surface_terrain,
+        CASE WHEN u(i, 'no_geo') >= 0.03
+            THEN round(lon_commune + 0.01 * z(i, 'lon'), 6) END AS longitude,
+        CASE WHEN u(i, 'no_geo') >= 0.03
+            THEN round(lat_commune + 0.01 * z(i, 'lat'), 6) END AS latitude
+    FROM (SELECT *, (u(r, 'postal') * 10)::INTEGER AS c_postal FROM priced)
+    ORDER BY i, j
+    LIMIT {n_rows}
+"""
+
+# One department's diagnostics, on the same communes and surface distributions
+_DPE_SELECT = """
+    WITH d AS (
+        SELECT
+            i,
+            least(({n_communes} * u(i, 'dpe-commune') ^ 2)::INTEGER, {n_communes} - 1) AS c
+        FROM range({n_rows}) t(i)
+    )
+    SELECT
+        '{dept}' || 'E' || lpad(i::VARCHAR, 8, '0') AS id_dpe,
+        '{dept}' || lpad(c::VARCHAR, {code_digits}, '0') AS code_commune,
+        NULL::VARCHAR AS id_parcelle,
+        {classes}[pick(u(i, 'ce'), {class_weights})] AS classe_energie,
+        {classes}[pick(u(i, 'cg'), {class_weights})] AS classe_ges,
+        (1850 + u(i, 'annee') * 172)::INTEGER AS annee_construction,
+        round(
+            CASE WHEN u(i, 'dpe-type') < 0.55
+                THEN exp(ln(55) + 0.45 * z(i, 'dpe-surface'))
+                ELSE exp(ln(100) + 0.35 * z(i, 'dpe-surface'))
+            END,
+            1
+        ) AS surface_habitable,
+        DATE '2021-07-01' + (u(i, 'dpe-date') * 1600)::INTEGER AS date_etablissement
+    FROM d
+"""
+
+
+@dataclass
+class SyntheticSpec:
+    """What ``generate`` writes; saved to the manifest so unchanged data is reused."""
+
+    departments: list[str]
+    years: list[str]
+    rows_per_file: int
+    dpe_rows_per_department: int
+    seed: int = 0
+
+    @property
+    def dvf_rows(self) -> int:
+        return len(self.departments) * len(self.years) * self.rows_per_file
+
+    @property
+    def dpe_rows(self) -> int:
+        return len(self.departments) * self.dpe_rows_per_department
+
+
+def generate(spec: SyntheticSpec, output_dir: Path, force: bool = False) -> bool:
+    """Write the DVF CSVs to ``output_dir/dvf`` and the DPE files to ``output_dir/dpe``.
+
+    Files already generated with the same spec (per the manifest) are kept
+    unless ``force``. Returns whether files were (re)generated.
+    """
+    manifest = output_dir / MANIFEST_NAME
+    if not force and manifest.exists() and json.loads(manifest.read_text()) == asdict(spec):
+        logger.info("Synthetic data in %s is up to date", output_dir)
+        return False
+
+    manifest.unlink(missing_ok=True)
+    generate_dvf(output_dir / "dvf", spec.departments, spec.years, spec.rows_per_file, spec.seed)
+    generate_dpe(output_dir / "dpe", spec.departments, spec.dpe_rows_per_department, spec.seed)
+    manifest.write_text(json.dumps(asdict(spec), indent=2))
+    return True
+
+
+def generate_dvf(
+    output_dir: Path,
+    departments: list[str],
+    years: list[str],
+    rows_per_file: int,
+    seed: int = 0,
+) -> list[Path]:
+    """Write one ``dvf_{year}_{dept}.csv.gz`` of ``rows_per_file`` lines per department-year."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    con = _connect(seed)
+    paths = []
+    tasks = [(year, dept) for year in years for dept in departments]
+    for year, dept in tqdm(tasks, unit="file", desc="DVF synthétique"):
+        out = output_dir / f"dvf_{year}_{dept}.csv.gz"
+        tmp = out.with_name(out.name + ".part")
+        con.execute(f"""
+            COPY ({_dvf_sql(dept, year, rows_per_file)})
+            TO '{tmp}' (FORMAT CSV, HEADER, COMPRESSION GZIP)
+        """)
+        tmp.replace(out)
+        paths.append(out)
+    con.close()
+    logger.info(
+        "Generated %d DVF files (%d rows each) in %s", len(paths), rows_per_file, output_dir
+    )
+    return paths
+
+
+def generate_dpe(
+    output_dir: Path, departments: list[str], rows_per_department: int, seed: int = 0
+) -> list[Path]:
+    """Write one ``dpe_{dept}.parquet`` of ``rows_per_department`` diagnostics per department."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    con = _connect(seed)
+    paths = []
+    for dept in tqdm(departments, unit="dept", desc="DPE synthétique"):
+        out = output_dir / f"dpe_{dept}.parquet"
+        tmp = out.with_name(out.name + ".part")
+        query = _DPE_SELECT.format(
+            dept=dept,
+            n_rows=rows_per_department,
+            n_communes=_communes_per_dept(dept),
+            code_digits=5 - len(dept),
+            classes=_sql_list([c for c, _ in DPE_CLASSES]),
+            class_weights=_sql_list(_cumulative([w for _, w in DPE_CLASSES])),
+        )
+        con.execute(f"COPY ({query}) TO '{tmp}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+        tmp.replace(out)
+        paths.append(out)
+    con.close()
+    logger.info(
+        "Generated %d DPE files (%d rows each) in %s", len(paths), rows_per_department, output_dir
+    )
+    return paths
+
+
+def _connect(seed: int) -> duckdb.DuckDBPyConnection:
+    con = duckdb.connect()
+    con.execute(_MACROS.format(seed=int(seed)))
+    return con
+
+
+def _dvf_sql(dept: str, year: str, n_rows: int) -> str:
+    n_names = len(NAME_PREFIXES) * len(NAME_ROOTS) * len(NAME_SUFFIXES)
+    # Department centre, drawn from the department code so it is stable across years
+    key = int.from_bytes(dept.encode(), "big")
+    lon0 = LON_RANGE[0] + (key * 7919 % 1000) / 1000 * (LON_RANGE[1] - LON_RANGE[0])
+    lat0 = LAT_RANGE[0] + (key * 104729 % 1000) / 1000 * (LAT_RANGE[1] - LAT_RANGE[0])
+    query = _DVF_SELECT.format(
+        dept=dept,
+        year=int(year),
+        n_rows=n_rows,
+        n_mutations=int(n_rows / LINES_PER_MUTATION) + 1,
+        n_communes=_communes_per_dept(dept),
+        code_digits=5 - len(dept),
+        natures=_sql_list([n for n, _ in NATURES]),
+        nature_weights=_sql_list(_cumulative([w for _, w in NATURES])),
+        prefixes=_sql_list(NAME_PREFIXES),
+        roots=_sql_list(NAME_ROOTS),
+        suffixes=_sql_list(NAME_SUFFIXES),
+        n_prefixes=len(NAME_PREFIXES),
+        n_roots=len(NAME_ROOTS),
+        n_suffixes=len(NAME_SUFFIXES),
+        n_names=n_names,
+        dept_offset=key % len(NAME_ROOTS),
+        lon0=round(lon0, 4),
+        lat0=round(lat0, 4),
+    )
+    # Columns in the geo-dvf file order
+    return f"SELECT {', '.join(DVF_CSV_COLUMNS)} FROM ({query})"
+
+
+def _communes_per_dept(dept: str) -> int:
+    """Communes of a department, capped by the digits its commune codes leave."""
+    return min(COMMUNES_PER_DEPT, 10 ** (5 - len(dept)))
+
+
+def _sql_list(values: list) -> str:
+    """Render a Python list of strings or numbers as a DuckDB list literal."""
+    items = ("'" + v.replace("'", "''") + "'" if isinstance(v, str) else repr(v) for v in values)
+    return "[" + ", ".join(items) + "]"
+
+
+def _cumulative(shares: list[float]) -> list[float]:
+    """Cumulative shares, the last one set to 1 so every draw in [0, 1) lands in a bucket."""
+    total, bounds = 0.0, []
+    for share in shares:
+        total += share
+        bounds.append(round(total, 6))
+    return bounds[:-1] + [1.0]
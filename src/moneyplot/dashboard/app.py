@@ -2,9 +2,12 @@
 
 from pathlib import Path
 
+import pandas as pd
 import streamlit as st
 
-from moneyplot.storage.db import get_connection
+from moneyplot.dashboard.debug import query_panel
+from moneyplot.storage import queries
+from moneyplot.storage.db import get_read_connection
 
 
 def main():
@@ -21,19 +24,20 @@ def main():
 
     # Quick stats on the sidebar
     try:
-        con = get_connection()
-        total = con.execute("SELECT count(*) FROM mutations").fetchone()[0]
-        st.sidebar.metric("Transactions en base", f"{total:,.0f}")
-
-        date_range = con.execute(
-            "SELECT min(date_mutation), max(date_mutation) FROM mutations"
-        ).fetchone()
-        if date_range[0]:
-            st.sidebar.caption(f"Période : {date_range[0]} → {date_range[1]}")
+        con = get_read_connection()
+        summary = queries.mutations_summary(con).iloc[0]
+        st.sidebar.metric("Transactions en base", f"{summary['total']:,.0f}")
+
+        if pd.notna(summary["date_min"]):
+            st.sidebar.caption(
+                f"Période : {summary['date_min']:%Y-%m-%d} → {summary['date_max']:%Y-%m-%d}"
+            )
         con.close()
     except Exception:
         st.sidebar.warning("Base de données non initialisée. Lancez le pipeline Dagster.")
 
+    query_panel()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,81 @@
+"""Debug panel of the dashboard — query timings, shown when query profiling is enabled."""
+
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+from moneyplot.storage.cache import get_cache
+from moneyplot.storage.db import PROFILING_ENV, default_profiler
+
+# Most recent queries listed in the panel
+RECENT_QUERIES = 20
+
+
+def query_panel() -> None:
+    """Show the process's query timings in the sidebar (nothing unless profiling is on).
+
+    Timings cover every session since the dashboard started (or the last
+    reset). The panel is drawn before the page queries, so the queries of the
+    current run appear at the next interaction.
+    """
+    profiler = default_profiler()
+    if profiler is None:
+        return
+
+    with st.sidebar.expander("Requêtes (debug)"):
+        records = profiler.records()
+        cache = get_cache().stats()
+        st.caption(
+            f"{len(records)} requêtes DuckDB, {sum(r.seconds for r in records):.2f} s au total · "
+            f"cache : {cache.hits} succès, {cache.misses} échecs, {cache.entries} entrées"
+        )
+        if st.button("Réinitialiser", key="debug_reset"):
+            profiler.clear()
+            records = []
+
+        shapes = profiler.slowest_shapes()
+        if shapes:
+            st.markdown(
+                f"**Formes les plus coûteuses** (lentes : ≥ {profiler.slow_seconds:g} s)"
+            )
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "requête": s.shape[:120],
+                        "n": s.count,
+                        "total (s)": round(s.total_seconds, 3),
+                        "moyenne (s)": round(s.mean_seconds, 3),
+                        "max (s)": round(s.max_seconds, 3),
+                        "lentes": s.slow,
+                        "lignes (moy.)": None if s.mean_rows is None else round(s.mean_rows),
+                    }
+                    for s in shapes
+                ]),
+                hide_index=True,
+                use_container_width=True,
+            )
+
+        if records:
+            st.markdown("**Dernières requêtes**")
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "heure": datetime.fromtimestamp(r.started_at).strftime("%H:%M:%S"),
+                        "durée (s)": round(r.seconds, 3),
+                        "lignes": r.rows,
+                        "requête": r.shape[:120],
+                        "erreur": r.error,
+                    }
+                    for r in reversed(records[-RECENT_QUERIES:])
+                ]),
+                hide_index=True,
+                use_container_width=True,
+            )
+            profiled = [r for r in records if r.profile]
+            if profiled:
+                slowest = max(profiled, key=lambda r: r.seconds)
+                st.markdown("**Profil DuckDB de la requête la plus lente**")
+                st.code(slowest.sql.strip(), language="sql")
+                st.json(slowest.profile, expanded=False)
+        st.caption(f"Désactiver : retirer la variable d'environnement `{PROFILING_ENV}`.")
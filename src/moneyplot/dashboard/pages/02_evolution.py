@@ -4,25 +4,27 @@ import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
 
-from moneyplot.storage.db import get_connection
+from moneyplot.dashboard.debug import query_panel
+from moneyplot.storage import queries
+from moneyplot.storage.db import get_read_connection
 
 st.set_page_config(page_title="Évolution des prix", layout="wide")
 st.title("Évolution des prix au m\u00b2")
 
 try:
-    con = get_connection()
+    con = get_read_connection()
 except Exception:
     st.error("Base de données non disponible.")
     st.stop()
 
+query_panel()
+
 # ── Filters ──────────────────────────────────────────────────────────────────
 
 col1, col2 = st.columns(2)
 
 with col1:
-    depts = con.execute(
-        "SELECT DISTINCT code_departement FROM mutations ORDER BY 1"
-    ).fetchdf()["code_departement"].tolist()
+    depts = queries.list_departements(con)
     selected_depts = st.multiselect("Départements", depts, default=depts[:1] if depts else [])
 
 with col2:
@@ -37,26 +39,9 @@ if not selected_depts:
     st.info("Sélectionnez au moins un département.")
     st.stop()
 
-dept_list = ", ".join(f"'{d}'" for d in selected_depts)
-type_filter = f"AND type_local = '{selected_type}'" if selected_type != "Tous" else ""
-
-query = f"""
-    SELECT
-        annee,
-        trimestre,
-        code_departement,
-        MEDIAN(prix_m2) AS prix_m2_median,
-        AVG(prix_m2) AS prix_m2_moyen,
-        COUNT(*) AS nb_transactions
-    FROM mutations
-    WHERE prix_m2 IS NOT NULL
-      AND code_departement IN ({dept_list})
-      {type_filter}
-    GROUP BY annee, trimestre, code_departement
-    ORDER BY annee, trimestre
-"""
-
-df = con.execute(query).fetchdf()
+df = queries.departement_quarterly(
+    con, selected_depts, type_local=None if selected_type == "Tous" else selected_type
+)
 
 if df.empty:
     st.warning("Aucune donnée pour les filtres sélectionnés.")
@@ -106,9 +91,7 @@ st.plotly_chart(fig2, use_container_width=True)
 # ── Overlay mortgage rates if available ──────────────────────────────────────
 
 try:
-    taux = con.execute("""
-        SELECT date, taux FROM taux_hypothecaires ORDER BY date
-    """).fetchdf()
+    taux = queries.mortgage_rates(con)
     if not taux.empty:
         st.subheader("Taux hypothécaires (overlay)")
         fig3 = go.Figure()
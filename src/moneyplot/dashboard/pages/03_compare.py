@@ -2,83 +2,81 @@
 
 import streamlit as st
 import plotly.express as px
+import plotly.graph_objects as go
 import pandas as pd
 
-from moneyplot.storage.db import get_connection
+from moneyplot.dashboard.debug import query_panel
+from moneyplot.storage import queries
+from moneyplot.storage.db import get_read_connection
 
 st.set_page_config(page_title="Comparaison", layout="wide")
 st.title("Comparaison de communes")
 
 try:
-    con = get_connection()
+    con = get_read_connection()
 except Exception:
     st.error("Base de données non disponible.")
     st.stop()
 
+query_panel()
+
 # ── Commune selector ─────────────────────────────────────────────────────────
 
-communes = con.execute("""
-    SELECT DISTINCT nom_commune, code_commune, code_departement
-    FROM mutations
-    WHERE nom_commune IS NOT NULL
-    ORDER BY nom_commune
-""").fetchdf()
+# Communes are tracked by code; names are only looked up for display
+if "compare_communes" not in st.session_state:
+    st.session_state.compare_communes = []
+
+
+def _add_commune():
+    code = st.session_state.commune_match
+    if code and code not in st.session_state.compare_communes:
+        st.session_state.compare_communes.append(code)
+    st.session_state.commune_match = None
+
+
+def _labels(df: pd.DataFrame) -> dict[str, str]:
+    return dict(zip(df["code_commune"], df["nom_commune"] + " (" + df["code_departement"] + ")"))
 
-commune_options = (
-    communes["nom_commune"] + " (" + communes["code_departement"] + ")"
-).tolist()
 
-selected = st.multiselect(
+# Without search text, the communes with the most sales are proposed
+search = st.text_input("Rechercher une commune", placeholder="Début du nom, ex. « saint etienne »")
+match_labels = _labels(queries.search_communes(con, search))
+st.selectbox(
+    "Ajouter une commune",
+    list(match_labels),
+    index=None,
+    format_func=match_labels.get,
+    placeholder="Choisir" if match_labels else "Aucun résultat",
+    key="commune_match",
+    on_change=_add_commune,
+    disabled=len(st.session_state.compare_communes) >= 5,
+)
+
+labels = _labels(queries.commune_names(con, st.session_state.compare_communes))
+selected_codes = st.multiselect(
     "Communes à comparer (max 5)",
-    commune_options,
+    st.session_state.compare_communes,
+    default=st.session_state.compare_communes,
+    format_func=lambda code: labels.get(code, code),
     max_selections=5,
 )
+st.session_state.compare_communes = selected_codes
 
-if not selected:
+if not selected_codes:
     st.info("Sélectionnez des communes pour les comparer.")
     con.close()
     st.stop()
 
-# Extract code_commune from selection
-selected_codes = []
-for s in selected:
-    name = s.rsplit(" (", 1)[0]
-    dept = s.rsplit("(", 1)[1].rstrip(")")
-    match = communes[
-        (communes["nom_commune"] == name) & (communes["code_departement"] == dept)
-    ]
-    if not match.empty:
-        selected_codes.append(match.iloc[0]["code_commune"])
-
-if not selected_codes:
-    st.stop()
-
-codes_sql = ", ".join(f"'{c}'" for c in selected_codes)
-
 # ── Filters ──────────────────────────────────────────────────────────────────
 
 selected_type = st.selectbox("Type de bien", ["Tous", "Appartement", "Maison"])
-type_filter = f"AND type_local = '{selected_type}'" if selected_type != "Tous" else ""
+type_local = None if selected_type == "Tous" else selected_type
 
 # ── Key metrics ──────────────────────────────────────────────────────────────
 
 st.subheader("Indicateurs clés")
 
-metrics = con.execute(f"""
-    SELECT
-        nom_commune,
-        code_departement,
-        MEDIAN(prix_m2) AS prix_m2_median,
-        AVG(prix_m2) AS prix_m2_moyen,
-        COUNT(*) AS nb_transactions,
-        MEDIAN(surface_reelle_bati) AS surface_mediane,
-        MEDIAN(valeur_fonciere) AS prix_median
-    FROM mutations
-    WHERE code_commune IN ({codes_sql})
-      AND prix_m2 IS NOT NULL
-      {type_filter}
-    GROUP BY nom_commune, code_departement
-""").fetchdf()
+metrics = queries.commune_metrics(con, selected_codes, type_local)
 
 cols = st.columns(len(metrics))
 for i, (_, row) in enumerate(metrics.iterrows()):
@@ -93,20 +91,7 @@ for i, (_, row) in enumerate(metrics.iterrows()):
 
 st.subheader("Évolution comparée")
 
-evo = con.execute(f"""
-    SELECT
-        nom_commune,
-        annee,
-        trimestre,
-        MEDIAN(prix_m2) AS prix_m2_median,
-        COUNT(*) AS nb
-    FROM mutations
-    WHERE code_commune IN ({codes_sql})
-      AND prix_m2 IS NOT NULL
-      {type_filter}
-    GROUP BY nom_commune, annee, trimestre
-    ORDER BY annee, trimestre
-""").fetchdf()
+evo = queries.commune_quarterly(con, selected_codes, type_local)
 
 if not evo.empty:
     evo["date"] = evo.apply(
@@ -132,25 +117,47 @@ if not evo.empty:
 
 st.subheader("Distribution des prix au m²")
 
-distrib = con.execute(f"""
-    SELECT nom_commune, prix_m2
-    FROM mutations
-    WHERE code_commune IN ({codes_sql})
-      AND prix_m2 IS NOT NULL
-      AND prix_m2 < 15000
-      {type_filter}
-""").fetchdf()
-
-if not distrib.empty:
-    fig2 = px.histogram(
-        distrib,
-        x="prix_m2",
-        color="nom_commune",
-        nbins=50,
-        labels={"prix_m2": "Prix au m² (€)", "nom_commune": "Commune"},
+# Bins and percentiles are computed in DuckDB: only a few rows per commune come back
+bin_mode = st.radio("Classes", ["Largeur fixe", "Quantiles"], horizontal=True)
+quantile_bins = bin_mode == "Quantiles"
+hist = queries.commune_prix_m2_histogram(
+    con, selected_codes, type_local, quantile_bins=quantile_bins, max_prix_m2=15000
+)
+
+if not hist.empty:
+    hist["largeur"] = hist["bin_end"] - hist["bin_start"]
+    if quantile_bins:
+        # Classes have unequal widths: plot sales per 100 €/m² so that areas compare
+        hist["y"] = hist["nb_transactions"] / hist["largeur"] * 100
+        y_title = "Transactions par tranche de 100 €/m²"
+    else:
+        hist["y"] = hist["nb_transactions"]
+        y_title = "Transactions"
+
+    fig2 = go.Figure()
+    for nom_commune, bins in hist.groupby("nom_commune"):
+        fig2.add_bar(
+            x=(bins["bin_start"] + bins["bin_end"]) / 2,
+            y=bins["y"],
+            width=bins["largeur"],
+            name=nom_commune,
+            opacity=0.6,
+        )
+    fig2.update_layout(
         barmode="overlay",
-        opacity=0.6,
+        xaxis_title="Prix au m² (€)",
+        yaxis_title=y_title,
+        legend_title="Commune",
     )
     st.plotly_chart(fig2, use_container_width=True)
 
+percentiles = queries.commune_prix_m2_percentiles(con, selected_codes, type_local)
+
+if not percentiles.empty:
+    table = percentiles.drop(columns="code_commune")
+    table.columns = ["Commune", "Transactions"] + [
+        f"P{round(p * 100)} €/m²" for p in queries.PERCENTILES
+    ]
+    st.dataframe(table.round(0), use_container_width=True, hide_index=True)
+
 con.close()
@@ -0,0 +1,149 @@
+"""Page 4 — Ventes autour d'une adresse."""
+
+import httpx
+import pydeck as pdk
+import streamlit as st
+
+from moneyplot.dashboard.debug import query_panel
+from moneyplot.ingestion.ban import geocode
+from moneyplot.storage import queries
+from moneyplot.storage.db import get_read_connection
+
+st.set_page_config(page_title="Autour d'une adresse", layout="wide")
+st.title("Ventes autour d'une adresse")
+
+try:
+    con = get_read_connection()
+except Exception:
+    st.error("Base de données non disponible. Lancez le pipeline Dagster.")
+    st.stop()
+
+query_panel()
+
+# ── Address ──────────────────────────────────────────────────────────────────
+
+search = st.text_input("Adresse", placeholder="ex. « 20 avenue de Ségur Paris »")
+try:
+    matches = geocode(search) if search else []
+except httpx.HTTPError:
+    st.error("Le service de géocodage (Base Adresse Nationale) ne répond pas.")
+    st.stop()
+
+if not matches:
+    if search:
+        st.warning("Adresse introuvable.")
+    else:
+        st.info("Saisissez une adresse pour voir les ventes à proximité.")
+    con.close()
+    st.stop()
+
+labels = {i: m["label"] for i, m in enumerate(matches)}
+place = matches[st.selectbox("Résultat", list(labels), format_func=labels.get)]
+
+# ── Filters ──────────────────────────────────────────────────────────────────
+
+col1, col2, col3 = st.columns(3)
+
+with col1:
+    radius = st.select_slider(
+        "Rayon", [100, 200, 300, 500, 750, 1000, 1500, 2000], value=500,
+        format_func=lambda r: f"{r} m",
+    )
+
+with col2:
+    types = queries.list_types_local(con)
+    selected_type = st.selectbox("Type de bien", ["Tous"] + types)
+
+with col3:
+    years = queries.list_annees(con)
+    selected_year = st.selectbox("Depuis", ["Toutes"] + years)
+
+# ── Query ────────────────────────────────────────────────────────────────────
+
+df = queries.sales_near(
+    con,
+    place["latitude"],
+    place["longitude"],
+    radius,
+    type_local=None if selected_type == "Tous" else selected_type,
+    annee_min=None if selected_year == "Toutes" else selected_year,
+)
+con.close()
+
+if df.empty:
+    st.warning(f"Aucune vente à moins de {radius} m pour les filtres sélectionnés.")
+    st.stop()
+
+# ── Key metrics ──────────────────────────────────────────────────────────────
+
+col1, col2, col3 = st.columns(3)
+col1.metric("Ventes", f"{len(df):,}".replace(",", " "))
+col2.metric("Prix médian", f"{df['prix_m2'].median():,.0f} €/m²".replace(",", " "))
+col3.metric("Surface médiane", f"{df['surface_reelle_bati'].median():.0f} m²")
+if len(df) == queries.MAX_NEARBY_SALES:
+    st.caption(f"Seules les {queries.MAX_NEARBY_SALES} ventes les plus proches sont affichées.")
+
+# ── Map ──────────────────────────────────────────────────────────────────────
+
+# Points coloured from green (cheapest 5 %) to red (dearest 5 %); unpriced sales in between
+lo, hi = df["prix_m2"].quantile([0.05, 0.95])
+t = ((df["prix_m2"] - lo) / max(hi - lo, 1)).clip(0, 1).fillna(0.5)
+df["r"], df["g"] = (255 * t).astype(int), (200 * (1 - t)).astype(int)
+df["date"] = df["date_mutation"].astype(str)
+df = df.round({"distance_m": 0, "prix_m2": 0})
+
+sales = pdk.Layer(
+    "ScatterplotLayer",
+    data=df,
+    get_position=["longitude", "latitude"],
+    get_fill_color=["r", "g", 80, 180],
+    get_radius=8,
+    radius_min_pixels=3,
+    pickable=True,
+)
+center = pdk.Layer(
+    "ScatterplotLayer",
+    data=[place],
+    get_position=["longitude", "latitude"],
+    get_fill_color=[30, 90, 200, 255],
+    get_radius=12,
+    radius_min_pixels=6,
+)
+circle = pdk.Layer(
+    "ScatterplotLayer",
+    data=[place],
+    get_position=["longitude", "latitude"],
+    get_radius=radius,
+    filled=False,
+    stroked=True,
+    get_line_color=[30, 90, 200, 200],
+    line_width_min_pixels=2,
+)
+
+zoom = 16 if radius <= 300 else 15 if radius <= 750 else 14
+view = pdk.ViewState(latitude=place["latitude"], longitude=place["longitude"], zoom=zoom, pitch=0)
+
+tooltip = {
+    "html": (
+        "{type_local} · {surface_reelle_bati} m² · {nombre_pieces} p.<br>"
+        "{valeur_fonciere} € ({prix_m2} €/m²)<br>"
+        "{date} · à {distance_m} m"
+    ),
+    "style": {"backgroundColor": "#333", "color": "white"},
+}
+
+st.pydeck_chart(
+    pdk.Deck(layers=[circle, sales, center], initial_view_state=view, tooltip=tooltip)
+)
+
+# ── Table ────────────────────────────────────────────────────────────────────
+
+st.subheader("Ventes les plus proches")
+table = df[[
+    "distance_m", "date_mutation", "type_local", "surface_reelle_bati", "nombre_pieces",
+    "valeur_fonciere", "prix_m2", "nom_commune",
+]]
+table.columns = [
+    "Distance (m)", "Date", "Type", "Surface (m²)", "Pièces", "Prix (€)", "Prix €/m²", "Commune",
+]
+st.dataframe(table, use_container_width=True, hide_index=True)
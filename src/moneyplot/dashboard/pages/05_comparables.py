@@ -0,0 +1,128 @@
+"""Page 5 — Ventes comparables à un bien."""
+
+from datetime import date
+
+import httpx
+import pydeck as pdk
+import streamlit as st
+
+from moneyplot.dashboard.debug import query_panel
+from moneyplot.ingestion.ban import geocode
+from moneyplot.storage import queries
+from moneyplot.storage.db import get_read_connection
+from moneyplot.transform.comparables import DEFAULT_K, TYPES, find_comparables
+
+st.set_page_config(page_title="Ventes comparables", layout="wide")
+st.title("Ventes comparables")
+st.caption(
+    "Les ventes les plus proches du bien par la localisation, la surface, "
+    "le nombre de pièces et la date."
+)
+
+try:
+    con = get_read_connection()
+except Exception:
+    st.error("Base de données non disponible. Lancez le pipeline Dagster.")
+    st.stop()
+
+query_panel()
+
+# ── Property ─────────────────────────────────────────────────────────────────
+
+search = st.text_input("Adresse du bien", placeholder="ex. « 20 avenue de Ségur Paris »")
+try:
+    matches = geocode(search) if search else []
+except httpx.HTTPError:
+    st.error("Le service de géocodage (Base Adresse Nationale) ne répond pas.")
+    st.stop()
+
+if not matches:
+    if search:
+        st.warning("Adresse introuvable.")
+    else:
+        st.info("Saisissez l'adresse du bien pour trouver les ventes comparables.")
+    con.close()
+    st.stop()
+
+labels = {i: m["label"] for i, m in enumerate(matches)}
+place = matches[st.selectbox("Résultat", list(labels), format_func=labels.get)]
+
+col1, col2, col3, col4, col5 = st.columns(5)
+type_local = col1.selectbox("Type de bien", list(TYPES))
+surface = col2.number_input("Surface (m²)", min_value=9, max_value=1000, value=60)
+pieces = col3.number_input("Pièces", min_value=1, max_value=20, value=3)
+on = col4.date_input("Date", value=date.today())
+k = col5.select_slider("Ventes", [5, 10, 20, 50], value=DEFAULT_K)
+
+# ── Search ───────────────────────────────────────────────────────────────────
+
+df = find_comparables(
+    place["latitude"], place["longitude"], surface, pieces, type_local, on=on, k=k
+)
+
+if df.empty:
+    con.close()
+    st.warning("Aucune vente indexée. Lancez l'asset « comparables » du pipeline Dagster.")
+    st.stop()
+
+names = queries.commune_names(con, df["code_commune"].unique().tolist())
+con.close()
+df = df.merge(names[["code_commune", "nom_commune"]], on="code_commune", how="left")
+
+# ── Estimate ─────────────────────────────────────────────────────────────────
+
+median_m2 = df["prix_m2"].median()
+col1, col2, col3 = st.columns(3)
+col1.metric("Prix médian des comparables", f"{median_m2:,.0f} €/m²".replace(",", " "))
+col2.metric("Estimation", f"{median_m2 * surface:,.0f} €".replace(",", " "))
+col3.metric("Distance médiane", f"{df['distance_m'].median():,.0f} m".replace(",", " "))
+
+# ── Map ──────────────────────────────────────────────────────────────────────
+
+df["date"] = df["date_mutation"].astype(str)
+df = df.round({"distance_m": 0, "prix_m2": 0, "ecart": 2})
+
+sales = pdk.Layer(
+    "ScatterplotLayer",
+    data=df,
+    get_position=["longitude", "latitude"],
+    get_fill_color=[220, 120, 30, 200],
+    get_radius=10,
+    radius_min_pixels=4,
+    pickable=True,
+)
+center = pdk.Layer(
+    "ScatterplotLayer",
+    data=[place],
+    get_position=["longitude", "latitude"],
+    get_fill_color=[30, 90, 200, 255],
+    get_radius=12,
+    radius_min_pixels=6,
+)
+
+farthest = df["distance_m"].max()
+zoom = 16 if farthest <= 300 else 15 if farthest <= 750 else 14 if farthest <= 2000 else 12
+view = pdk.ViewState(latitude=place["latitude"], longitude=place["longitude"], zoom=zoom, pitch=0)
+
+tooltip = {
+    "html": (
+        "{surface_reelle_bati} m² · {nombre_pieces} p. · {nom_commune}<br>"
+        "{valeur_fonciere} € ({prix_m2} €/m²)<br>"
+        "{date} · à {distance_m} m"
+    ),
+    "style": {"backgroundColor": "#333", "color": "white"},
+}
+
+st.pydeck_chart(pdk.Deck(layers=[sales, center], initial_view_state=view, tooltip=tooltip))
+
+# ── Table ────────────────────────────────────────────────────────────────────
+
+st.subheader("Ventes les plus comparables")
+table = df[[
+    "ecart", "distance_m", "date_mutation", "surface_reelle_bati", "nombre_pieces",
+    "valeur_fonciere", "prix_m2", "nom_commune",
+]]
+table.columns = [
+    "Écart", "Distance (m)", "Date", "Surface (m²)", "Pièces", "Prix (€)", "Prix €/m²", "Commune",
+]
+st.dataframe(table, use_container_width=True, hide_index=True)
@@ -0,0 +1,48 @@
+"""Geocode French addresses with the Base Adresse Nationale (BAN) API."""
+
+import logging
+from contextlib import nullcontext
+
+import httpx
+
+from moneyplot.ingestion import http
+
+logger = logging.getLogger(__name__)
+
+BAN_API_URL = "https://api-adresse.data.gouv.fr/search/"
+
+# Shortest query the API accepts
+MIN_QUERY_LENGTH = 3
+
+
+def geocode(query: str, limit: int = 5, client: httpx.Client | None = None) -> list[dict]:
+    """Return the best matches of a free-text address, best first.
+
+    Each match has: label, latitude, longitude, score, code_commune, type
+    (housenumber, street, locality or municipality). Responses go through the
+    shared HTTP cache, so repeating a search costs no request.
+    """
+    query = " ".join(query.split())
+    if len(query) < MIN_QUERY_LENGTH:
+        return []
+
+    with nullcontext(client) if client is not None else http.make_client(timeout=10) as c:
+        resp = c.get(BAN_API_URL, params={"q": query, "limit": limit})
+    resp.raise_for_status()
+
+    matches = []
+    for feature in resp.json().get("features", []):
+        props = feature.get("properties", {})
+        coordinates = (feature.get("geometry") or {}).get("coordinates") or []
+        if len(coordinates) != 2:
+            continue
+        matches.append({
+            "label": props.get("label"),
+            "latitude": coordinates[1],
+            "longitude": coordinates[0],
+            "score": props.get("score"),
+            "code_commune": props.get("citycode"),
+            "type": props.get("type"),
+        })
+    logger.info("BAN: %d matches for %r", len(matches), query)
+    return matches
@@ -1,147 +1,415 @@
 """Fetch DPE (Diagnostic de Performance Énergétique) data from ADEME API."""
 
 import logging
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from datetime import date
+from pathlib import Path
 
+import duckdb
 import httpx
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from moneyplot.ingestion import http
+from moneyplot.ingestion.dvf import ALL_DEPTS
 
 logger = logging.getLogger(__name__)
 
 ADEME_API_URL = "https://data.ademe.fr/data-fair/api/v1/datasets/dpe-v2-logements-existants/lines"
+RAW_DIR = Path(__file__).resolve().parents[3] / "data" / "raw" / "dpe"
 
+# Diagnostics fetched by the incremental sync, one file per department
+INCREMENTS_DIR = RAW_DIR / "increments"
 
-def fetch_dpe_for_commune(code_commune: str, limit: int = 10000) -> pd.DataFrame:
-    """Fetch DPE records for a single commune.
+# Largest page the data-fair API serves
+PAGE_SIZE = 10_000
 
-    Returns a DataFrame with columns matching the dpe table schema.
-    """
-    logger.info("Fetching DPE for commune %s", code_commune)
+# Departments harvested in parallel by harvest_dpe
+DEFAULT_CONCURRENCY = 4
 
-    rows = []
-    offset = 0
-    page_size = min(limit, 1000)
-
-    while offset < limit:
-        resp = httpx.get(
-            ADEME_API_URL,
-            params={
-                "q_fields": "code_insee_commune_actualise",
-                "q": code_commune,
-                "size": page_size,
-                "after": offset,
-                "select": (
-                    "identifiant_dpe,"
-                    "code_insee_commune_actualise,"
-                    "identifiant_ban,"
-                    "classe_consommation_energie,"
-                    "classe_estimation_ges,"
-                    "annee_construction,"
-                    "surface_habitable_logement,"
-                    "date_etablissement_dpe"
-                ),
-            },
-            timeout=30,
-        )
+# Rows buffered before a Parquet row group is written
+BATCH_ROWS = 50_000
+
+# API field → dpe column
+API_FIELDS = {
+    "identifiant_dpe": "id_dpe",
+    "code_insee_commune_actualise": "code_commune",
+    "classe_consommation_energie": "classe_energie",
+    "classe_estimation_ges": "classe_ges",
+    "annee_construction": "annee_construction",
+    "surface_habitable_logement": "surface_habitable",
+    "date_etablissement_dpe": "date_etablissement",
+}
+SELECT_FIELDS = ",".join(API_FIELDS)
+
+# Construction years kept; others (typos, 99999999999) are null
+CONSTRUCTION_YEARS = (1000, 2100)
+
+# Plain decimal number, as sent in string-typed API fields
+_NUMBER_PATTERN = r"^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$"
+
+# Arrow schema of harvested files, matching the dpe table
+DPE_SCHEMA = pa.schema([
+    ("id_dpe", pa.string()),
+    ("code_commune", pa.string()),
+    ("id_parcelle", pa.string()),
+    ("classe_energie", pa.string()),
+    ("classe_ges", pa.string()),
+    ("annee_construction", pa.int32()),
+    ("surface_habitable", pa.float64()),
+    ("date_etablissement", pa.date32()),
+])
+
+
+def make_client(max_concurrency: int = DEFAULT_CONCURRENCY) -> httpx.Client:
+    """Return an HTTP client whose connection pool is sized for parallel harvests."""
+    return http.make_client(max_concurrency, timeout=60)
+
+
+def iter_dpe_pages(client: httpx.Client, params: dict) -> Iterator[list[dict]]:
+    """Yield the result pages of a DPE query, following the API's ``next`` cursor."""
+    url, query = ADEME_API_URL, {"size": PAGE_SIZE, "select": SELECT_FIELDS, **params}
+    while url:
+        resp = client.get(url, params=query)
         resp.raise_for_status()
         data = resp.json()
         results = data.get("results", [])
-
         if not results:
             break
+        yield results
+        # The next link already carries the query and the opaque `after` cursor
+        url, query = data.get("next"), None
 
-        for r in results:
-            rows.append({
-                "id_dpe": r.get("identifiant_dpe"),
-                "code_commune": r.get("code_insee_commune_actualise"),
-                "id_parcelle": None,  # Not directly available, needs geocoding
-                "classe_energie": r.get("classe_consommation_energie"),
-                "classe_ges": r.get("classe_estimation_ges"),
-                "annee_construction": _safe_int(r.get("annee_construction")),
-                "surface_habitable": _safe_float(r.get("surface_habitable_logement")),
-                "date_etablissement": r.get("date_etablissement_dpe"),
-            })
-
-        offset += len(results)
-        if len(results) < page_size:
-            break
 
-    df = pd.DataFrame(rows)
-    if not df.empty and "date_etablissement" in df.columns:
-        df["date_etablissement"] = pd.to_datetime(df["date_etablissement"], errors="coerce")
+def fetch_dpe_for_commune(
+    code_commune: str, limit: int = 10000, client: httpx.Client | None = None
+) -> pd.DataFrame:
+    """Fetch DPE records for a single commune.
+
+    Returns a DataFrame with columns matching the dpe table schema.
+    """
+    logger.info("Fetching DPE for commune %s", code_commune)
+
+    params = {"q_fields": "code_insee_commune_actualise", "q": code_commune}
+    tables, total = [], 0
+    with _client_scope(client) as c:
+        for results in iter_dpe_pages(c, {**params, "size": min(limit, PAGE_SIZE)}):
+            tables.append(_decode_page(results[: limit - total]))
+            total += tables[-1].num_rows
+            if total >= limit:
+                break
+
+    df = _concat(tables)
     logger.info("Fetched %d DPE records for commune %s", len(df), code_commune)
     return df
 
 
-def fetch_dpe_for_department(code_dept: str, limit_per_commune: int = 10000) -> pd.DataFrame:
+def fetch_dpe_for_department(code_dept: str, client: httpx.Client | None = None) -> pd.DataFrame:
     """Fetch DPE data for all communes in a department.
 
-    This queries by department code prefix.
+    This queries by department code prefix. The whole department is held in
+    memory; use ``harvest_dpe_department`` to stream it to Parquet instead.
     """
     logger.info("Fetching DPE for department %s", code_dept)
 
-    rows = []
-    offset = 0
-    page_size = 1000
-    total_limit = 100_000
-
-    while offset < total_limit:
-        resp = httpx.get(
-            ADEME_API_URL,
-            params={
-                "qs": f"code_insee_commune_actualise:{code_dept}*",
-                "size": page_size,
-                "after": offset,
-                "select": (
-                    "identifiant_dpe,"
-                    "code_insee_commune_actualise,"
-                    "classe_consommation_energie,"
-                    "classe_estimation_ges,"
-                    "annee_construction,"
-                    "surface_habitable_logement,"
-                    "date_etablissement_dpe"
+    with _client_scope(client) as c:
+        tables = [_decode_page(r) for r in iter_dpe_pages(c, _department_query(code_dept))]
+
+    df = _concat(tables)
+    logger.info("Fetched %d DPE records for department %s", len(df), code_dept)
+    return df
+
+
+def harvest_dpe_department(
+    code_dept: str,
+    output_dir: Path | None = None,
+    client: httpx.Client | None = None,
+    since: date | None = None,
+) -> tuple[Path, int]:
+    """Stream the DPE records of a department to ``dpe_{code_dept}.parquet``.
+
+    Pages are decoded as they arrive and flushed every ``BATCH_ROWS`` rows, so
+    memory stays flat however large the department is. The file is written to
+    a ``.part`` file and renamed once complete. With ``since``, only diagnostics
+    established on or after that date are fetched.
+    Returns the output path and the number of records written.
+    """
+    out = (output_dir or RAW_DIR) / f"dpe_{code_dept}.parquet"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(out.name + ".part")
+    logger.info("Harvesting DPE for department %s%s", code_dept, f" since {since}" if since else "")
+
+    total, batch = 0, []
+    try:
+        with _client_scope(client) as c, pq.ParquetWriter(tmp, DPE_SCHEMA, compression="zstd") as w:
+            for results in iter_dpe_pages(c, _department_query(code_dept, since)):
+                batch.append(_decode_page(results))
+                if sum(t.num_rows for t in batch) >= BATCH_ROWS:
+                    total += _write_batch(w, batch)
+                    batch = []
+            total += _write_batch(w, batch)
+        tmp.replace(out)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+    logger.info("Harvested %d DPE records for department %s", total, code_dept)
+    return out, total
+
+
+def harvest_dpe(
+    departments: list[str],
+    output_dir: Path | None = None,
+    max_concurrency: int = DEFAULT_CONCURRENCY,
+    since: dict[str, date] | None = None,
+) -> dict[str, Path]:
+    """Harvest several departments in parallel over one pooled HTTP client.
+
+    ``since`` maps departments to the date from which to fetch (see
+    ``harvest_dpe_department``); departments absent from it are fetched in full.
+    Returns the Parquet file of every department harvested successfully.
+    """
+    since = since or {}
+    workers = max(1, max_concurrency)
+    paths = {}
+    with (
+        make_client(workers) as client,
+        ThreadPoolExecutor(max_workers=workers) as pool,
+        tqdm(total=len(departments), unit="dept", desc="DPE") as pbar,
+    ):
+        futures = {
+            pool.submit(harvest_dpe_department, dept, output_dir, client, since.get(dept)): dept
+            for dept in departments
+        }
+        for future in as_completed(futures):
+            dept = futures[future]
+            pbar.update(1)
+            try:
+                paths[dept], _ = future.result()
+            except httpx.HTTPError as exc:
+                logger.warning("Failed to harvest DPE for department %s: %s", dept, exc)
+    return paths
+
+
+@dataclass
+class SyncStats:
+    """Outcome of an incremental DPE sync."""
+
+    fetched: int = 0
+    inserted: int = 0
+    updated: int = 0
+    row_count: int = 0
+    failed: list[str] = field(default_factory=list)
+
+
+def read_watermarks(con: duckdb.DuckDBPyConnection) -> dict[str, date]:
+    """Return the latest ``date_etablissement`` synced for each department."""
+    rows = con.execute("""
+        SELECT code_departement, last_date_etablissement
+        FROM dpe_sync_state
+        WHERE last_date_etablissement IS NOT NULL
+    """).fetchall()
+    return dict(rows)
+
+
+def sync_dpe(
+    con: duckdb.DuckDBPyConnection,
+    departments: list[str] | None = None,
+    output_dir: Path | None = None,
+    max_concurrency: int = DEFAULT_CONCURRENCY,
+) -> SyncStats:
+    """Fetch the diagnostics published since the last sync and merge them into ``dpe``.
+
+    Each department is queried from its high watermark on (inclusive, so late
+    diagnostics of that day are not missed); departments never synced are
+    harvested in full. A department whose harvest fails keeps its watermark
+    and is retried in full from it on the next sync.
+    """
+    depts = departments or ALL_DEPTS
+    out = output_dir or INCREMENTS_DIR
+    watermarks = read_watermarks(con)
+    paths = harvest_dpe(depts, out, max_concurrency, since=watermarks)
+
+    stats = SyncStats(failed=sorted(set(depts) - set(paths)))
+    for dept in sorted(paths):
+        fetched, inserted, updated = load_dpe_increment(con, dept, paths[dept])
+        stats.fetched += fetched
+        stats.inserted += inserted
+        stats.updated += updated
+    stats.row_count = con.execute("SELECT count(*) FROM dpe").fetchone()[0]
+    logger.info(
+        "DPE sync: %d fetched, %d inserted, %d updated, %d departments failed",
+        stats.fetched, stats.inserted, stats.updated, len(stats.failed),
+    )
+    return stats
+
+
+def load_dpe_increment(
+    con: duckdb.DuckDBPyConnection, code_dept: str, path: Path
+) -> tuple[int, int, int]:
+    """Upsert one department's harvested file into ``dpe`` and advance its watermark.
+
+    Rows are deduplicated on ``id_dpe``: known diagnostics are replaced only if
+    they changed, so the overlap refetched at the watermark date costs nothing.
+    Runs in one transaction. Returns the (fetched, inserted, updated) counts.
+    """
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute("""
+            CREATE OR REPLACE TEMP TABLE _dpe_staged AS
+            SELECT DISTINCT ON (id_dpe) *
+            FROM read_parquet(?)
+            WHERE id_dpe IS NOT NULL
+            ORDER BY id_dpe, date_etablissement DESC
+        """, [str(path)])
+        # Staged rows not already in the table as-is (new or revised diagnostics)
+        con.execute("""
+            CREATE OR REPLACE TEMP TABLE _dpe_changed AS
+            SELECT * FROM _dpe_staged
+            EXCEPT
+            SELECT d.* FROM dpe d SEMI JOIN _dpe_staged s USING (id_dpe)
+        """)
+        fetched = con.execute("SELECT count(*) FROM _dpe_staged").fetchone()[0]
+        changed, updated = con.execute("""
+            SELECT count(*), count(*) FILTER (WHERE id_dpe IN (SELECT id_dpe FROM dpe))
+            FROM _dpe_changed
+        """).fetchone()
+
+        con.execute("DELETE FROM dpe USING _dpe_changed c WHERE dpe.id_dpe = c.id_dpe")
+        con.execute("INSERT INTO dpe SELECT * FROM _dpe_changed")
+        # Future dates are data errors: they would stall the watermark
+        con.execute("""
+            INSERT INTO dpe_sync_state
+            SELECT ?, max(date_etablissement), now()
+            FROM _dpe_staged
+            WHERE date_etablissement <= current_date
+            ON CONFLICT (code_departement) DO UPDATE SET
+                last_date_etablissement = greatest(
+                    dpe_sync_state.last_date_etablissement,
+                    excluded.last_date_etablissement
                 ),
-            },
-            timeout=60,
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        results = data.get("results", [])
+                synced_at = excluded.synced_at
+        """, [code_dept])
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        for table in ("_dpe_staged", "_dpe_changed"):
+            con.execute(f"DROP TABLE IF EXISTS {table}")
 
-        if not results:
-            break
+    logger.info(
+        "DPE %s: %d fetched, %d inserted, %d updated",
+        code_dept, fetched, changed - updated, updated,
+    )
+    return fetched, changed - updated, updated
 
-        for r in results:
-            rows.append({
-                "id_dpe": r.get("identifiant_dpe"),
-                "code_commune": r.get("code_insee_commune_actualise"),
-                "id_parcelle": None,
-                "classe_energie": r.get("classe_consommation_energie"),
-                "classe_ges": r.get("classe_estimation_ges"),
-                "annee_construction": _safe_int(r.get("annee_construction")),
-                "surface_habitable": _safe_float(r.get("surface_habitable_logement")),
-                "date_etablissement": r.get("date_etablissement_dpe"),
-            })
-
-        offset += len(results)
-        if len(results) < page_size:
-            break
 
-    df = pd.DataFrame(rows)
-    if not df.empty and "date_etablissement" in df.columns:
-        df["date_etablissement"] = pd.to_datetime(df["date_etablissement"], errors="coerce")
-    logger.info("Fetched %d DPE records for department %s", len(df), code_dept)
-    return df
+def _department_query(code_dept: str, since: date | None = None) -> dict:
+    qs = f"code_insee_commune_actualise:{code_dept}*"
+    if since is not None:
+        qs += f" AND date_etablissement_dpe:[{since.isoformat()} TO *]"
+    return {"qs": qs}
+
+
+def _client_scope(client: httpx.Client | None):
+    """Use ``client`` as-is, or a fresh client closed on exit."""
+    return nullcontext(client) if client is not None else make_client(max_concurrency=1)
+
+
+def _decode_page(results: list[dict]) -> pa.Table:
+    """Decode one page of API records into a ``DPE_SCHEMA`` table, column by column.
+
+    Arrow builds each field's column from the records, inferring its type.
+    Fields arrive as JSON strings or numbers (or junk such as "inconnu"): each
+    column is then cast with Arrow kernels, values that do not parse becoming
+    null. Only a field mixing strings and numbers on a page, or missing from
+    its first record, is gathered in Python (see ``_mixed_column``).
+    """
+    try:
+        table = pa.Table.from_pylist(results)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Some field mixes strings and numbers on this page
+        table = pa.table({})
+    col = {
+        f: (
+            table.column(f)
+            if f in table.column_names
+            else _mixed_column([r.get(f) for r in results])
+        )
+        for f in API_FIELDS
+    }
+    arrays = [
+        _as_strings(col["identifiant_dpe"]),
+        _as_strings(col["code_insee_commune_actualise"]),
+        pa.nulls(len(results), pa.string()),  # id_parcelle: needs geocoding
+        _as_strings(col["classe_consommation_energie"]),
+        _as_strings(col["classe_estimation_ges"]),
+        _parse_year(col["annee_construction"]),
+        _parse_number(col["surface_habitable_logement"]),
+        _parse_date(col["date_etablissement_dpe"]),
+    ]
+    return pa.Table.from_arrays(arrays, schema=DPE_SCHEMA)
 
 
-def _safe_int(val) -> int | None:
+def _mixed_column(values: list) -> pa.Array:
+    """Build a column whose values may mix types; mixed values are stringified."""
     try:
-        return int(val) if val is not None else None
-    except (ValueError, TypeError):
-        return None
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if v is None else str(v) for v in values], pa.string())
 
 
-def _safe_float(val) -> float | None:
+def _parse_date(values: pa.Array) -> pa.Date32Array:
+    """Parse ISO dates (a time part is ignored); malformed or impossible dates are null."""
+    strings = pc.utf8_slice_codeunits(_as_strings(values), 0, 10)
+    strings = pc.if_else(pc.match_substring_regex(strings, r"^\d{4}-\d{2}-\d{2}$"), strings, None)
+    parsed = pc.strptime(strings, "%Y-%m-%d", "s", error_is_null=True)
+    # strptime rolls impossible dates over (2024-02-30 → 03-01): the day must survive parsing
+    exact = pc.equal(pc.day(parsed), pc.cast(pc.utf8_slice_codeunits(strings, 8, 10), pa.int64()))
+    return pc.cast(pc.if_else(exact, parsed, None), pa.date32())
+
+
+def _parse_year(values: pa.Array) -> pa.Int32Array:
+    """Parse years (decimals truncated); years outside ``CONSTRUCTION_YEARS`` are null."""
+    years = pc.trunc(_parse_number(values))
+    lo, hi = CONSTRUCTION_YEARS
+    plausible = pc.and_(pc.greater_equal(years, lo), pc.less_equal(years, hi))
+    # Masked first, so that the int32 cast can never overflow
+    return pc.cast(pc.if_else(plausible, years, None), pa.int32())
+
+
+def _parse_number(values: pa.Array) -> pa.DoubleArray:
+    """Parse numbers sent either as JSON numbers or as strings; anything else is null."""
+    if pa.types.is_integer(values.type) or pa.types.is_floating(values.type):
+        return pc.cast(values, pa.float64())
+    strings = pc.utf8_trim_whitespace(_as_strings(values))
+    valid = pc.match_substring_regex(strings, _NUMBER_PATTERN)
+    return pc.cast(pc.if_else(valid, strings, None), pa.float64())
+
+
+def _as_strings(values: pa.Array) -> pa.StringArray:
+    """Cast a column to strings in Arrow; values of other types (lists, structs) are null."""
     try:
-        return float(val) if val is not None else None
-    except (ValueError, TypeError):
-        return None
+        return pc.cast(values, pa.string())
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return pa.nulls(len(values), pa.string())
+
+
+def _concat(tables: list[pa.Table]) -> pd.DataFrame:
+    table = pa.concat_tables(tables) if tables else DPE_SCHEMA.empty_table()
+    return table.to_pandas(date_as_object=False)
+
+
+def _write_batch(writer: pq.ParquetWriter, tables: list[pa.Table]) -> int:
+    if not tables:
+        return 0
+    table = pa.concat_tables(tables)
+    writer.write_table(table)
+    return table.num_rows
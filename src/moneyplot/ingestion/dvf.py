@@ -1,11 +1,16 @@
 """Download DVF (Demandes de Valeurs Foncières) data from Etalab."""
 
+import json
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from pathlib import Path
 
 import httpx
 from tqdm import tqdm
 
+from moneyplot.ingestion import http
+
 logger = logging.getLogger(__name__)
 
 BASE_URL = "https://files.data.gouv.fr/geo-dvf/latest/csv"
@@ -23,49 +28,207 @@ ALL_DEPTS = (
     + [f"{i}" for i in range(971, 975)]  # DOM: 971-974 (not 976)
 )
 
+# Number of files downloaded in parallel by download_all
+DEFAULT_CONCURRENCY = 8
+
+# Per-file ETag / Last-Modified / size of the last successful download, one JSON
+# file per department so that concurrent department refreshes never race
+MANIFEST_DIR = "manifest"
+
+# Download outcomes, as reported by DownloadResult.status
+STATUS_NEW = "new"
+STATUS_UPDATED = "updated"
+STATUS_UNCHANGED = "unchanged"
+
+
+@dataclass
+class DownloadResult:
+    """Outcome of a (conditional) download of one DVF file."""
+
+    path: Path
+    status: str
+    etag: str | None = None
+    last_modified: str | None = None
+    size: int = 0
+
+    def manifest_entry(self) -> dict:
+        return {"etag": self.etag, "last_modified": self.last_modified, "size": self.size}
+
+
+def _manifest_dept(file_name: str) -> str:
+    """Department code of a ``dvf_{year}_{dept}.csv.gz`` file name."""
+    return file_name.removesuffix(".csv.gz").split("_")[2]
+
+
+def load_manifest(
+    output_dir: Path | None = None, departments: list[str] | None = None
+) -> dict[str, dict]:
+    """Return the download manifest keyed by file name (empty if none yet)."""
+    manifest_dir = (output_dir or RAW_DIR) / MANIFEST_DIR
+    paths = (
+        [manifest_dir / f"{dept}.json" for dept in departments]
+        if departments
+        else sorted(manifest_dir.glob("*.json"))
+    )
+    manifest = {}
+    for path in paths:
+        if path.exists():
+            manifest.update(json.loads(path.read_text()))
+    return manifest
+
+
+def save_manifest(manifest: dict[str, dict], output_dir: Path | None = None) -> None:
+    """Atomically write the manifest files of the departments present in ``manifest``."""
+    manifest_dir = (output_dir or RAW_DIR) / MANIFEST_DIR
+    manifest_dir.mkdir(parents=True, exist_ok=True)
+
+    by_dept: dict[str, dict[str, dict]] = {}
+    for name, entry in manifest.items():
+        by_dept.setdefault(_manifest_dept(name), {})[name] = entry
+
+    for dept, entries in by_dept.items():
+        path = manifest_dir / f"{dept}.json"
+        tmp = path.with_name(path.name + ".part")
+        tmp.write_text(json.dumps(entries, indent=2, sort_keys=True))
+        tmp.replace(path)
+
+
+def make_client(max_concurrency: int = DEFAULT_CONCURRENCY) -> httpx.Client:
+    """Return an HTTP client whose connection pool is sized for parallel downloads."""
+    return http.make_client(max_concurrency, timeout=120, follow_redirects=True)
+
 
 def download_department_year(
-    dept: str, year: str, output_dir: Path | None = None
-) -> Path:
+    dept: str,
+    year: str,
+    output_dir: Path | None = None,
+    client: httpx.Client | None = None,
+    show_progress: bool = True,
+    previous: dict | None = None,
+) -> DownloadResult:
     """Download the DVF CSV for a single department and year.
 
     URL pattern: {BASE_URL}/{year}/departements/{dept}.csv.gz
-    Returns the path to the downloaded file.
+    When ``previous`` holds the manifest entry of the local copy, the request is
+    conditional (If-None-Match / If-Modified-Since) and a 304 leaves the file
+    untouched. The body is streamed to a temporary ``.part`` file and renamed
+    once complete, so an interrupted download never leaves a truncated CSV.
     """
     out = (output_dir or RAW_DIR) / f"dvf_{year}_{dept}.csv.gz"
     out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(out.name + ".part")
 
     url = f"{BASE_URL}/{year}/departements/{dept}.csv.gz"
-    logger.info("Downloading DVF %s dept %s from %s", year, dept, url)
 
-    with httpx.stream("GET", url, follow_redirects=True, timeout=120) as resp:
-        resp.raise_for_status()
-        total = int(resp.headers.get("content-length", 0))
-        with open(out, "wb") as f, tqdm(
-            total=total, unit="B", unit_scale=True, desc=f"DVF {year}/{dept}", disable=total == 0
-        ) as pbar:
-            for chunk in resp.iter_bytes(chunk_size=65_536):
-                f.write(chunk)
-                pbar.update(len(chunk))
+    existed = out.exists()
+    # The CSV itself is the local copy: keep it out of the HTTP response cache
+    headers = {"Cache-Control": "no-store"}
+    if previous and existed:
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+
+    owns_client = client is None
+    if owns_client:
+        client = make_client(max_concurrency=1)
 
-    logger.info("Saved %s (%d bytes)", out, out.stat().st_size)
-    return out
+    try:
+        with client.stream("GET", url, headers=headers) as resp:
+            if resp.status_code == httpx.codes.NOT_MODIFIED:
+                logger.info("DVF %s dept %s unchanged", year, dept)
+                return DownloadResult(out, STATUS_UNCHANGED, **previous)
+            resp.raise_for_status()
+            logger.info("Downloading DVF %s dept %s from %s", year, dept, url)
+            etag = resp.headers.get("etag")
+            last_modified = resp.headers.get("last-modified")
+            total = int(resp.headers.get("content-length", 0))
+            with open(tmp, "wb") as f, tqdm(
+                total=total,
+                unit="B",
+                unit_scale=True,
+                desc=f"DVF {year}/{dept}",
+                disable=total == 0 or not show_progress,
+            ) as pbar:
+                for chunk in resp.iter_bytes(chunk_size=65_536):
+                    f.write(chunk)
+                    pbar.update(len(chunk))
+        tmp.replace(out)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    finally:
+        if owns_client:
+            client.close()
+
+    size = out.stat().st_size
+    logger.info("Saved %s (%d bytes)", out, size)
+
+    if not existed:
+        status = STATUS_NEW
+    elif previous and etag and etag == previous.get("etag") and size == previous.get("size"):
+        # Server ignored the conditional request but served the same content
+        status = STATUS_UNCHANGED
+    else:
+        status = STATUS_UPDATED
+    return DownloadResult(out, status, etag, last_modified, size)
 
 
 def download_all(
     departments: list[str] | None = None,
     years: list[str] | None = None,
     output_dir: Path | None = None,
-) -> list[Path]:
-    """Download DVF CSVs for all (or selected) departments and years."""
+    max_concurrency: int = DEFAULT_CONCURRENCY,
+) -> list[DownloadResult]:
+    """Refresh DVF CSVs for all (or selected) departments and years.
+
+    Files are fetched by a pool of ``max_concurrency`` threads sharing a single
+    pooled HTTP client, with one aggregate progress bar over all files. Requests
+    are conditional on the local manifest, so files Etalab has not republished
+    are reported as unchanged without being downloaded again.
+    """
     depts = departments or ALL_DEPTS
     yrs = years or YEARS
-    paths = []
-    for year in yrs:
-        for dept in depts:
-            try:
-                p = download_department_year(dept, year, output_dir)
-                paths.append(p)
-            except httpx.HTTPStatusError as exc:
-                logger.warning("Failed to download dept %s year %s: %s", dept, year, exc)
-    return paths
+    tasks = [(dept, year) for year in yrs for dept in depts]
+    workers = max(1, max_concurrency)
+    manifest = load_manifest(output_dir, depts)
+
+    results = []
+    try:
+        with (
+            make_client(workers) as client,
+            ThreadPoolExecutor(max_workers=workers) as pool,
+            tqdm(total=len(tasks), unit="file", desc="DVF") as pbar,
+        ):
+            futures = {
+                pool.submit(
+                    download_department_year,
+                    dept,
+                    year,
+                    output_dir,
+                    client,
+                    show_progress=False,
+                    previous=manifest.get(f"dvf_{year}_{dept}.csv.gz"),
+                ): (dept, year)
+                for dept, year in tasks
+            }
+            for future in as_completed(futures):
+                dept, year = futures[future]
+                pbar.update(1)
+                try:
+                    result = future.result()
+                except httpx.HTTPStatusError as exc:
+                    logger.warning("Failed to download dept %s year %s: %s", dept, year, exc)
+                    continue
+                results.append(result)
+                manifest[result.path.name] = result.manifest_entry()
+    finally:
+        save_manifest(manifest, output_dir)
+
+    logger.info(
+        "DVF refresh: %d new, %d updated, %d unchanged",
+        sum(r.status == STATUS_NEW for r in results),
+        sum(r.status == STATUS_UPDATED for r in results),
+        sum(r.status == STATUS_UNCHANGED for r in results),
+    )
+    return sorted(results, key=lambda r: r.path)
@@ -1,48 +1,274 @@
 """Fetch mortgage interest rates from the ECB Statistical Data Warehouse."""
 
 import logging
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from datetime import UTC, date, datetime
+from io import BytesIO
 
+import duckdb
 import httpx
 import pandas as pd
 
+from moneyplot.ingestion import http
+
 logger = logging.getLogger(__name__)
 
-# ECB series for French mortgage rates (new business, house purchase, over 5 years)
-ECB_SERIES_KEY = "M.FR.B.A2C.A.C.A.2250.EUR.N"
-ECB_API_URL = f"https://data-api.ecb.europa.eu/service/data/MIR/{ECB_SERIES_KEY}"
+ECB_API_URL = "https://data-api.ecb.europa.eu/service/data"
+
+# Series keys are qualified by their dataflow ("MIR.M.FR..."), as stored in
+# taux_hypothecaires.serie. Default series: French mortgage rates (new business,
+# house purchase, over 5 years).
+ECB_SERIES_KEY = "MIR.M.FR.B.A2C.A.C.A.2250.EUR.N"
+ECB_SERIES = [ECB_SERIES_KEY]
+
+# Series requested per call: keys of one dataflow are merged into a single
+# SDMX key, each dimension listing its values joined by "+"
+MAX_SERIES_PER_REQUEST = 50
+
+# Months before the last stored period that incremental fetches reach back, so
+# that recent revisions are picked up
+REVISION_MONTHS = 12
+
+COLUMNS = ["date", "taux", "source", "serie"]
+
+
+@dataclass
+class SyncStats:
+    """Outcome of an incremental ECB sync."""
+
+    fetched: int = 0
+    inserted: int = 0
+    updated: int = 0
+    row_count: int = 0
+    failed: list[str] = field(default_factory=list)
+
+
+def fetch_mortgage_rates(
+    series: list[str] | None = None,
+    state: dict[str, tuple[date, datetime]] | None = None,
+    client: httpx.Client | None = None,
+) -> pd.DataFrame:
+    """Fetch monthly mortgage rates from ECB, several series per request.
+
+    ``series`` lists dataflow-qualified keys (``ECB_SERIES`` by default).
+    ``state`` maps series to their last stored period and last sync time: a
+    request whose series are all known only asks for the observations updated
+    since (``updatedAfter``) from ``REVISION_MONTHS`` before the last period on
+    (``startPeriod``); otherwise the full history is fetched.
+    Returns a DataFrame with columns: date, taux, source, serie.
+    """
+    df, _ = _fetch(series or ECB_SERIES, state or {}, client)
+    return df
+
+
+def read_sync_state(con: duckdb.DuckDBPyConnection) -> dict[str, tuple[date, datetime]]:
+    """Return the last stored period and last sync time of each series."""
+    rows = con.execute("""
+        SELECT serie, last_period, synced_at
+        FROM ecb_sync_state
+        WHERE last_period IS NOT NULL
+    """).fetchall()
+    return {serie: (last_period, synced_at) for serie, last_period, synced_at in rows}
 
 
-def fetch_mortgage_rates() -> pd.DataFrame:
-    """Fetch monthly French mortgage rates from ECB.
+def sync_mortgage_rates(
+    con: duckdb.DuckDBPyConnection,
+    series: list[str] | None = None,
+    full_refresh: bool = False,
+    client: httpx.Client | None = None,
+) -> SyncStats:
+    """Fetch the observations ECB added or revised since the last sync and upsert them.
 
-    Returns a DataFrame with columns: date, taux, source.
+    Rows are keyed on (serie, date): only new points are inserted and only
+    points whose value changed are replaced. Series whose request failed keep
+    their sync state and are retried from it on the next run. ``full_refresh``
+    ignores the state and refetches every series' whole history.
     """
-    logger.info("Fetching ECB mortgage rates: %s", ECB_SERIES_KEY)
+    keys = series or ECB_SERIES
+    # Taken before the requests, so that updates published meanwhile are refetched
+    started_at = datetime.now(UTC).replace(tzinfo=None)
+    state = {} if full_refresh else read_sync_state(con)
+    df, fetched_keys = _fetch(keys, state, client)
 
-    resp = httpx.get(
-        ECB_API_URL,
-        params={"format": "csvdata"},
-        headers={"Accept": "text/csv"},
-        timeout=30,
+    stats = SyncStats(fetched=len(df), failed=sorted(set(keys) - set(fetched_keys)))
+    stats.inserted, stats.updated = _upsert(con, df[COLUMNS], fetched_keys, started_at)
+    stats.row_count = con.execute("SELECT count(*) FROM taux_hypothecaires").fetchone()[0]
+    logger.info(
+        "ECB sync: %d fetched, %d inserted, %d updated, %d series failed",
+        stats.fetched, stats.inserted, stats.updated, len(stats.failed),
     )
-    resp.raise_for_status()
+    return stats
+
+
+def _fetch(
+    keys: list[str], state: dict[str, tuple[date, datetime]], client: httpx.Client | None
+) -> tuple[pd.DataFrame, list[str]]:
+    """Fetch ``keys`` batch by batch; return the rows and the keys fetched successfully."""
+    frames, fetched = [], []
+    with _client_scope(client) as c:
+        for flow, batch in _batches(keys):
+            known = [state[k] for k in batch if k in state]
+            start_period = updated_after = None
+            if len(known) == len(batch):
+                start_period = _months_before(min(p for p, _ in known), REVISION_MONTHS)
+                updated_after = min(s for _, s in known)
+            try:
+                frames.append(_fetch_batch(c, flow, batch, start_period, updated_after))
+            except (httpx.HTTPError, ValueError):
+                logger.exception("Failed to fetch ECB series %s", ", ".join(batch))
+                continue
+            fetched.extend(batch)
+
+    df = pd.concat(frames, ignore_index=True) if frames else _empty_frame()
+    logger.info("Fetched %d mortgage rate data points from %d series", len(df), len(fetched))
+    return df, fetched
+
 
-    # Parse the CSV response
-    from io import StringIO
+def _fetch_batch(
+    client: httpx.Client,
+    flow: str,
+    keys: list[str],
+    start_period: str | None,
+    updated_after: datetime | None,
+) -> pd.DataFrame:
+    """Request the series of one dataflow in a single call and keep those asked for.
 
-    df_raw = pd.read_csv(StringIO(resp.text))
+    The merged key selects every combination of the listed dimension values,
+    so series not in ``keys`` may come back too; they are dropped.
+    """
+    url = f"{ECB_API_URL}/{flow}/{_merged_key(keys)}"
+    params = {"format": "csvdata"}
+    if start_period:
+        params["startPeriod"] = start_period
+    if updated_after:
+        params["updatedAfter"] = f"{updated_after.isoformat(timespec='seconds')}+00:00"
+    logger.info("Fetching %d ECB series from %s %s", len(keys), url, params)
 
-    # ECB CSV has TIME_PERIOD and OBS_VALUE columns
-    if "TIME_PERIOD" not in df_raw.columns or "OBS_VALUE" not in df_raw.columns:
-        logger.warning("Unexpected ECB response format: %s", df_raw.columns.tolist())
-        return pd.DataFrame(columns=["date", "taux", "source"])
+    resp = client.get(url, params=params, headers={"Accept": "text/csv"})
+    # The ECB answers 404 when no observation matches (nothing updated since)
+    if resp.status_code in (httpx.codes.NOT_FOUND, httpx.codes.NOT_MODIFIED):
+        return _empty_frame()
+    # Checked before the body, so that an empty error response counts as a failure
+    resp.raise_for_status()
+    if not resp.content:
+        return _empty_frame()
+
+    # Only three of the ~30 columns are read, from the raw bytes
+    raw = pd.read_csv(
+        BytesIO(resp.content),
+        usecols=lambda c: c in ("KEY", "TIME_PERIOD", "OBS_VALUE"),
+        dtype=str,
+    )
+    if "TIME_PERIOD" not in raw.columns or "OBS_VALUE" not in raw.columns:
+        raise ValueError(f"Unexpected ECB response format: {raw.columns.tolist()}")
+    if "KEY" not in raw.columns:
+        if len(keys) > 1:
+            raise ValueError("ECB response has no KEY column to tell the series apart")
+        raw["KEY"] = keys[0]
 
     df = pd.DataFrame({
-        "date": pd.to_datetime(df_raw["TIME_PERIOD"]),
-        "taux": pd.to_numeric(df_raw["OBS_VALUE"], errors="coerce"),
+        "date": pd.to_datetime(raw["TIME_PERIOD"], errors="coerce"),
+        "taux": pd.to_numeric(raw["OBS_VALUE"], errors="coerce"),
         "source": "ECB",
+        "serie": raw["KEY"].astype(object),
     })
-    df = df.dropna(subset=["taux"])
+    return df[df["serie"].isin(keys)].dropna(subset=["date", "taux"]).reset_index(drop=True)
 
-    logger.info("Fetched %d mortgage rate data points", len(df))
-    return df
+
+def _upsert(
+    con: duckdb.DuckDBPyConnection, df: pd.DataFrame, keys: list[str], synced_at: datetime
+) -> tuple[int, int]:
+    """Merge fetched rows into ``taux_hypothecaires`` and advance the series' sync state.
+
+    Runs in one transaction. Returns the (inserted, updated) counts.
+    """
+    con.execute("BEGIN TRANSACTION")
+    try:
+        # Rows stored before the serie column existed are the French series' (once:
+        # none are left afterwards), so that they are merged rather than duplicated
+        con.execute(
+            "UPDATE taux_hypothecaires SET serie = ? WHERE serie IS NULL", [ECB_SERIES_KEY]
+        )
+        con.execute("""
+            CREATE OR REPLACE TEMP TABLE _taux_staged AS
+            SELECT DISTINCT ON (serie, date) date::DATE AS date, taux, source, serie
+            FROM df
+            ORDER BY serie, date
+        """)
+        # Staged rows not already in the table as-is (new or revised points)
+        con.execute("""
+            CREATE OR REPLACE TEMP TABLE _taux_changed AS
+            SELECT * FROM _taux_staged
+            EXCEPT
+            SELECT t.* FROM taux_hypothecaires t SEMI JOIN _taux_staged s USING (serie, date)
+        """)
+        changed, updated = con.execute("""
+            SELECT count(*), count(*) FILTER (WHERE EXISTS (
+                SELECT 1 FROM taux_hypothecaires t WHERE t.serie = c.serie AND t.date = c.date
+            ))
+            FROM _taux_changed c
+        """).fetchone()
+
+        con.execute("""
+            DELETE FROM taux_hypothecaires USING _taux_changed c
+            WHERE taux_hypothecaires.serie = c.serie AND taux_hypothecaires.date = c.date
+        """)
+        con.execute("INSERT INTO taux_hypothecaires BY NAME SELECT * FROM _taux_changed")
+        con.execute("""
+            INSERT INTO ecb_sync_state
+            SELECT k.serie, max(s.date), ?
+            FROM unnest(?::VARCHAR[]) AS k(serie)
+            LEFT JOIN _taux_staged s USING (serie)
+            GROUP BY k.serie
+            ON CONFLICT (serie) DO UPDATE SET
+                last_period = greatest(ecb_sync_state.last_period, excluded.last_period),
+                synced_at = excluded.synced_at
+        """, [synced_at, keys])
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        for table in ("_taux_staged", "_taux_changed"):
+            con.execute(f"DROP TABLE IF EXISTS {table}")
+    return changed - updated, updated
+
+
+def _batches(keys: list[str]) -> list[tuple[str, list[str]]]:
+    """Group keys by dataflow and number of dimensions, at most ``MAX_SERIES_PER_REQUEST`` each."""
+    groups: dict[tuple[str, int], list[str]] = {}
+    for key in dict.fromkeys(keys):
+        flow, _, series_key = key.partition(".")
+        groups.setdefault((flow, series_key.count(".")), []).append(key)
+    return [
+        (flow, group[i : i + MAX_SERIES_PER_REQUEST])
+        for (flow, _), group in groups.items()
+        for i in range(0, len(group), MAX_SERIES_PER_REQUEST)
+    ]
+
+
+def _merged_key(keys: list[str]) -> str:
+    """SDMX key covering ``keys``: 'MIR.M.FR.B' + 'MIR.M.DE.B' -> 'M.FR+DE.B'."""
+    dimensions = zip(*(key.split(".")[1:] for key in keys))
+    return ".".join("+".join(dict.fromkeys(values)) for values in dimensions)
+
+
+def _months_before(period: date, months: int) -> str:
+    """SDMX monthly period ``months`` before ``period``: (2024-03-01, 12) -> '2023-03'."""
+    index = period.year * 12 + period.month - 1 - months
+    return f"{index // 12}-{index % 12 + 1:02d}"
+
+
+def _empty_frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        "date": pd.Series(dtype="datetime64[us]"),
+        "taux": pd.Series(dtype=float),
+        "source": pd.Series(dtype=object),
+        "serie": pd.Series(dtype=object),
+    })
+
+
+def _client_scope(client: httpx.Client | None):
+    """Use ``client`` as-is, or a fresh client closed on exit."""
+    return nullcontext(client) if client is not None else http.make_client(timeout=30)
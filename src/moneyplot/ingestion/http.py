@@ -0,0 +1,424 @@
+"""Shared HTTP layer of the ingestion sources: pooled client, per-host rate limits, disk cache.
+
+Every source builds its client with ``make_client``. Requests go through two
+transports stacked on httpx's connection pool:
+
+- ``CachingTransport`` stores GET responses on disk and serves them again while
+  fresh; once stale they are revalidated with If-None-Match / If-Modified-Since,
+  a 304 costing no body transfer;
+- ``RateLimitTransport`` spaces the requests that do reach the network with one
+  token bucket per host, shared by all clients of the process.
+
+Tests and local runs can point the stack at a stand-in server through the
+``transport`` argument of ``make_client`` (e.g. ``httpx.MockTransport``) or by
+overriding a source's base URL.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path(__file__).resolve().parents[3] / "data" / "raw" / "http_cache"
+
+# "0" / "off" disables the response cache; any other value is the cache directory
+CACHE_ENV = "MONEYPLOT_HTTP_CACHE"
+
+# Seconds a stored response is served without asking the server (the sources
+# publish at most daily); stale entries are revalidated, not dropped
+DEFAULT_TTL_SECONDS = 24 * 3600
+
+# Requests per second and burst allowed per host. INSEE caps its API at 30
+# requests a minute and the BAN at 50 a second; the others publish no quota,
+# these stay polite.
+RATE_LIMITS = {
+    "api-adresse.data.gouv.fr": (10.0, 10),
+    "api.insee.fr": (0.5, 1),
+    "data.ademe.fr": (5.0, 10),
+    "data-api.ecb.europa.eu": (2.0, 4),
+    "files.data.gouv.fr": (10.0, 10),
+}
+DEFAULT_RATE_LIMIT = (5.0, 10)
+
+# Request headers that select a different representation, hence a different entry
+VARY_HEADERS = ("accept", "accept-language")
+
+# Response header reporting how the cache served a request: hit, revalidated or miss
+CACHE_STATUS_HEADER = "x-moneyplot-cache"
+
+# Response headers a 304 may update
+_VALIDATORS = ("etag", "last-modified")
+
+# Bytes read at a time when replaying a stored body
+CHUNK_SIZE = 1 << 16
+
+# Hop-by-hop / transfer headers not replayed from the cache
+_UNSTORED_HEADERS = {"connection", "keep-alive", "transfer-encoding", "date", "age"}
+
+
+# ── Rate limiting ───────────────────────────────────────────────────────────
+
+
+class TokenBucket:
+    """Thread-safe token bucket: ``rate`` tokens per second, at most ``burst`` saved up."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, sleeping until one is available; return the seconds waited."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # The token is taken now (possibly going negative), so concurrent
+            # callers queue up behind each other instead of all waking at once
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+_buckets: dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def host_bucket(host: str) -> TokenBucket:
+    """The process-wide bucket of ``host``, so that parallel clients share its quota."""
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket is None:
+            bucket = _buckets[host] = TokenBucket(*RATE_LIMITS.get(host, DEFAULT_RATE_LIMIT))
+        return bucket
+
+
+class RateLimitTransport(httpx.BaseTransport):
+    """Wait for a token of the request's host before handing it to ``transport``."""
+
+    def __init__(self, transport: httpx.BaseTransport) -> None:
+        self._transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        waited = host_bucket(request.url.host).acquire()
+        if waited > 1:
+            logger.debug("Rate limit: waited %.1f s for %s", waited, request.url.host)
+        return self._transport.handle_request(request)
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+# ── Response cache ──────────────────────────────────────────────────────────
+
+
+@dataclass
+class CacheEntry:
+    """Metadata of a stored response; its body lives in the object store under ``digest``."""
+
+    url: str
+    status_code: int
+    headers: list[tuple[str, str]]
+    digest: str
+    size: int
+    stored_at: float
+    ttl: float
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() - self.stored_at < self.ttl
+
+    def header(self, name: str) -> str | None:
+        return next((v for k, v in self.headers if k.lower() == name), None)
+
+
+class ResponseCache:
+    """Content-addressed store of GET responses.
+
+    Bodies are written once under the SHA-256 of their bytes (``objects/``), so
+    identical responses to different URLs share one file; small JSON entries
+    keyed by request (``entries/``) point to them. Bodies are kept as received,
+    still content-encoded, and decoded by httpx on replay like a network response.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+
+    def key(self, request: httpx.Request) -> str:
+        """Entry key: method, URL (query parameters sorted) and representation headers."""
+        params = sorted(request.url.params.multi_items())
+        url = request.url.copy_with(params=params) if params else request.url
+        parts = [request.method, str(url)]
+        parts += [f"{name}:{request.headers.get(name, '')}" for name in VARY_HEADERS]
+        return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+    def get(self, key: str) -> CacheEntry | None:
+        path = self._entry_path(key)
+        try:
+            entry = CacheEntry(**json.loads(path.read_text()))
+        except (OSError, ValueError, TypeError):
+            return None
+        if entry.headers:
+            entry.headers = [tuple(h) for h in entry.headers]
+        return entry if self.object_path(entry.digest).exists() else None
+
+    def put(self, key: str, entry: CacheEntry) -> None:
+        _atomic_write(self._entry_path(key), json.dumps(entry.__dict__).encode())
+
+    def touch(self, key: str, entry: CacheEntry, response: httpx.Response) -> CacheEntry:
+        """Restart the TTL of an entry the server confirmed (304), keeping updated validators."""
+        updated = {k.lower(): v for k, v in response.headers.multi_items()}
+        headers = [(k, v) for k, v in entry.headers if k.lower() not in _VALIDATORS]
+        for name in _VALIDATORS:
+            value = updated.get(name) or entry.header(name)
+            if value is not None:
+                headers.append((name, value))
+        entry = CacheEntry(
+            entry.url, entry.status_code, headers, entry.digest, entry.size,
+            time.time(), entry.ttl,
+        )
+        self.put(key, entry)
+        return entry
+
+    def object_path(self, digest: str) -> Path:
+        return self.directory / "objects" / digest[:2] / digest
+
+    def _entry_path(self, key: str) -> Path:
+        return self.directory / "entries" / key[:2] / f"{key}.json"
+
+    def prune(self, older_than_seconds: float) -> tuple[int, int]:
+        """Delete entries stored more than ``older_than_seconds`` ago and unreferenced bodies.
+
+        Returns the number of entries and of bodies removed.
+        """
+        cutoff = time.time() - older_than_seconds
+        referenced, entries_removed = set(), 0
+        for path in (self.directory / "entries").glob("*/*.json"):
+            try:
+                entry = json.loads(path.read_text())
+            except (OSError, ValueError):
+                entry = None
+            if entry is None or entry["stored_at"] < cutoff:
+                path.unlink(missing_ok=True)
+                entries_removed += 1
+            else:
+                referenced.add(entry["digest"])
+        objects_removed = 0
+        for path in (self.directory / "objects").glob("*/*"):
+            if path.name not in referenced and not path.name.endswith(".part"):
+                path.unlink(missing_ok=True)
+                objects_removed += 1
+        return entries_removed, objects_removed
+
+
+class _ReplayStream(httpx.SyncByteStream):
+    """Body of a response served from the cache, read from disk chunk by chunk."""
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+
+    def __iter__(self) -> Iterator[bytes]:
+        with self._path.open("rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                yield chunk
+
+
+class _StoringStream(httpx.SyncByteStream):
+    """Network body passed through to the caller while being copied into the cache.
+
+    The entry is only written once the body has been read to the end, so a
+    download abandoned halfway never leaves a truncated response behind.
+    """
+
+    def __init__(
+        self, stream: httpx.SyncByteStream, cache: ResponseCache, key: str, entry: CacheEntry
+    ) -> None:
+        self._stream = stream
+        self._cache = cache
+        self._key = key
+        self._entry = entry
+
+    def __iter__(self) -> Iterator[bytes]:
+        objects = self._cache.directory / "objects"
+        objects.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=objects, suffix=".part")
+        tmp = Path(tmp_name)
+        digest, size, complete = hashlib.sha256(), 0, False
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in self._stream:
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            if complete:
+                self._entry.digest, self._entry.size = digest.hexdigest(), size
+                target = self._cache.object_path(self._entry.digest)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                tmp.replace(target)
+                self._cache.put(self._key, self._entry)
+            else:
+                tmp.unlink(missing_ok=True)
+
+    def close(self) -> None:
+        self._stream.close()
+
+
+class CachingTransport(httpx.BaseTransport):
+    """Serve GET requests from a ``ResponseCache``, revalidating stale entries.
+
+    Only 200 responses are stored. A request sent with ``Cache-Control: no-store``
+    bypasses the cache (large files the caller already keeps on disk), one with
+    ``no-cache`` is always revalidated. Freshness is the caller's policy: the
+    ``cache_ttl`` request extension, else ``ttl``. The servers' own cache headers
+    are ignored, as their data changes at most daily and public APIs often mark
+    every response ``no-cache``.
+    """
+
+    def __init__(
+        self,
+        transport: httpx.BaseTransport,
+        cache: ResponseCache,
+        ttl: float = DEFAULT_TTL_SECONDS,
+    ) -> None:
+        self._transport = transport
+        self.cache = cache
+        self.ttl = ttl
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        directives = _directives(request.headers.get("cache-control"))
+        if request.method != "GET" or "no-store" in directives:
+            return self._transport.handle_request(request)
+
+        key = self.cache.key(request)
+        entry = self.cache.get(key)
+        if entry is not None and entry.fresh and "no-cache" not in directives:
+            return self._replay(request, entry, "hit")
+
+        caller_validates = "if-none-match" in request.headers or (
+            "if-modified-since" in request.headers
+        )
+        if entry is not None and not caller_validates:
+            if entry.header("etag"):
+                request.headers["If-None-Match"] = entry.header("etag")
+            if entry.header("last-modified"):
+                request.headers["If-Modified-Since"] = entry.header("last-modified")
+
+        response = self._transport.handle_request(request)
+        if response.status_code == httpx.codes.NOT_MODIFIED and entry is not None:
+            response.close()
+            entry = self.cache.touch(key, entry, response)
+            if caller_validates:
+                return httpx.Response(
+                    httpx.codes.NOT_MODIFIED,
+                    headers=[*entry.headers, (CACHE_STATUS_HEADER, "revalidated")],
+                    request=request,
+                )
+            return self._replay(request, entry, "revalidated")
+
+        if response.status_code != httpx.codes.OK:
+            return response
+
+        headers = [
+            (k, v) for k, v in response.headers.multi_items()
+            if k.lower() not in _UNSTORED_HEADERS
+        ]
+        new_entry = CacheEntry(
+            str(request.url), response.status_code, headers, "", 0, time.time(),
+            request.extensions.get("cache_ttl", self.ttl),
+        )
+        return httpx.Response(
+            response.status_code,
+            headers=[*response.headers.multi_items(), (CACHE_STATUS_HEADER, "miss")],
+            stream=_StoringStream(response.stream, self.cache, key, new_entry),
+            request=request,
+            extensions=response.extensions,
+        )
+
+    def _replay(self, request: httpx.Request, entry: CacheEntry, status: str) -> httpx.Response:
+        logger.debug("HTTP cache %s: %s", status, entry.url)
+        return httpx.Response(
+            entry.status_code,
+            headers=[*entry.headers, (CACHE_STATUS_HEADER, status)],
+            stream=_ReplayStream(self.cache.object_path(entry.digest)),
+            request=request,
+        )
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+def cache_directory() -> Path | None:
+    """Directory of the response cache, or None when disabled through ``CACHE_ENV``."""
+    value = os.environ.get(CACHE_ENV, "").strip()
+    if value.lower() in ("0", "off", "false", "no"):
+        return None
+    return Path(value) if value else CACHE_DIR
+
+
+def prune_cache(older_than_days: float = 30, directory: Path | None = None) -> tuple[int, int]:
+    """Remove cache entries older than ``older_than_days`` and the bodies no entry uses."""
+    directory = directory or cache_directory()
+    if directory is None or not directory.exists():
+        return 0, 0
+    removed = ResponseCache(directory).prune(older_than_days * 86400)
+    logger.info("HTTP cache pruned: %d entries, %d bodies", *removed)
+    return removed
+
+
+# ── Client ──────────────────────────────────────────────────────────────────
+
+
+def make_client(
+    max_concurrency: int = 1,
+    timeout: float = 60,
+    ttl: float = DEFAULT_TTL_SECONDS,
+    cache: bool = True,
+    transport: httpx.BaseTransport | None = None,
+    **kwargs,
+) -> httpx.Client:
+    """Return a pooled client behind the cache and the per-host rate limiter.
+
+    The connection pool is sized for ``max_concurrency`` parallel requests.
+    ``transport`` replaces the network transport (a stand-in server in tests);
+    ``cache=False`` or the ``CACHE_ENV`` variable turn the disk cache off.
+    Other keyword arguments go to ``httpx.Client``.
+    """
+    if transport is None:
+        limits = httpx.Limits(
+            max_connections=max_concurrency, max_keepalive_connections=max_concurrency
+        )
+        transport = httpx.HTTPTransport(limits=limits)
+    transport = RateLimitTransport(transport)
+    directory = cache_directory() if cache else None
+    if directory is not None:
+        transport = CachingTransport(transport, ResponseCache(directory), ttl)
+    return httpx.Client(transport=transport, timeout=timeout, **kwargs)
+
+
+def _directives(value: str | None) -> set[str]:
+    """Lower-cased Cache-Control directives of a request."""
+    return {d.strip().lower() for d in value.split(",")} if value else set()
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{threading.get_ident()}.part")
+    tmp.write_bytes(data)
+    tmp.replace(path)
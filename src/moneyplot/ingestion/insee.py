@@ -1,11 +1,16 @@
 """Fetch Notaires-INSEE price indices via INSEE BDM API (SDMX-ML)."""
 
 import logging
+import re
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from xml.etree import ElementTree as ET
 
 import httpx
 import pandas as pd
 
+from moneyplot.ingestion import http
+
 logger = logging.getLogger(__name__)
 
 # Notaires-INSEE price index series
@@ -22,94 +27,163 @@ SERIES_IDS = {
 
 INSEE_BDM_URL = "https://api.insee.fr/series/BDM/V1/data/SERIES_BDM"
 
-# SDMX 2.1 namespaces used by INSEE
-NS = {
-    "mes": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message",
-    "gen": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/data/generic",
-    "com": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common",
-}
+# Series requested per call: the BDM API takes several idbanks joined by "+"
+# (up to 400; fewer keeps URLs and responses reasonable)
+MAX_SERIES_PER_REQUEST = 100
+
+# Batches fetched in parallel by fetch_price_indices
+DEFAULT_CONCURRENCY = 4
+
+# Quarterly ("2023-Q1", "2023-T1") or monthly ("2023-01") observation periods
+_PERIOD_PATTERN = re.compile(
+    r"^(?P<year>\d{4})-(?:[QT](?P<quarter>[1-4])|(?P<month>0[1-9]|1[0-2]))$"
+)
+
 
+def make_client(max_concurrency: int = DEFAULT_CONCURRENCY) -> httpx.Client:
+    """Return an HTTP client whose connection pool is sized for parallel batches."""
+    return http.make_client(max_concurrency, timeout=30)
 
-def fetch_price_indices() -> pd.DataFrame:
+
+def fetch_price_indices(
+    series: dict[str, tuple[str, str]] | None = None,
+    batch_size: int = MAX_SERIES_PER_REQUEST,
+    max_concurrency: int = DEFAULT_CONCURRENCY,
+) -> pd.DataFrame:
     """Fetch quarterly price indices from INSEE BDM.
 
-    The API returns SDMX-ML (XML) regardless of Accept header.
+    ``series`` maps idbanks to their (type_bien, zone), ``SERIES_IDS`` by
+    default. Series are requested ``batch_size`` at a time, batches in
+    parallel over one pooled client, and each response is parsed as it
+    streams in. The API returns SDMX-ML (XML) regardless of Accept header.
     Returns a DataFrame with columns: date, indice, type_bien, zone.
     """
-    all_rows = []
+    series = series or SERIES_IDS
+    ids = list(series)
+    batches = [ids[i : i + batch_size] for i in range(0, len(ids), batch_size)]
+    workers = max(1, min(max_concurrency, len(batches)))
+
+    columns: dict[str, list] = {"idbank": [], "period": [], "value": []}
+    with make_client(workers) as client, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_fetch_batch, client, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                parsed = future.result()
+            except (httpx.HTTPError, ET.ParseError):
+                logger.exception("Failed to fetch INSEE series %s", ", ".join(batch))
+                continue
+            for name, values in parsed.items():
+                columns[name].extend(values)
+
+    df = _to_frame(columns, series)
+    for series_id in sorted(set(ids) - set(columns["idbank"])):
+        logger.warning("INSEE series %s returned no observation", series_id)
+    logger.info("Fetched %d price index data points from %d series", len(df), len(ids))
+    return df
 
-    for series_id, (type_bien, zone) in SERIES_IDS.items():
-        url = f"{INSEE_BDM_URL}/{series_id}"
-        logger.info("Fetching INSEE series %s (%s, %s)", series_id, type_bien, zone)
 
-        try:
-            resp = httpx.get(url, timeout=30)
-            resp.raise_for_status()
+def _fetch_batch(client: httpx.Client, series_ids: list[str]) -> dict[str, list]:
+    """Request several series in one call and parse the response as it streams in.
 
-            rows = _parse_sdmx_xml(resp.text, type_bien, zone)
-            all_rows.extend(rows)
-            logger.info("Series %s: %d observations", series_id, len(rows))
-        except Exception:
-            logger.exception("Failed to fetch series %s", series_id)
+    A single unknown idbank fails the whole request: the batch is then retried
+    one series at a time, so only the faulty series are lost.
+    """
+    url = f"{INSEE_BDM_URL}/{'+'.join(series_ids)}"
+    logger.info("Fetching %d INSEE series from %s", len(series_ids), url)
+    try:
+        with client.stream("GET", url) as resp:
+            resp.raise_for_status()
+            return parse_sdmx(resp.iter_bytes())
+    except httpx.HTTPStatusError:
+        if len(series_ids) == 1:
+            raise
+        logger.warning("INSEE batch of %d series failed, retrying one by one", len(series_ids))
+
+    columns: dict[str, list] = {"idbank": [], "period": [], "value": []}
+    for series_id in series_ids:
+        try:
+            parsed = _fetch_batch(client, [series_id])
+        except (httpx.HTTPError, ET.ParseError):
+            logger.exception("Failed to fetch INSEE series %s", series_id)
+            continue
+        for name, values in parsed.items():
+            columns[name].extend(values)
+    return columns
 
-    df = pd.DataFrame(all_rows)
-    if not df.empty:
-        df["date"] = pd.to_datetime(df["date"])
-    logger.info("Fetched %d price index data points", len(df))
-    return df
 
+def parse_sdmx(chunks: Iterable[bytes]) -> dict[str, list]:
+    """Parse SDMX-ML StructureSpecificData or GenericData, fed chunk by chunk.
 
-def _parse_sdmx_xml(xml_text: str, type_bien: str, zone: str) -> list[dict]:
-    """Parse SDMX-ML StructureSpecificData or GenericData from INSEE."""
-    root = ET.fromstring(xml_text)
-    rows = []
-
-    # Try StructureSpecificData format first (most common from INSEE)
-    # In this format, observations are Obs elements with TIME_PERIOD and OBS_VALUE attributes
-    for obs in root.iter():
-        tag = obs.tag.split("}")[-1] if "}" in obs.tag else obs.tag
-        if tag == "Obs":
-            period = obs.attrib.get("TIME_PERIOD")
-            value = obs.attrib.get("OBS_VALUE")
-            if period and value:
-                date = _quarter_to_date(period)
-                if date:
-                    rows.append({
-                        "date": date,
-                        "indice": float(value),
-                        "type_bien": type_bien,
-                        "zone": zone,
-                    })
-
-    if rows:
-        return rows
-
-    # Fallback: try GenericData format
-    for obs in root.iter(f"{{{NS['gen']}}}Obs"):
-        period = None
-        value = None
-        for dim in obs.iter(f"{{{NS['gen']}}}ObsDimension"):
-            period = dim.attrib.get("value")
-        for val in obs.iter(f"{{{NS['gen']}}}ObsValue"):
-            value = val.attrib.get("value")
-        if period and value:
-            date = _quarter_to_date(period)
-            if date:
-                rows.append({
-                    "date": date,
-                    "indice": float(value),
-                    "type_bien": type_bien,
-                    "zone": zone,
-                })
-
-    return rows
-
-
-def _quarter_to_date(period: str) -> str | None:
-    """Convert '2023-Q1' or '2023-T1' to '2023-01-01'."""
-    try:
-        year, q = period.replace("T", "Q").split("-Q")
-        month = (int(q) - 1) * 3 + 1
-        return f"{year}-{month:02d}-01"
-    except (ValueError, IndexError):
+    Observations are appended to column lists (idbank, period, value) as the
+    parser completes them, and elements are cleared once read, so memory stays
+    flat however many series the document holds.
+    """
+    columns: dict[str, list] = {"idbank": [], "period": [], "value": []}
+    idbanks, periods, values = columns["idbank"], columns["period"], columns["value"]
+    parser = ET.XMLPullParser(events=("end",))
+    # Local name of each (namespaced) tag, split once per distinct tag
+    names: dict[str, str] = {}
+    # Rows of the current series, and its idbank when it comes first (GenericData)
+    first_row, idbank, period = 0, None, None
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _, elem in parser.read_events():
+            name = names.get(elem.tag)
+            if name is None:
+                name = names[elem.tag] = elem.tag.rpartition("}")[2]
+
+            # StructureSpecificData: <Series IDBANK=...><Obs TIME_PERIOD=... OBS_VALUE=.../>
+            # GenericData: <SeriesKey><Value id="IDBANK" value=.../></SeriesKey>
+            #              <Obs><ObsDimension value=.../><ObsValue value=.../></Obs>
+            if name == "Obs":
+                if "TIME_PERIOD" in elem.attrib:
+                    periods.append(elem.get("TIME_PERIOD"))
+                    values.append(elem.get("OBS_VALUE"))
+                elem.clear()
+            elif name == "ObsDimension":
+                period = elem.get("value")
+            elif name == "ObsValue":
+                periods.append(period)
+                values.append(elem.get("value"))
+            elif name == "Value" and elem.get("id") == "IDBANK":
+                idbank = elem.get("value")
+            elif name == "Series":
+                # The series' rows get its idbank once the element is complete
+                idbank = elem.get("IDBANK", idbank)
+                idbanks.extend([idbank] * (len(periods) - first_row))
+                first_row, idbank = len(periods), None
+                elem.clear()
+    parser.close()
+    return columns
+
+
+def _to_frame(columns: dict[str, list], series: dict[str, tuple[str, str]]) -> pd.DataFrame:
+    """Build the indices frame from parsed columns, converting whole columns at once.
+
+    Periods repeat across series, so each distinct one is converted only once.
+    Periods that are neither quarters nor months, values that are missing or
+    not numbers ("NaN", "ND") and series not requested are dropped.
+    """
+    starts = {period: _period_start(period) for period in set(columns["period"])}
+    idbanks = pd.Series(columns["idbank"], dtype=object)
+    df = pd.DataFrame({
+        "date": pd.to_datetime(
+            pd.Series(columns["period"], dtype=object).map(starts), format="%Y-%m-%d"
+        ),
+        "indice": pd.to_numeric(pd.Series(columns["value"], dtype=object), errors="coerce"),
+        "type_bien": idbanks.map({k: v[0] for k, v in series.items()}),
+        "zone": idbanks.map({k: v[1] for k, v in series.items()}),
+    })
+    return df.dropna().reset_index(drop=True)
+
+
+def _period_start(period: str | None) -> str | None:
+    """First day of a period: '2023-Q1' or '2023-T1' -> '2023-01-01', '2023-05' -> '2023-05-01'."""
+    match = _PERIOD_PATTERN.match(period or "")
+    if match is None:
         return None
+    quarter = match["quarter"]
+    month = (int(quarter) - 1) * 3 + 1 if quarter else int(match["month"])
+    return f"{match['year']}-{month:02d}-01"
@@ -1,70 +1,273 @@
 """Dagster asset definitions for Moneyplot."""
 
 import logging
-from pathlib import Path
 
-from dagster import AssetExecutionContext, Config, MaterializeResult, MetadataValue, asset
+from dagster import (
+    AssetExecutionContext,
+    AutomationCondition,
+    Config,
+    MaterializeResult,
+    MetadataValue,
+    asset,
+)
 
-from moneyplot.ingestion.dvf import ALL_DEPTS, download_all
-from moneyplot.ingestion.ecb import fetch_mortgage_rates
+from moneyplot.ingestion import dpe, ecb
+from moneyplot.ingestion.dvf import (
+    DEFAULT_CONCURRENCY,
+    STATUS_NEW,
+    STATUS_UNCHANGED,
+    STATUS_UPDATED,
+    download_all,
+)
 from moneyplot.ingestion.insee import fetch_price_indices
+from moneyplot.pipelines.partitions import dvf_partitions
 from moneyplot.pipelines.resources import DuckDBResource
+from moneyplot.transform.communes import refresh_communes
+from moneyplot.transform.comparables import refresh_comparables
 from moneyplot.transform.dvf_clean import clean_dvf, load_parquet_to_duckdb
+from moneyplot.transform.enrich import enrich_mutations_with_dpe
+from moneyplot.transform.geo import refresh_geo_index
+from moneyplot.transform.rollups import refresh_price_grid, refresh_rollups
 
 logger = logging.getLogger(__name__)
 
 
+# Writers to the DuckDB file share this concurrency key so that parallel
+# partition runs queue up on DuckDB's single-writer lock instead of failing.
+DUCKDB_WRITE_TAGS = {"dagster/concurrency_key": "duckdb"}
+
+
 class DVFConfig(Config):
     """Configuration for DVF download."""
 
-    departments: list[str] = []  # empty = all
+    max_concurrency: int = DEFAULT_CONCURRENCY  # parallel downloads
+
+
+class RollupConfig(Config):
+    """Configuration for the price rollups."""
+
+    # Merge department and France medians from commune sketches (within 1%)
+    # instead of recomputing them exactly from every sale
+    approximate: bool = True
+
+
+class ECBConfig(Config):
+    """Configuration for the incremental ECB mortgage-rate sync."""
+
+    series: list[str] = ecb.ECB_SERIES  # dataflow-qualified keys, e.g. MIR.M.FR.B.A2C...
+    full_refresh: bool = False  # refetch every series' whole history
+
+
+class DPEConfig(Config):
+    """Configuration for the incremental DPE sync."""
+
+    max_concurrency: int = dpe.DEFAULT_CONCURRENCY  # departments harvested in parallel
 
 
 # ── DVF Assets ───────────────────────────────────────────────────────────────
 
 
-@asset(group_name="dvf")
-def raw_dvf(context: AssetExecutionContext, config: DVFConfig) -> MaterializeResult:
-    """Download raw DVF CSV files from Etalab."""
-    depts = config.departments or None
-    paths = download_all(departments=depts)
-    return MaterializeResult(
+@asset(group_name="dvf", partitions_def=dvf_partitions, output_required=False)
+def raw_dvf(context: AssetExecutionContext, config: DVFConfig):
+    """Refresh one department's raw DVF CSV files from Etalab.
+
+    Downloads are conditional on the local manifest. When no file was added or
+    republished the partition is not materialized, so downstream steps are skipped.
+    """
+    dept = context.partition_key
+    results = download_all(departments=[dept], max_concurrency=config.max_concurrency)
+    by_status = {
+        status: [r.path.name for r in results if r.status == status]
+        for status in (STATUS_NEW, STATUS_UPDATED, STATUS_UNCHANGED)
+    }
+    context.log.info(
+        "DVF files for %s: %d new, %d updated, %d unchanged",
+        dept,
+        *(len(names) for names in by_status.values()),
+    )
+    if not by_status[STATUS_NEW] and not by_status[STATUS_UPDATED]:
+        context.log.info("No DVF file changed for department %s", dept)
+        return
+
+    yield MaterializeResult(
         metadata={
-            "num_files": MetadataValue.int(len(paths)),
-            "departments": MetadataValue.text(", ".join(p.stem.split("_")[1] for p in paths)),
+            "num_files": MetadataValue.int(len(results)),
+            **{
+                f"num_{status}": MetadataValue.int(len(names))
+                for status, names in by_status.items()
+            },
+            "new_files": MetadataValue.text(", ".join(by_status[STATUS_NEW])),
+            "updated_files": MetadataValue.text(", ".join(by_status[STATUS_UPDATED])),
         }
     )
 
 
-@asset(deps=[raw_dvf], group_name="dvf")
+@asset(deps=[raw_dvf], group_name="dvf", partitions_def=dvf_partitions)
 def cleaned_dvf(context: AssetExecutionContext) -> MaterializeResult:
-    """Clean raw DVF data and produce a Parquet file."""
-    parquet_path = clean_dvf()
-    size_mb = parquet_path.stat().st_size / (1024 * 1024)
+    """Clean one department's raw DVF data into the partitioned Parquet dataset."""
+    dept = context.partition_key
+    dataset_dir = clean_dvf(department=dept)
+    files = list(dataset_dir.glob(f"annee=*/code_departement={dept}/*.parquet"))
+    size_mb = sum(f.stat().st_size for f in files) / (1024 * 1024)
     return MaterializeResult(
         metadata={
-            "parquet_path": MetadataValue.path(str(parquet_path)),
+            "dataset_dir": MetadataValue.path(str(dataset_dir)),
+            "num_partitions": MetadataValue.int(len(files)),
             "size_mb": MetadataValue.float(round(size_mb, 1)),
         }
     )
 
 
-@asset(deps=[cleaned_dvf], group_name="dvf")
+@asset(
+    deps=[cleaned_dvf],
+    group_name="dvf",
+    partitions_def=dvf_partitions,
+    op_tags=DUCKDB_WRITE_TAGS,
+)
 def dvf_in_duckdb(context: AssetExecutionContext, duckdb_resource: DuckDBResource) -> MaterializeResult:
-    """Load cleaned DVF Parquet into DuckDB."""
-    processed = Path(__file__).resolve().parents[3] / "data" / "processed" / "dvf_clean.parquet"
+    """Merge one department's cleaned rows into the DuckDB mutations table."""
+    con = duckdb_resource.get_connection()
+    stats = load_parquet_to_duckdb(con, department=context.partition_key)
+    con.close()
+    return MaterializeResult(
+        metadata={
+            "row_count": MetadataValue.int(stats.row_count),
+            "rows_inserted": MetadataValue.int(stats.inserted),
+            "rows_updated": MetadataValue.int(stats.updated),
+            "rows_deleted": MetadataValue.int(stats.deleted),
+        },
+    )
+
+
+@asset(
+    deps=[dvf_in_duckdb],
+    group_name="dvf",
+    partitions_def=dvf_partitions,
+    op_tags=DUCKDB_WRITE_TAGS,
+)
+def price_rollups(
+    context: AssetExecutionContext, config: RollupConfig, duckdb_resource: DuckDBResource
+) -> MaterializeResult:
+    """Recompute the dashboard's price rollups and map grid for one department (and France)."""
     con = duckdb_resource.get_connection()
-    count = load_parquet_to_duckdb(processed, con)
+    written = refresh_rollups(
+        con, department=context.partition_key, approximate=config.approximate
+    )
+    grid_written = refresh_price_grid(con, department=context.partition_key)
     con.close()
     return MaterializeResult(
-        metadata={"row_count": MetadataValue.int(count)},
+        metadata={
+            "rows_written": MetadataValue.int(written),
+            "grid_rows_written": MetadataValue.int(grid_written),
+        }
+    )
+
+
+@asset(
+    deps=[dvf_in_duckdb],
+    group_name="dvf",
+    partitions_def=dvf_partitions,
+    op_tags=DUCKDB_WRITE_TAGS,
+)
+def communes(context: AssetExecutionContext, duckdb_resource: DuckDBResource) -> MaterializeResult:
+    """Refresh one department's rows of the communes dimension (centroids, counts, search keys)."""
+    con = duckdb_resource.get_connection()
+    written = refresh_communes(con, department=context.partition_key)
+    total = con.execute("SELECT count(*) FROM communes").fetchone()[0]
+    con.close()
+    return MaterializeResult(
+        metadata={
+            "communes_written": MetadataValue.int(written),
+            "row_count": MetadataValue.int(total),
+        }
+    )
+
+
+@asset(
+    deps=[dvf_in_duckdb],
+    group_name="dvf",
+    partitions_def=dvf_partitions,
+    op_tags=DUCKDB_WRITE_TAGS,
+)
+def mutations_geo(
+    context: AssetExecutionContext, duckdb_resource: DuckDBResource
+) -> MaterializeResult:
+    """Refresh one department's rows of the spatial index used by proximity search."""
+    con = duckdb_resource.get_connection()
+    written = refresh_geo_index(con, department=context.partition_key)
+    total = con.execute("SELECT count(*) FROM mutations_geo").fetchone()[0]
+    con.close()
+    return MaterializeResult(
+        metadata={
+            "rows_written": MetadataValue.int(written),
+            "row_count": MetadataValue.int(total),
+        }
+    )
+
+
+@asset(
+    deps=[dvf_in_duckdb],
+    group_name="dvf",
+    partitions_def=dvf_partitions,
+    op_tags=DUCKDB_WRITE_TAGS,
+)
+def comparables(
+    context: AssetExecutionContext, duckdb_resource: DuckDBResource
+) -> MaterializeResult:
+    """Rebuild one department's comparable-sales trees (skipped when its sales are unchanged)."""
+    con = duckdb_resource.get_connection()
+    indexed = refresh_comparables(con, department=context.partition_key)
+    con.close()
+    return MaterializeResult(metadata={"sales_indexed": MetadataValue.int(indexed)})
+
+
+# ── DPE Assets ───────────────────────────────────────────────────────────────
+
+
+@asset(group_name="dpe", op_tags=DUCKDB_WRITE_TAGS)
+def dpe_in_duckdb(
+    context: AssetExecutionContext, config: DPEConfig, duckdb_resource: DuckDBResource
+) -> MaterializeResult:
+    """Sync the dpe table with the diagnostics ADEME published since the last run."""
+    con = duckdb_resource.get_connection()
+    stats = dpe.sync_dpe(con, max_concurrency=config.max_concurrency)
+    con.close()
+    if stats.failed:
+        context.log.warning("DPE sync failed for departments: %s", ", ".join(stats.failed))
+    return MaterializeResult(
+        metadata={
+            "row_count": MetadataValue.int(stats.row_count),
+            "rows_fetched": MetadataValue.int(stats.fetched),
+            "rows_inserted": MetadataValue.int(stats.inserted),
+            "rows_updated": MetadataValue.int(stats.updated),
+            "failed_departments": MetadataValue.text(", ".join(stats.failed)),
+        },
+    )
+
+
+@asset(deps=[dvf_in_duckdb, dpe_in_duckdb], group_name="dpe", op_tags=DUCKDB_WRITE_TAGS)
+def mutations_enriched(
+    context: AssetExecutionContext, duckdb_resource: DuckDBResource
+) -> MaterializeResult:
+    """Rebuild the DVF × DPE join for the communes whose sales or diagnostics changed."""
+    con = duckdb_resource.get_connection()
+    rebuilt = enrich_mutations_with_dpe(con)
+    matched = con.execute(
+        "SELECT count(*) FROM mutations_enriched WHERE classe_energie IS NOT NULL"
+    ).fetchone()[0]
+    con.close()
+    return MaterializeResult(
+        metadata={
+            "communes_rebuilt": MetadataValue.int(rebuilt),
+            "rows_with_dpe": MetadataValue.int(matched),
+        },
     )
 
 
 # ── Macro Assets ─────────────────────────────────────────────────────────────
 
 
-@asset(group_name="macro")
+@asset(group_name="macro", op_tags=DUCKDB_WRITE_TAGS)
 def price_indices(context: AssetExecutionContext, duckdb_resource: DuckDBResource) -> MaterializeResult:
     """Fetch Notaires-INSEE price indices and load into DuckDB."""
     df = fetch_price_indices()
@@ -76,13 +279,57 @@ def price_indices(context: AssetExecutionContext, duckdb_resource: DuckDBResourc
     return MaterializeResult(metadata={"row_count": MetadataValue.int(count)})
 
 
-@asset(group_name="macro")
-def mortgage_rates(context: AssetExecutionContext, duckdb_resource: DuckDBResource) -> MaterializeResult:
-    """Fetch ECB mortgage rates and load into DuckDB."""
-    df = fetch_mortgage_rates()
+@asset(group_name="macro", op_tags=DUCKDB_WRITE_TAGS)
+def mortgage_rates(
+    context: AssetExecutionContext, config: ECBConfig, duckdb_resource: DuckDBResource
+) -> MaterializeResult:
+    """Upsert the ECB mortgage-rate observations added or revised since the last run."""
     con = duckdb_resource.get_connection()
-    con.execute("DELETE FROM taux_hypothecaires")
-    con.execute("INSERT INTO taux_hypothecaires SELECT * FROM df")
-    count = con.execute("SELECT count(*) FROM taux_hypothecaires").fetchone()[0]
+    stats = ecb.sync_mortgage_rates(con, config.series, config.full_refresh)
     con.close()
-    return MaterializeResult(metadata={"row_count": MetadataValue.int(count)})
+    if stats.failed:
+        context.log.warning("ECB sync failed for series: %s", ", ".join(stats.failed))
+    return MaterializeResult(
+        metadata={
+            "row_count": MetadataValue.int(stats.row_count),
+            "rows_fetched": MetadataValue.int(stats.fetched),
+            "rows_inserted": MetadataValue.int(stats.inserted),
+            "rows_updated": MetadataValue.int(stats.updated),
+            "failed_series": MetadataValue.text(", ".join(stats.failed)),
+        },
+    )
+
+
+# ── Publication ──────────────────────────────────────────────────────────────
+
+# Publish once the writers have settled: after any of them was updated, and not
+# while one is still running (any partition, e.g. during a backfill). Departments
+# never loaded do not hold the publication back.
+PUBLISH_CONDITION = AutomationCondition.eager().without(~AutomationCondition.any_deps_missing())
+
+
+@asset(
+    deps=[
+        dvf_in_duckdb,
+        price_rollups,
+        communes,
+        mutations_geo,
+        dpe_in_duckdb,
+        mutations_enriched,
+        price_indices,
+        mortgage_rates,
+    ],
+    group_name="publish",
+    op_tags=DUCKDB_WRITE_TAGS,
+    automation_condition=PUBLISH_CONDITION,
+)
+def published_snapshot(duckdb_resource: DuckDBResource) -> MaterializeResult:
+    """Publish one read-only snapshot of the database for the dashboard."""
+    snapshot = duckdb_resource.publish()
+    size_mb = snapshot.stat().st_size / (1024 * 1024)
+    return MaterializeResult(
+        metadata={
+            "snapshot": MetadataValue.path(str(snapshot)),
+            "size_mb": MetadataValue.float(round(size_mb, 1)),
+        }
+    )
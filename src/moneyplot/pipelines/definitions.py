@@ -1,19 +1,50 @@
 """Dagster definitions entry point for Moneyplot."""
 
-from dagster import Definitions
+from dagster import Definitions, multiprocess_executor
 
 from moneyplot.pipelines.assets import (
     cleaned_dvf,
+    communes,
+    comparables,
+    dpe_in_duckdb,
     dvf_in_duckdb,
     mortgage_rates,
+    mutations_enriched,
+    mutations_geo,
     price_indices,
+    price_rollups,
+    published_snapshot,
     raw_dvf,
 )
 from moneyplot.pipelines.resources import DuckDBResource
-from moneyplot.pipelines.schedules import dvf_monthly, macro_quarterly
+from moneyplot.pipelines.schedules import (
+    dpe_weekly,
+    dvf_job,
+    dvf_monthly,
+    macro_quarterly,
+    publish_sensor,
+)
 
 defs = Definitions(
-    assets=[raw_dvf, cleaned_dvf, dvf_in_duckdb, price_indices, mortgage_rates],
+    assets=[
+        raw_dvf,
+        cleaned_dvf,
+        dvf_in_duckdb,
+        price_rollups,
+        communes,
+        mutations_geo,
+        comparables,
+        dpe_in_duckdb,
+        mutations_enriched,
+        price_indices,
+        mortgage_rates,
+        published_snapshot,
+    ],
+    jobs=[dvf_job],
     resources={"duckdb_resource": DuckDBResource()},
-    schedules=[dvf_monthly, macro_quarterly],
+    schedules=[dvf_monthly, dpe_weekly, macro_quarterly],
+    sensors=[publish_sensor],
+    # Each step runs in its own process; partition runs of a backfill proceed in
+    # parallel while DuckDB writes are serialised by the "duckdb" concurrency key.
+    executor=multiprocess_executor.configured({"max_concurrent": 4}),
 )
@@ -0,0 +1,9 @@
+"""Dagster partition definitions for Moneyplot."""
+
+from dagster import StaticPartitionsDefinition
+
+from moneyplot.ingestion.dvf import ALL_DEPTS
+
+# DVF assets are partitioned by department: mutations never cross a department
+# boundary, so each slice is downloaded, cleaned and loaded independently.
+dvf_partitions = StaticPartitionsDefinition(ALL_DEPTS)
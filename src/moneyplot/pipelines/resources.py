@@ -5,7 +5,7 @@ from pathlib import Path
 import duckdb
 from dagster import ConfigurableResource, InitResourceContext
 
-from moneyplot.storage.db import DEFAULT_DB_PATH
+from moneyplot.storage.db import DEFAULT_DB_PATH, publish_snapshot
 from moneyplot.storage.schemas import create_tables
 
 
@@ -20,3 +20,7 @@ class DuckDBResource(ConfigurableResource):
         con = duckdb.connect(str(path))
         create_tables(con)
         return con
+
+    def publish(self) -> Path:
+        """Publish a snapshot for the dashboard once writes are committed."""
+        return publish_snapshot(self.db_path)
@@ -1,19 +1,71 @@
 """Dagster schedules for Moneyplot."""
 
-from dagster import ScheduleDefinition
+from dagster import (
+    AutomationConditionSensorDefinition,
+    DefaultSensorStatus,
+    RunRequest,
+    ScheduleDefinition,
+    ScheduleEvaluationContext,
+    define_asset_job,
+    schedule,
+)
 
-from moneyplot.pipelines.assets import dvf_in_duckdb, mortgage_rates, price_indices
+from moneyplot.pipelines.assets import (
+    cleaned_dvf,
+    communes,
+    comparables,
+    dpe_in_duckdb,
+    dvf_in_duckdb,
+    mortgage_rates,
+    mutations_enriched,
+    mutations_geo,
+    price_indices,
+    price_rollups,
+    published_snapshot,
+    raw_dvf,
+)
+from moneyplot.pipelines.partitions import dvf_partitions
 
-# DVF is updated semestrially (April + October) — run monthly to catch updates
-dvf_monthly = ScheduleDefinition(
-    name="dvf_monthly",
-    target=[dvf_in_duckdb],
-    cron_schedule="0 3 1 * *",  # 1st of each month at 3am
+# Download → clean → load → roll up and index (communes, locations, comparables) one department
+dvf_job = define_asset_job(
+    name="dvf_job",
+    selection=[
+        raw_dvf, cleaned_dvf, dvf_in_duckdb, price_rollups, communes, mutations_geo, comparables,
+    ],
+    partitions_def=dvf_partitions,
 )
 
+
+# DVF is updated semestrially (April + October) — run monthly to catch updates.
+# One run per department: departments whose files are unchanged stop after raw_dvf.
+@schedule(job=dvf_job, cron_schedule="0 3 1 * *")  # 1st of each month at 3am
+def dvf_monthly(context: ScheduleEvaluationContext):
+    month = context.scheduled_execution_time.strftime("%Y-%m")
+    for dept in dvf_partitions.get_partition_keys():
+        yield RunRequest(run_key=f"{month}:{dept}", partition_key=dept)
+
+
+# DPE — new diagnostics every day; the sync only fetches what is new since last week.
+# The enrichment then rebuilds the communes touched by this sync or by DVF loads.
+dpe_weekly = ScheduleDefinition(
+    name="dpe_weekly",
+    target=[dpe_in_duckdb, mutations_enriched],
+    cron_schedule="0 5 * * 1",  # Mondays at 5am
+)
+
+
 # Macro data — quarterly
 macro_quarterly = ScheduleDefinition(
     name="macro_quarterly",
     target=[price_indices, mortgage_rates],
     cron_schedule="0 4 1 1,4,7,10 *",  # 1st of Jan/Apr/Jul/Oct at 4am
 )
+
+
+# Snapshot for the dashboard — one copy of the database once the writers of a
+# run (or of a whole backfill) have finished, see PUBLISH_CONDITION
+publish_sensor = AutomationConditionSensorDefinition(
+    name="publish_sensor",
+    target=[published_snapshot],
+    default_status=DefaultSensorStatus.RUNNING,
+)
@@ -0,0 +1,126 @@
+"""In-process cache of dashboard query results, invalidated by the data version.
+
+Streamlit re-runs a page script on every interaction, re-issuing the same
+queries. Results are kept in a process-wide LRU keyed by the database, its
+data version (see ``db.read_data_version``), the normalised SQL and the
+parameters: once the pipeline publishes a new snapshot, earlier entries can no
+longer be hit and age out of the LRU.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import duckdb
+import pandas as pd
+
+from moneyplot.storage.db import database_path, read_data_version
+
+# Entries kept before the least recently used is evicted
+MAX_ENTRIES = 512
+
+# Total size of cached DataFrames (deep memory usage)
+MAX_BYTES = 256 * 1024 * 1024
+
+# Quoted SQL literals and identifiers, kept verbatim by normalisation
+_QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+
+class QueryCache:
+    """Thread-safe LRU of query results bounded by entry count and total bytes."""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, tuple[pd.DataFrame, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+
+    def get(self, key: tuple) -> pd.DataFrame | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats.hits += 1
+        # Callers may add columns to the frame they get: hand out a copy
+        return entry[0].copy()
+
+    def put(self, key: tuple, df: pd.DataFrame) -> None:
+        size = int(df.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._stats.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (df.copy(), size)
+            self._stats.bytes += size
+            while len(self._entries) > self.max_entries or self._stats.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._stats.bytes -= evicted
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats.bytes = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                self._stats.hits, self._stats.misses, len(self._entries), self._stats.bytes
+            )
+
+
+_cache = QueryCache()
+
+
+def get_cache() -> QueryCache:
+    """Return the process-wide query cache."""
+    return _cache
+
+
+def cached_fetchdf(
+    con: duckdb.DuckDBPyConnection, query: str, params: list | None = None
+) -> pd.DataFrame:
+    """Run ``query`` and return its result as a DataFrame, from the cache when possible."""
+    db_path = database_path(con)
+    # Read the version before querying: a snapshot published meanwhile changes it,
+    # so a result racing a publish is keyed under a version that is already stale.
+    key = (
+        db_path,
+        read_data_version(db_path) if db_path else None,
+        normalize_sql(query),
+        _freeze(params or []),
+    )
+    df = _cache.get(key)
+    if df is None:
+        df = con.execute(query, params or []).fetchdf()
+        if db_path:  # In-memory databases have no data version
+            _cache.put(key, df)
+    return df
+
+
+def normalize_sql(query: str) -> str:
+    """Collapse whitespace outside quotes, so formatting changes don't split the cache."""
+    parts = _QUOTED.split(query.strip())
+    # Odd indices are the quoted segments captured by the split
+    return "".join(p if i % 2 else re.sub(r"\s+", " ", p) for i, p in enumerate(parts))
+
+
+def _freeze(value):
+    """Turn query parameters into a hashable key."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
@@ -1,14 +1,504 @@
-"""DuckDB connection manager."""
+"""DuckDB connection manager.
 
+The pipeline writes to the live database (``get_connection``), then publishes
+an immutable copy of it to ``snapshots/`` (``publish_snapshot``). The dashboard
+reads the current snapshot through pooled read-only connections
+(``get_read_connection``), so it never contends for the live file's lock.
+
+Both functions can return an ``InstrumentedConnection`` instead, which records
+each query's latency and rows in a ``QueryProfiler``. This is opt-in: pass a
+profiler, or set ``MONEYPLOT_QUERY_PROFILING`` (``1`` for timings, ``full`` to
+also keep DuckDB's profile of each query) to instrument every connection of
+the process; ``MONEYPLOT_QUERY_LOG`` names a JSON Lines file the records are
+appended to.
+"""
+
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
 
 import duckdb
 
+logger = logging.getLogger(__name__)
+
 DEFAULT_DB_PATH = Path(__file__).resolve().parents[3] / "data" / "moneyplot.duckdb"
 
+# Published snapshots live next to the database, in this directory
+SNAPSHOT_DIRNAME = "snapshots"
+
+# Name of the pointer file holding the current snapshot's file name
+CURRENT_POINTER = "CURRENT"
+
+# Snapshots kept on disk; older ones are deleted on publish
+KEEP_SNAPSHOTS = 3
+
+# Read-only connection to the current snapshot, per database
+_read_pool: dict[Path, "_PooledSnapshot"] = {}
+# Reentrant: a cursor collected while its thread holds the lock releases itself
+# through __del__, which takes the lock again
+_read_pool_lock = threading.RLock()
+
+# Opt-in query profiling of every connection: "1" (timings) or "full" (plus
+# DuckDB's profile), and the JSON Lines file the query records are appended to
+PROFILING_ENV = "MONEYPLOT_QUERY_PROFILING"
+QUERY_LOG_ENV = "MONEYPLOT_QUERY_LOG"
+
+# Query records kept in memory by a profiler (the most recent ones)
+PROFILE_MAX_RECORDS = 5000
+
+# Queries slower than this are logged as warnings and counted as slow
+SLOW_QUERY_SECONDS = 0.5
+
+# Operators kept, by time, from DuckDB's profile of a query
+PROFILE_TOP_OPERATORS = 5
+
+# Query shape: literals and IN lists replaced by placeholders, whitespace collapsed
+_SHAPE_PATTERNS = [
+    (re.compile(r"--[^\n]*"), ""),
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)"), "(?, ...)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def get_connection(
+    db_path: Path | str | None = None, profiler: "QueryProfiler | None" = None
+) -> duckdb.DuckDBPyConnection:
+    """Return a DuckDB connection. Creates the file and parent dirs if needed.
 
-def get_connection(db_path: Path | str | None = None) -> duckdb.DuckDBPyConnection:
-    """Return a DuckDB connection. Creates the file and parent dirs if needed."""
+    The connection is instrumented when a ``profiler`` is given or profiling is
+    enabled for the process (see ``default_profiler``).
+    """
     path = Path(db_path) if db_path else DEFAULT_DB_PATH
     path.parent.mkdir(parents=True, exist_ok=True)
-    return duckdb.connect(str(path))
+    return _instrument(duckdb.connect(str(path)), profiler)
+
+
+def get_read_connection(
+    db_path: Path | str | None = None, profiler: "QueryProfiler | None" = None
+) -> duckdb.DuckDBPyConnection:
+    """Return a read-only cursor on the current snapshot of a database.
+
+    Cursors share one pooled connection per snapshot, which is swapped for a
+    new one as soon as a newer snapshot is published; cursors already handed
+    out keep reading the snapshot they started on, and the superseded
+    connection is closed with the last of them. Closing a cursor is cheap.
+    Before the first publish, falls back to a (non-pooled) read-only
+    connection to the live database. Instrumented like ``get_connection``.
+    """
+    path = Path(db_path) if db_path else DEFAULT_DB_PATH
+    snapshot = current_snapshot(path)
+    if snapshot is None:
+        return _instrument(duckdb.connect(str(path), read_only=True), profiler)
+
+    with _read_pool_lock:
+        pooled = _read_pool.get(path)
+        if pooled is None or pooled.snapshot != snapshot:
+            if pooled is not None:
+                pooled.retire()
+            pooled = _read_pool[path] = _PooledSnapshot(
+                snapshot, duckdb.connect(str(snapshot), read_only=True)
+            )
+        pooled.cursors += 1
+        return _instrument(_SnapshotCursor(pooled, pooled.con.cursor()), profiler)
+
+
+@dataclass
+class _PooledSnapshot:
+    """The pooled connection to one snapshot and the number of its open cursors."""
+
+    snapshot: Path
+    con: duckdb.DuckDBPyConnection
+    cursors: int = 0
+    retired: bool = False
+
+    def retire(self) -> None:
+        """Mark superseded; closed now if unused, else by its last cursor. Lock held."""
+        self.retired = True
+        if self.cursors == 0:
+            self.con.close()
+
+    def release(self) -> None:
+        with _read_pool_lock:
+            self.cursors -= 1
+            if self.retired and self.cursors == 0:
+                self.con.close()
+
+
+class _SnapshotCursor:
+    """A cursor on a pooled snapshot connection; closing it releases the connection.
+
+    Closing the connection closes its cursors, so a superseded connection is
+    only closed once every cursor taken from it has been closed (or collected).
+    """
+
+    def __init__(self, pooled: _PooledSnapshot, cursor: duckdb.DuckDBPyConnection):
+        self._pooled = pooled
+        self._cursor = cursor
+        self._closed = False
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._cursor.close()
+        self._pooled.release()
+
+    def __enter__(self) -> "_SnapshotCursor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        # Pages that stop early (st.stop) may never close their cursor
+        self.close()
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
+
+
+# ── Query profiling ──────────────────────────────────────────────────────────
+
+
+@dataclass
+class QueryRecord:
+    """One query run through an ``InstrumentedConnection``.
+
+    ``seconds`` covers execution and fetching (the time the caller waited);
+    ``rows`` is None when the result was not fetched. ``profile`` holds a
+    summary of DuckDB's profile when the profiler asks for it.
+    """
+
+    sql: str
+    shape: str
+    started_at: float
+    seconds: float
+    rows: int | None = None
+    profile: dict | None = None
+    error: str | None = None
+
+
+@dataclass
+class ShapeStats:
+    """Aggregated timings of the queries sharing a shape."""
+
+    shape: str
+    count: int
+    total_seconds: float
+    mean_seconds: float
+    max_seconds: float
+    slow: int
+    mean_rows: float | None
+    example: str = field(repr=False)
+
+
+class QueryProfiler:
+    """Thread-safe store of query records, with an optional JSON Lines sink.
+
+    Keeps the last ``max_records`` records in memory. Each record is also
+    logged (at DEBUG, or WARNING beyond ``slow_seconds``) and appended to
+    ``sink`` if set. With ``duckdb_profile``, instrumented connections enable
+    DuckDB's profiler and attach a summary of each query's profile.
+    """
+
+    def __init__(
+        self,
+        max_records: int = PROFILE_MAX_RECORDS,
+        sink: Path | str | None = None,
+        slow_seconds: float = SLOW_QUERY_SECONDS,
+        duckdb_profile: bool = False,
+    ):
+        self.sink = Path(sink) if sink else None
+        self.slow_seconds = slow_seconds
+        self.duckdb_profile = duckdb_profile
+        self._records: deque[QueryRecord] = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def record(self, rec: QueryRecord) -> None:
+        with self._lock:
+            self._records.append(rec)
+            if self.sink:
+                with open(self.sink, "a") as f:
+                    f.write(json.dumps(asdict(rec), default=str) + "\n")
+        level = logging.WARNING if rec.seconds >= self.slow_seconds else logging.DEBUG
+        logger.log(level, "Query took %.3f s, %s rows: %s", rec.seconds, rec.rows, rec.shape)
+
+    def records(self) -> list[QueryRecord]:
+        """Return the records kept, oldest first."""
+        with self._lock:
+            return list(self._records)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+
+    def slowest_shapes(self, limit: int = 10) -> list[ShapeStats]:
+        """Return the query shapes that took the most time overall, slowest first.
+
+        Shapes with a high total are the candidates for pre-aggregation: they
+        are slow, frequent, or both.
+        """
+        by_shape: dict[str, list[QueryRecord]] = {}
+        for rec in self.records():
+            by_shape.setdefault(rec.shape, []).append(rec)
+
+        stats = []
+        for shape, recs in by_shape.items():
+            seconds = [r.seconds for r in recs]
+            rows = [r.rows for r in recs if r.rows is not None]
+            stats.append(ShapeStats(
+                shape=shape,
+                count=len(recs),
+                total_seconds=sum(seconds),
+                mean_seconds=sum(seconds) / len(seconds),
+                max_seconds=max(seconds),
+                slow=sum(s >= self.slow_seconds for s in seconds),
+                mean_rows=sum(rows) / len(rows) if rows else None,
+                example=recs[-1].sql,
+            ))
+        return sorted(stats, key=lambda s: s.total_seconds, reverse=True)[:limit]
+
+
+class InstrumentedConnection:
+    """A DuckDB connection or cursor that records its queries in a ``QueryProfiler``.
+
+    ``execute`` and the fetch methods are timed; the record of a query is
+    completed by its first fetch, or by the next ``execute`` (or ``close``) if
+    the result is never fetched. Everything else is delegated to the wrapped
+    connection, so the wrapper can be used wherever a connection is expected.
+    """
+
+    _FETCHES = (
+        "fetchall", "fetchone", "fetchmany", "fetchdf", "df", "fetchnumpy",
+        "arrow", "fetch_arrow_table", "pl",
+    )
+
+    def __init__(self, con: duckdb.DuckDBPyConnection, profiler: QueryProfiler):
+        self._con = con
+        self._profiler = profiler
+        self._pending: QueryRecord | None = None
+        if profiler.duckdb_profile:
+            con.execute("SET enable_profiling = 'no_output'")
+
+    def execute(self, query: str, parameters=None) -> "InstrumentedConnection":
+        self._finish()
+        rec = QueryRecord(query, query_shape(query), time.time(), 0.0)
+        start = time.perf_counter()
+        try:
+            self._con.execute(query, parameters)
+        except Exception as exc:
+            rec.seconds, rec.error = time.perf_counter() - start, str(exc)
+            self._profiler.record(rec)
+            raise
+        rec.seconds = time.perf_counter() - start
+        self._pending = rec
+        return self
+
+    def cursor(self) -> "InstrumentedConnection":
+        return InstrumentedConnection(self._con.cursor(), self._profiler)
+
+    def close(self) -> None:
+        self._finish()
+        self._con.close()
+
+    def __enter__(self) -> "InstrumentedConnection":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._con, name)
+        if name not in self._FETCHES:
+            return attr
+
+        def fetch(*args, **kwargs):
+            start = time.perf_counter()
+            result = attr(*args, **kwargs)
+            self._finish(time.perf_counter() - start, _row_count(result))
+            return result
+
+        return fetch
+
+    def _finish(self, fetch_seconds: float = 0.0, rows: int | None = None) -> None:
+        """Record the pending query, adding the time spent fetching its result."""
+        rec, self._pending = self._pending, None
+        if rec is None:
+            return
+        rec.seconds += fetch_seconds
+        rec.rows = rows
+        if self._profiler.duckdb_profile:
+            rec.profile = _profile_summary(self._con)
+        self._profiler.record(rec)
+
+
+_default_profiler: QueryProfiler | None = None
+_default_profiler_lock = threading.Lock()
+
+
+def default_profiler() -> QueryProfiler | None:
+    """Return the process-wide profiler, or None unless ``MONEYPLOT_QUERY_PROFILING`` is set."""
+    global _default_profiler
+    mode = os.environ.get(PROFILING_ENV, "").strip().lower()
+    if mode in ("", "0", "false", "off"):
+        return None
+    with _default_profiler_lock:
+        if _default_profiler is None:
+            _default_profiler = QueryProfiler(
+                sink=os.environ.get(QUERY_LOG_ENV) or None, duckdb_profile=mode == "full"
+            )
+        return _default_profiler
+
+
+def query_shape(query: str) -> str:
+    """Normalise a query to its shape, so runs differing only by literals group together."""
+    shape = query
+    for pattern, replacement in _SHAPE_PATTERNS:
+        shape = pattern.sub(replacement, shape)
+    return shape.strip()
+
+
+def _instrument(
+    con: duckdb.DuckDBPyConnection, profiler: QueryProfiler | None
+) -> duckdb.DuckDBPyConnection:
+    profiler = profiler or default_profiler()
+    return InstrumentedConnection(con, profiler) if profiler else con
+
+
+def _row_count(result) -> int | None:
+    if result is None:
+        return 0
+    if isinstance(result, tuple):  # fetchone
+        return 1
+    if hasattr(result, "num_rows"):  # Arrow table
+        return result.num_rows
+    if isinstance(result, dict):  # fetchnumpy
+        return len(next(iter(result.values()), []))
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+
+def _profile_summary(con: duckdb.DuckDBPyConnection) -> dict | None:
+    """Summarise DuckDB's profile of the last query: totals and the slowest operators."""
+    try:
+        profile = json.loads(con.get_profiling_information(format="json"))
+    except (duckdb.Error, ValueError):
+        return None
+    operators = []
+    stack = list(profile.get("children", []))
+    while stack:
+        node = stack.pop()
+        stack.extend(node.get("children", []))
+        operators.append({
+            "operator": node.get("operator_name") or node.get("operator_type"),
+            "seconds": node.get("operator_timing", 0.0),
+            "rows": node.get("operator_cardinality"),
+        })
+    operators.sort(key=lambda o: o["seconds"], reverse=True)
+    return {
+        "latency": profile.get("latency"),
+        "cpu_time": profile.get("cpu_time"),
+        "rows_scanned": profile.get("cumulative_rows_scanned"),
+        "peak_buffer_memory": profile.get("system_peak_buffer_memory"),
+        "operators": operators[:PROFILE_TOP_OPERATORS],
+    }
+
+
+def snapshot_dir(db_path: Path | str | None = None) -> Path:
+    return (Path(db_path) if db_path else DEFAULT_DB_PATH).parent / SNAPSHOT_DIRNAME
+
+
+def current_snapshot(db_path: Path | str | None = None) -> Path | None:
+    """Return the current snapshot of a database, or None if none was published."""
+    directory = snapshot_dir(db_path)
+    try:
+        name = (directory / CURRENT_POINTER).read_text().strip()
+    except FileNotFoundError:
+        return None
+    return directory / name
+
+
+def read_data_version(db_path: Path | str | None = None) -> str:
+    """Return the data version of a database or snapshot file.
+
+    The version is the snapshot id: a snapshot is immutable, so its version is
+    its own id, and a live database is at the version of its current snapshot
+    ("0" before the first publish).
+    """
+    path = Path(db_path) if db_path else DEFAULT_DB_PATH
+    if path.parent.name == SNAPSHOT_DIRNAME:
+        return path.stem
+    snapshot = current_snapshot(path)
+    return snapshot.stem if snapshot else "0"
+
+
+def database_path(con: duckdb.DuckDBPyConnection) -> str:
+    """Return the file a connection reads ("" for an in-memory database).
+
+    The lookup bypasses an ``InstrumentedConnection``, so that it does not show
+    up in the profiler next to every query it is made for.
+    """
+    if isinstance(con, InstrumentedConnection):
+        # The lookup replaces the result of the pending query: record it first
+        con._finish()
+        con = con._con
+    return con.execute(
+        "SELECT path FROM duckdb_databases() WHERE database_name = current_database()"
+    ).fetchone()[0] or ""
+
+
+def publish_snapshot(db_path: Path | str | None = None) -> Path:
+    """Publish an immutable copy of the live database for readers.
+
+    The database is checkpointed (so the file holds every committed write and
+    no WAL), copied under a new snapshot id, and the ``CURRENT`` pointer is
+    swapped atomically. Must not run concurrently with writes: the pipeline
+    calls it once per run from the ``published_snapshot`` asset, which holds
+    the "duckdb" concurrency slot.
+    Returns the new snapshot's path.
+    """
+    path = Path(db_path) if db_path else DEFAULT_DB_PATH
+    directory = snapshot_dir(path)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    con = duckdb.connect(str(path))
+    con.execute("CHECKPOINT")
+    con.close()
+
+    snapshot = directory / f"{path.stem}-{time.time_ns()}{path.suffix}"
+    tmp = snapshot.with_name(snapshot.name + ".part")
+    shutil.copyfile(path, tmp)
+    tmp.replace(snapshot)
+
+    pointer = directory / CURRENT_POINTER
+    pointer_tmp = directory / f"{CURRENT_POINTER}.{os.getpid()}.part"
+    pointer_tmp.write_text(snapshot.name)
+    pointer_tmp.replace(pointer)
+    logger.info("Published snapshot %s", snapshot.name)
+
+    _prune_snapshots(directory, path, keep=snapshot)
+    return snapshot
+
+
+def _prune_snapshots(directory: Path, db_path: Path, keep: Path) -> None:
+    """Delete all but the ``KEEP_SNAPSHOTS`` most recent snapshots.
+
+    Readers still on a deleted snapshot keep reading it (the file is unlinked,
+    not truncated) until they take a new cursor.
+    """
+    # Ids are fixed-width timestamps: name order is publication order
+    snapshots = sorted(directory.glob(f"{db_path.stem}-*{db_path.suffix}"))
+    for old in snapshots[:-KEEP_SNAPSHOTS]:
+        if old != keep:
+            old.unlink(missing_ok=True)
@@ -0,0 +1,636 @@
+"""Dashboard read API — price statistics served from the rollups, or from mutations.
+
+Each function answers one dashboard question. It reads the ``prix_rollups``
+(or, for the map, ``prix_grille``; for proximity search, ``mutations_geo``)
+table when it has been built, and otherwise aggregates the raw ``mutations``
+table the same way, so pages work (slowly) before the first rollup refresh.
+Results are cached until the data version changes. ``None`` filters mean "all".
+"""
+
+import duckdb
+import pandas as pd
+
+from moneyplot.ingestion.ecb import ECB_SERIES_KEY
+from moneyplot.storage.cache import cached_fetchdf
+from moneyplot.transform.communes import SEARCH_KEY_SQL
+from moneyplot.transform.geo import DISTANCE_SQL, cell_range, radius_bbox
+from moneyplot.transform.rollups import GRID_SIZES_KM, KM_PER_DEGREE_LAT, KM_PER_DEGREE_LON
+
+# Most grid cells sent to the map when the grid size is picked automatically
+MAX_GRID_CELLS = 4000
+
+# Percentiles of the price per m² reported for distributions
+PERCENTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+# Most sales returned by a bounding-box or radius search
+MAX_NEARBY_SALES = 5000
+
+# Columns of the sales returned by bounding-box and radius searches
+_SALE_COLUMNS = """
+    id_mutation, date_mutation, code_commune, nom_commune, type_local, valeur_fonciere,
+    surface_reelle_bati, nombre_pieces, prix_m2, latitude, longitude
+"""
+
+
+def rollups_ready(con: duckdb.DuckDBPyConnection) -> bool:
+    """Whether ``prix_rollups`` has been built."""
+    ready = cached_fetchdf(con, "SELECT EXISTS (SELECT 1 FROM prix_rollups) AS ready")
+    return bool(ready["ready"].iloc[0])
+
+
+def communes_ready(con: duckdb.DuckDBPyConnection) -> bool:
+    """Whether the ``communes`` table has been built."""
+    ready = cached_fetchdf(
+        con, "SELECT EXISTS (SELECT 1 FROM communes WHERE nom_recherche IS NOT NULL) AS ready"
+    )
+    return bool(ready["ready"].iloc[0])
+
+
+def grid_ready(con: duckdb.DuckDBPyConnection) -> bool:
+    """Whether ``prix_grille`` has been built."""
+    ready = cached_fetchdf(con, "SELECT EXISTS (SELECT 1 FROM prix_grille) AS ready")
+    return bool(ready["ready"].iloc[0])
+
+
+def geo_index_ready(con: duckdb.DuckDBPyConnection) -> bool:
+    """Whether ``mutations_geo`` has been built."""
+    ready = cached_fetchdf(con, "SELECT EXISTS (SELECT 1 FROM mutations_geo) AS ready")
+    return bool(ready["ready"].iloc[0])
+
+
+def mutations_summary(con: duckdb.DuckDBPyConnection) -> pd.DataFrame:
+    """Sales count and date range. Columns: total, date_min, date_max."""
+    return cached_fetchdf(con, """
+        SELECT count(*) AS total, min(date_mutation) AS date_min, max(date_mutation) AS date_max
+        FROM mutations
+    """)
+
+
+def mortgage_rates(con: duckdb.DuckDBPyConnection, serie: str = ECB_SERIES_KEY) -> pd.DataFrame:
+    """Monthly mortgage rates of one ECB series (French by default). Columns: date, taux."""
+    # Rows without a serie predate it and are the French series' until the next ECB sync
+    return cached_fetchdf(
+        con,
+        "SELECT date, taux FROM taux_hypothecaires WHERE coalesce(serie, ?) = ? ORDER BY date",
+        [ECB_SERIES_KEY, serie],
+    )
+
+
+def list_departements(con: duckdb.DuckDBPyConnection) -> list[str]:
+    if rollups_ready(con):
+        query = """
+            SELECT DISTINCT code_departement FROM prix_rollups
+            WHERE niveau = 'departement' ORDER BY 1
+        """
+    else:
+        query = "SELECT DISTINCT code_departement FROM mutations ORDER BY 1"
+    return cached_fetchdf(con, query)["code_departement"].tolist()
+
+
+def list_types_local(con: duckdb.DuckDBPyConnection) -> list[str]:
+    if rollups_ready(con):
+        query = """
+            SELECT DISTINCT type_local FROM prix_rollups
+            WHERE niveau = 'france' AND type_local IS NOT NULL ORDER BY 1
+        """
+    else:
+        query = "SELECT DISTINCT type_local FROM mutations ORDER BY 1"
+    return cached_fetchdf(con, query)["type_local"].tolist()
+
+
+def list_annees(con: duckdb.DuckDBPyConnection) -> list[int]:
+    """Years with sales, most recent first."""
+    if rollups_ready(con):
+        query = """
+            SELECT DISTINCT annee FROM prix_rollups
+            WHERE niveau = 'france' AND annee IS NOT NULL ORDER BY 1 DESC
+        """
+    else:
+        query = "SELECT DISTINCT annee FROM mutations ORDER BY annee DESC"
+    return [int(y) for y in cached_fetchdf(con, query)["annee"].tolist()]
+
+
+def search_communes(
+    con: duckdb.DuckDBPyConnection, text: str, limit: int = 20
+) -> pd.DataFrame:
+    """Communes whose name starts with ``text``, ignoring case, accents and punctuation.
+
+    Communes with the most sales come first.
+    Columns: code_commune, nom_commune, code_departement, nb_transactions.
+    """
+    key = SEARCH_KEY_SQL.format("?")
+    if communes_ready(con):
+        query = f"""
+            SELECT code_commune, nom_commune, code_departement, nb_transactions
+            FROM communes
+            WHERE starts_with(nom_recherche, {key})
+            ORDER BY nb_transactions DESC, nom_commune
+            LIMIT ?
+        """
+    else:
+        query = f"""
+            SELECT code_commune, max(nom_commune) AS nom_commune,
+                   max(code_departement) AS code_departement, count(*) AS nb_transactions
+            FROM mutations
+            WHERE starts_with({SEARCH_KEY_SQL.format("nom_commune")}, {key})
+            GROUP BY code_commune
+            ORDER BY nb_transactions DESC, nom_commune
+            LIMIT ?
+        """
+    return cached_fetchdf(con, query, [text, limit])
+
+
+def commune_names(con: duckdb.DuckDBPyConnection, communes: list[str]) -> pd.DataFrame:
+    """Name and department of the communes. Columns: code_commune, nom_commune, code_departement."""
+    if communes_ready(con):
+        query = """
+            SELECT code_commune, nom_commune, code_departement FROM communes
+            WHERE code_commune IN (SELECT unnest(?::VARCHAR[]))
+        """
+    else:
+        query = """
+            SELECT code_commune, max(nom_commune) AS nom_commune,
+                   max(code_departement) AS code_departement
+            FROM mutations
+            WHERE code_commune IN (SELECT unnest(?::VARCHAR[]))
+            GROUP BY code_commune
+        """
+    return cached_fetchdf(con, query, [communes])
+
+
+def commune_prices(
+    con: duckdb.DuckDBPyConnection,
+    departement: str | None = None,
+    type_local: str | None = None,
+    annee: int | None = None,
+    min_transactions: int = 5,
+    limit: int | None = None,
+) -> pd.DataFrame:
+    """Median price per m² and sales count of each located commune, most expensive first.
+
+    Only the first ``limit`` communes are returned if set.
+    Columns: nom_commune, code_commune, lat, lon, prix_m2_median, nb_transactions.
+    """
+    if rollups_ready(con):
+        where, params = _rollup_filters("commune", type_local, annee=annee)
+        if departement is not None:
+            where += " AND code_departement = ?"
+            params.append(departement)
+        # Centroids come from the communes dimension, once it is built
+        query = f"""
+            SELECT r.nom_commune, r.code_commune,
+                   coalesce(c.latitude, r.latitude) AS lat,
+                   coalesce(c.longitude, r.longitude) AS lon,
+                   r.prix_m2_median, r.nb_transactions
+            FROM (SELECT * FROM prix_rollups WHERE {where}) r
+            LEFT JOIN communes c USING (code_commune)
+            WHERE lat IS NOT NULL AND r.nb_transactions >= ?
+            ORDER BY r.prix_m2_median DESC
+        """
+    else:
+        where, params = _raw_filters(type_local, annee=annee)
+        if departement is not None:
+            where += " AND code_departement = ?"
+            params.append(departement)
+        query = f"""
+            SELECT nom_commune, code_commune, AVG(latitude) AS lat, AVG(longitude) AS lon,
+                   MEDIAN(prix_m2) AS prix_m2_median, COUNT(*) AS nb_transactions
+            FROM mutations
+            WHERE {where}
+            GROUP BY nom_commune, code_commune
+            HAVING lat IS NOT NULL AND COUNT(*) >= ?
+            ORDER BY prix_m2_median DESC
+        """
+    params.append(min_transactions)
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return cached_fetchdf(con, query, params)
+
+
+def price_grid_sizes(
+    con: duckdb.DuckDBPyConnection,
+    departement: str | None = None,
+    type_local: str | None = None,
+    annee: int | None = None,
+    min_transactions: int = 5,
+) -> pd.DataFrame:
+    """Number of map grid cells at each grid size, coarsest first.
+
+    Columns: taille_km, nb_cells.
+    """
+    cells, params = _grid_cells(con, None, departement, type_local, annee, min_transactions)
+    query = f"""
+        SELECT s.taille_km, count(c.taille_km) AS nb_cells
+        FROM (SELECT unnest(?::INTEGER[]) AS taille_km) s
+        LEFT JOIN ({cells}) c USING (taille_km)
+        GROUP BY s.taille_km
+        ORDER BY s.taille_km DESC
+    """
+    return cached_fetchdf(con, query, [list(GRID_SIZES_KM), *params])
+
+
+def pick_grid_size(sizes: pd.DataFrame, max_cells: int = MAX_GRID_CELLS) -> int:
+    """Grid size showing the most cells, up to ``max_cells`` (the coarsest if none fits).
+
+    Cells under the sales threshold are hidden, so a finer grid can show fewer
+    cells than a coarser one: the number of cells, not the size, is maximised.
+    """
+    fitting = sizes[(sizes["nb_cells"] > 0) & (sizes["nb_cells"] <= max_cells)]
+    if fitting.empty:
+        return int(sizes["taille_km"].max())
+    # Finest first, so that ties go to the finer grid
+    fitting = fitting.sort_values("taille_km")
+    return int(fitting.loc[fitting["nb_cells"].idxmax(), "taille_km"])
+
+
+def price_grid(
+    con: duckdb.DuckDBPyConnection,
+    taille_km: int,
+    departement: str | None = None,
+    type_local: str | None = None,
+    annee: int | None = None,
+    min_transactions: int = 5,
+) -> pd.DataFrame:
+    """Median price per m² and sales count of the map grid cells of one size.
+
+    With ``departement``, only the cells holding some of its sales. Each cell
+    comes with its bounds and a fill colour, from green (5th percentile of the
+    cell medians) to red (95th percentile).
+    Columns: lon_min, lat_min, lon_max, lat_max, lon, lat, prix_m2_median,
+    nb_transactions, r, g, b.
+    """
+    cells, params = _grid_cells(con, taille_km, departement, type_local, annee, min_transactions)
+    query = f"""
+        WITH cells AS ({cells}),
+        scale AS (
+            SELECT quantile_cont(prix_m2_median, 0.05) AS lo,
+                   quantile_cont(prix_m2_median, 0.95) AS hi
+            FROM cells
+        ),
+        scaled AS (
+            SELECT cells.*,
+                   greatest(0, least(1, coalesce((prix_m2_median - lo) / nullif(hi - lo, 0), 0)))
+                       AS t
+            FROM cells, scale
+        )
+        SELECT lon_min, lat_min, lon_max, lat_max,
+               (lon_min + lon_max) / 2 AS lon, (lat_min + lat_max) / 2 AS lat,
+               prix_m2_median, nb_transactions,
+               (255 * t)::INTEGER AS r, (200 * (1 - t))::INTEGER AS g, 80 AS b
+        FROM scaled
+        ORDER BY prix_m2_median DESC
+    """
+    return cached_fetchdf(con, query, params)
+
+
+def departement_quarterly(
+    con: duckdb.DuckDBPyConnection,
+    departements: list[str],
+    type_local: str | None = None,
+) -> pd.DataFrame:
+    """Quarterly price statistics of each department.
+
+    Medians are approximate: the rollups merge them from commune sketches
+    (within ``SKETCH_RELATIVE_ACCURACY``), unless the rollups were built exact
+    (see ``transform.rollups``); before the rollups are built they are
+    estimated with ``approx_quantile`` instead of sorting every sale.
+    Columns: annee, trimestre, code_departement, prix_m2_median, prix_m2_moyen,
+    nb_transactions.
+    """
+    return _quarterly(con, "departement", "code_departement", departements, type_local)
+
+
+def commune_quarterly(
+    con: duckdb.DuckDBPyConnection, communes: list[str], type_local: str | None = None
+) -> pd.DataFrame:
+    """Quarterly price statistics of each commune.
+
+    Columns: annee, trimestre, code_commune, nom_commune, prix_m2_median,
+    prix_m2_moyen, nb_transactions.
+    """
+    return _quarterly(con, "commune", "code_commune", communes, type_local)
+
+
+def commune_metrics(
+    con: duckdb.DuckDBPyConnection, communes: list[str], type_local: str | None = None
+) -> pd.DataFrame:
+    """All-time key figures of each commune.
+
+    Columns: code_commune, nom_commune, code_departement, prix_m2_median,
+    prix_m2_moyen, nb_transactions, surface_mediane, prix_median.
+    """
+    if rollups_ready(con):
+        where, params = _rollup_filters("commune", type_local)
+        query = f"""
+            SELECT code_commune, nom_commune, code_departement, prix_m2_median,
+                   prix_m2_moyen, nb_transactions, surface_mediane, prix_median
+            FROM prix_rollups
+            WHERE {where} AND code_commune IN (SELECT unnest(?::VARCHAR[]))
+        """
+    else:
+        where, params = _raw_filters(type_local)
+        query = f"""
+            SELECT code_commune, max(nom_commune) AS nom_commune, code_departement,
+                   MEDIAN(prix_m2) AS prix_m2_median, AVG(prix_m2) AS prix_m2_moyen,
+                   COUNT(*) AS nb_transactions, MEDIAN(surface_reelle_bati) AS surface_mediane,
+                   MEDIAN(valeur_fonciere) AS prix_median
+            FROM mutations
+            WHERE {where} AND code_commune IN (SELECT unnest(?::VARCHAR[]))
+            GROUP BY code_commune, code_departement
+        """
+    return cached_fetchdf(con, query, [*params, communes])
+
+
+def commune_prix_m2_histogram(
+    con: duckdb.DuckDBPyConnection,
+    communes: list[str],
+    type_local: str | None = None,
+    nb_bins: int = 50,
+    quantile_bins: bool = False,
+    max_prix_m2: float | None = None,
+) -> pd.DataFrame:
+    """Histogram of the price per m² of the sales in each commune, binned in DuckDB.
+
+    All communes share the same bins: ``nb_bins`` of equal width between the
+    lowest and highest price of the selected sales, or with ``quantile_bins``,
+    bins holding about the same number of those sales (fewer bins if quantiles
+    coincide). The result size depends on the number of bins, not of sales.
+    Columns: code_commune, nom_commune, bin, bin_start, bin_end, nb_transactions.
+    """
+    where, params = _raw_filters(type_local)
+    if max_prix_m2 is not None:
+        where += " AND prix_m2 < ?"
+        params.append(max_prix_m2)
+    if quantile_bins:
+        edges = """
+            SELECT bin, q[bin + 1] AS bin_start, q[bin + 2] AS bin_end
+            FROM (
+                SELECT q, unnest(range(len(q) - 1)) AS bin
+                FROM (SELECT list_sort(list_distinct(quantile_cont(prix_m2, ?))) AS q FROM sales)
+            )
+        """
+        edge_params = [[i / nb_bins for i in range(nb_bins + 1)]]
+    else:
+        edges = """
+            SELECT bin, lo + bin * width AS bin_start, lo + (bin + 1) * width AS bin_end
+            FROM (SELECT min(prix_m2) AS lo, (max(prix_m2) - min(prix_m2)) / ? AS width FROM sales),
+                 (SELECT unnest(range(?)) AS bin)
+        """
+        edge_params = [nb_bins, nb_bins]
+    # Each sale falls in the last bin starting at or below its price
+    query = f"""
+        WITH sales AS (
+            SELECT code_commune, nom_commune, prix_m2
+            FROM mutations
+            WHERE {where} AND code_commune IN (SELECT unnest(?::VARCHAR[]))
+        ),
+        edges AS ({edges})
+        SELECT s.code_commune, max(s.nom_commune) AS nom_commune,
+               e.bin, e.bin_start, e.bin_end, count(*) AS nb_transactions
+        FROM sales s
+        ASOF JOIN edges e ON s.prix_m2 >= e.bin_start
+        GROUP BY s.code_commune, e.bin, e.bin_start, e.bin_end
+        ORDER BY s.code_commune, e.bin
+    """
+    return cached_fetchdf(con, query, [*params, communes, *edge_params])
+
+
+def commune_prix_m2_percentiles(
+    con: duckdb.DuckDBPyConnection,
+    communes: list[str],
+    type_local: str | None = None,
+) -> pd.DataFrame:
+    """Percentiles of the price per m² of the sales in each commune.
+
+    Columns: code_commune, nom_commune, nb_transactions, then p10, p25, p50,
+    p75 and p90 (one per entry of ``PERCENTILES``).
+    """
+    where, params = _raw_filters(type_local)
+    columns = ", ".join(f"q[{i + 1}] AS p{round(p * 100)}" for i, p in enumerate(PERCENTILES))
+    query = f"""
+        SELECT code_commune, nom_commune, nb_transactions, {columns}
+        FROM (
+            SELECT code_commune, max(nom_commune) AS nom_commune, count(*) AS nb_transactions,
+                   quantile_cont(prix_m2, ?) AS q
+            FROM mutations
+            WHERE {where} AND code_commune IN (SELECT unnest(?::VARCHAR[]))
+            GROUP BY code_commune
+        )
+        ORDER BY code_commune
+    """
+    return cached_fetchdf(con, query, [list(PERCENTILES), *params, communes])
+
+
+def sales_in_bbox(
+    con: duckdb.DuckDBPyConnection,
+    lon_min: float,
+    lat_min: float,
+    lon_max: float,
+    lat_max: float,
+    type_local: str | None = None,
+    annee_min: int | None = None,
+    limit: int = MAX_NEARBY_SALES,
+) -> pd.DataFrame:
+    """Sales located in a bounding box, most recent first.
+
+    Columns: id_mutation, date_mutation, code_commune, nom_commune, type_local,
+    valeur_fonciere, surface_reelle_bati, nombre_pieces, prix_m2, latitude, longitude.
+    """
+    source, where, params = _located_sales(
+        con, (lon_min, lat_min, lon_max, lat_max), type_local, annee_min
+    )
+    query = f"""
+        SELECT {_SALE_COLUMNS}
+        FROM {source}
+        WHERE {where}
+        ORDER BY date_mutation DESC
+        LIMIT ?
+    """
+    return cached_fetchdf(con, query, [*params, limit])
+
+
+def sales_near(
+    con: duckdb.DuckDBPyConnection,
+    latitude: float,
+    longitude: float,
+    radius_m: float,
+    type_local: str | None = None,
+    annee_min: int | None = None,
+    limit: int = MAX_NEARBY_SALES,
+) -> pd.DataFrame:
+    """Sales within ``radius_m`` metres of a point, closest first.
+
+    Columns: those of ``sales_in_bbox``, plus distance_m.
+    """
+    source, where, params = _located_sales(
+        con, radius_bbox(latitude, longitude, radius_m), type_local, annee_min
+    )
+    distance = DISTANCE_SQL.format(lat="center.lat", lon="center.lon")
+    query = f"""
+        SELECT {_SALE_COLUMNS}, distance_m
+        FROM (
+            SELECT *, {distance} AS distance_m
+            FROM {source}, (SELECT ?::DOUBLE AS lat, ?::DOUBLE AS lon) AS center
+            WHERE {where}
+        )
+        WHERE distance_m <= ?
+        ORDER BY distance_m
+        LIMIT ?
+    """
+    return cached_fetchdf(con, query, [latitude, longitude, *params, radius_m, limit])
+
+
+def _located_sales(
+    con: duckdb.DuckDBPyConnection,
+    bbox: tuple[float, float, float, float],
+    type_local: str | None,
+    annee_min: int | None,
+) -> tuple[str, str, list]:
+    """Table and WHERE clause selecting the sales in ``bbox`` (lon_min, lat_min, lon_max, lat_max).
+
+    On ``mutations_geo`` the range of index cells comes first: it is what lets
+    DuckDB skip the row groups outside the box.
+    """
+    lon_min, lat_min, lon_max, lat_max = bbox
+    clauses = ["latitude BETWEEN ? AND ?", "longitude BETWEEN ? AND ?"]
+    params = [lat_min, lat_max, lon_min, lon_max]
+    source = "mutations"
+    if geo_index_ready(con):
+        x_min, x_max, y_min, y_max = cell_range(lon_min, lat_min, lon_max, lat_max)
+        clauses[:0] = ["cell_y BETWEEN ? AND ?", "cell_x BETWEEN ? AND ?"]
+        params[:0] = [y_min, y_max, x_min, x_max]
+        source = "mutations_geo"
+    if type_local is not None:
+        clauses.append("type_local = ?")
+        params.append(type_local)
+    if annee_min is not None:
+        clauses.append("annee >= ?")
+        params.append(annee_min)
+    return source, " AND ".join(clauses), params
+
+
+def _quarterly(
+    con: duckdb.DuckDBPyConnection,
+    niveau: str,
+    key: str,
+    codes: list[str],
+    type_local: str | None,
+) -> pd.DataFrame:
+    names = ", nom_commune" if niveau == "commune" else ""
+    if rollups_ready(con):
+        where, params = _rollup_filters(niveau, type_local, quarterly=True)
+        query = f"""
+            SELECT annee, trimestre, {key}{names}, prix_m2_median, prix_m2_moyen, nb_transactions
+            FROM prix_rollups
+            WHERE {where} AND {key} IN (SELECT unnest(?::VARCHAR[]))
+            ORDER BY annee, trimestre
+        """
+    else:
+        where, params = _raw_filters(type_local)
+        raw_names = ", max(nom_commune) AS nom_commune" if names else ""
+        exact = niveau == "commune"
+        median = "MEDIAN(prix_m2)" if exact else "approx_quantile(prix_m2, 0.5)"
+        query = f"""
+            SELECT annee, trimestre, {key}{raw_names}, {median} AS prix_m2_median,
+                   AVG(prix_m2) AS prix_m2_moyen, COUNT(*) AS nb_transactions
+            FROM mutations
+            WHERE {where} AND {key} IN (SELECT unnest(?::VARCHAR[]))
+            GROUP BY annee, trimestre, {key}
+            ORDER BY annee, trimestre
+        """
+    return cached_fetchdf(con, query, [*params, codes])
+
+
+def _grid_cells(
+    con: duckdb.DuckDBPyConnection,
+    taille_km: int | None,
+    departement: str | None,
+    type_local: str | None,
+    annee: int | None,
+    min_transactions: int,
+) -> tuple[str, list]:
+    """Query of the grid cells of one size (all sizes if None) matching the filters.
+
+    Columns: taille_km, lon_min, lat_min, lon_max, lat_max, prix_m2_median,
+    nb_transactions.
+    """
+    if grid_ready(con):
+        clauses, params = [], []
+        for column, value in (("taille_km", taille_km), ("type_local", type_local),
+                              ("annee", annee)):
+            if value is None and column != "taille_km":
+                clauses.append(f"{column} IS NULL")
+            elif value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if departement is not None:
+            clauses.append("list_contains(departements, ?)")
+            params.append(departement)
+        query = f"""
+            SELECT taille_km, lon_min, lat_min, lon_max, lat_max, prix_m2_median, nb_transactions
+            FROM prix_grille
+            WHERE {" AND ".join(clauses)} AND nb_transactions >= ?
+        """
+        return query, [*params, min_transactions]
+
+    where, params = _raw_filters(type_local, annee=annee)
+    if departement is not None:
+        where += " AND code_departement = ?"
+        params.append(departement)
+    sizes = [taille_km] if taille_km is not None else list(GRID_SIZES_KM)
+    query = f"""
+        SELECT taille_km, cell_x * taille_km / {KM_PER_DEGREE_LON} AS lon_min,
+               cell_y * taille_km / {KM_PER_DEGREE_LAT} AS lat_min,
+               (cell_x + 1) * taille_km / {KM_PER_DEGREE_LON} AS lon_max,
+               (cell_y + 1) * taille_km / {KM_PER_DEGREE_LAT} AS lat_max,
+               MEDIAN(prix_m2) AS prix_m2_median, COUNT(*) AS nb_transactions
+        FROM (
+            SELECT s.taille_km, prix_m2,
+                   floor(longitude * {KM_PER_DEGREE_LON} / s.taille_km)::INTEGER AS cell_x,
+                   floor(latitude * {KM_PER_DEGREE_LAT} / s.taille_km)::INTEGER AS cell_y
+            FROM mutations, (SELECT unnest(?::INTEGER[]) AS taille_km) s
+            WHERE {where} AND longitude IS NOT NULL AND latitude IS NOT NULL
+        )
+        GROUP BY taille_km, cell_x, cell_y
+        HAVING COUNT(*) >= ?
+    """
+    return query, [sizes, *params, min_transactions]
+
+
+def _rollup_filters(
+    niveau: str,
+    type_local: str | None,
+    annee: int | None = None,
+    quarterly: bool = False,
+) -> tuple[str, list]:
+    """WHERE clause selecting the rollup cells of a level, type and period.
+
+    Cells are per quarter with ``quarterly``, per year when ``annee`` is set,
+    and all-time otherwise.
+    """
+    clauses, params = ["niveau = ?"], [niveau]
+    if type_local is None:
+        clauses.append("type_local IS NULL")
+    else:
+        clauses.append("type_local = ?")
+        params.append(type_local)
+    if quarterly:
+        clauses.append("trimestre IS NOT NULL")
+    elif annee is not None:
+        clauses.append("annee = ? AND trimestre IS NULL")
+        params.append(annee)
+    else:
+        clauses.append("annee IS NULL")
+    return " AND ".join(clauses), params
+
+
+def _raw_filters(type_local: str | None, annee: int | None = None) -> tuple[str, list]:
+    clauses, params = ["prix_m2 IS NOT NULL"], []
+    if type_local is not None:
+        clauses.append("type_local = ?")
+        params.append(type_local)
+    if annee is not None:
+        clauses.append("annee = ?")
+        params.append(annee)
+    return " AND ".join(clauses), params
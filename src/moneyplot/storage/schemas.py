@@ -42,7 +42,20 @@ def create_tables(con: duckdb.DuckDBPyConnection) -> None:
         CREATE TABLE IF NOT EXISTS taux_hypothecaires (
             date    DATE,
             taux    DOUBLE,
-            source  VARCHAR
+            source  VARCHAR,
+            serie   VARCHAR
+        )
+    """)
+    # Column added after the first release, when only the French ECB series was
+    # loaded; the ECB sync assigns those rows to it
+    con.execute("ALTER TABLE taux_hypothecaires ADD COLUMN IF NOT EXISTS serie VARCHAR")
+
+    # Last stored period and last sync time of each ECB series (incremental fetch)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS ecb_sync_state (
+            serie       VARCHAR PRIMARY KEY,
+            last_period DATE,
+            synced_at   TIMESTAMP
         )
     """)
 
@@ -55,9 +68,14 @@ def create_tables(con: duckdb.DuckDBPyConnection) -> None:
             population      INTEGER,
             revenu_median   DOUBLE,
             latitude        DOUBLE,
-            longitude       DOUBLE
+            longitude       DOUBLE,
+            nb_transactions BIGINT,
+            nom_recherche   VARCHAR
         )
     """)
+    # Columns added after the first release (see transform/communes.py)
+    con.execute("ALTER TABLE communes ADD COLUMN IF NOT EXISTS nb_transactions BIGINT")
+    con.execute("ALTER TABLE communes ADD COLUMN IF NOT EXISTS nom_recherche VARCHAR")
 
     con.execute("""
         CREATE TABLE IF NOT EXISTS dpe (
@@ -71,3 +89,92 @@ def create_tables(con: duckdb.DuckDBPyConnection) -> None:
             date_etablissement  DATE
         )
     """)
+
+    # High watermark of the incremental DPE sync, per department
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS dpe_sync_state (
+            code_departement        VARCHAR PRIMARY KEY,
+            last_date_etablissement DATE,
+            synced_at               TIMESTAMP
+        )
+    """)
+
+    # Per-commune fingerprints of the inputs of mutations_enriched at its last refresh
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS enrichment_state (
+            code_commune    VARCHAR PRIMARY KEY,
+            mutations_fp    HUGEINT,
+            dpe_fp          HUGEINT
+        )
+    """)
+
+    # Price statistics per geographic level × type × period (see transform/rollups.py).
+    # NULL type_local / annee / trimestre mean "all types" / "all years" / "whole year".
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS prix_rollups (
+            niveau              VARCHAR,
+            code_departement    VARCHAR,
+            code_commune        VARCHAR,
+            nom_commune         VARCHAR,
+            type_local          VARCHAR,
+            annee               INTEGER,
+            trimestre           INTEGER,
+            nb_transactions     BIGINT,
+            prix_m2_median      DOUBLE,
+            prix_m2_moyen       DOUBLE,
+            surface_mediane     DOUBLE,
+            prix_median         DOUBLE,
+            latitude            DOUBLE,
+            longitude           DOUBLE,
+            prix_m2_sketch      STRUCT(k INTEGER, n BIGINT)[],
+            surface_sketch      STRUCT(k INTEGER, n BIGINT)[],
+            prix_sketch         STRUCT(k INTEGER, n BIGINT)[]
+        )
+    """)
+    # Sketch columns added after the first release; set on commune and department
+    # × type × quarter cells only
+    for sketch in ("prix_m2_sketch", "surface_sketch", "prix_sketch"):
+        con.execute(
+            f"ALTER TABLE prix_rollups ADD COLUMN IF NOT EXISTS {sketch} "
+            "STRUCT(k INTEGER, n BIGINT)[]"
+        )
+
+    # Located sales sorted by 500 m grid cell, for spatial search (see transform/geo.py)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS mutations_geo (
+            cell_y              INTEGER,
+            cell_x              INTEGER,
+            latitude            DOUBLE,
+            longitude           DOUBLE,
+            id_mutation         VARCHAR,
+            date_mutation       DATE,
+            code_departement    VARCHAR,
+            code_commune        VARCHAR,
+            nom_commune         VARCHAR,
+            type_local          VARCHAR,
+            valeur_fonciere     DOUBLE,
+            surface_reelle_bati DOUBLE,
+            nombre_pieces       INTEGER,
+            prix_m2             DOUBLE,
+            annee               INTEGER
+        )
+    """)
+
+    # Price statistics per map grid cell × type × year (see transform/rollups.py).
+    # Cells are squares of taille_km on a side; NULL type_local / annee mean "all".
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS prix_grille (
+            taille_km           INTEGER,
+            cell_x              INTEGER,
+            cell_y              INTEGER,
+            type_local          VARCHAR,
+            annee               INTEGER,
+            nb_transactions     BIGINT,
+            prix_m2_median      DOUBLE,
+            lon_min             DOUBLE,
+            lat_min             DOUBLE,
+            lon_max             DOUBLE,
+            lat_max             DOUBLE,
+            departements        VARCHAR[]
+        )
+    """)
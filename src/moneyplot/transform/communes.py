@@ -0,0 +1,80 @@
+"""Communes dimension — one row per commune with sales, for lookups and name search."""
+
+import logging
+
+import duckdb
+
+logger = logging.getLogger(__name__)
+
+# Search key of a commune name (SQL expression over ``{}``): lower case, no
+# accents, words separated by single spaces. "Saint-Étienne" -> "saint etienne".
+SEARCH_KEY_SQL = (
+    "trim(regexp_replace(replace(replace(lower(strip_accents({})), 'œ', 'oe'), 'æ', 'ae'), "
+    "'[^a-z0-9]+', ' ', 'g'))"
+)
+
+_COMMUNES_SELECT = f"""
+    SELECT
+        code_commune,
+        max(nom_commune) AS nom_commune,
+        max(code_departement) AS code_departement,
+        avg(latitude) AS latitude,
+        avg(longitude) AS longitude,
+        count(*) AS nb_transactions,
+        {SEARCH_KEY_SQL.format("max(nom_commune)")} AS nom_recherche
+    FROM mutations
+    WHERE code_commune IS NOT NULL {{where}}
+    GROUP BY code_commune
+    ORDER BY nom_recherche
+"""
+
+
+def refresh_communes(con: duckdb.DuckDBPyConnection, department: str | None = None) -> int:
+    """Refresh the ``communes`` table from ``mutations``.
+
+    Each commune with sales gets its name, department, centroid (mean position
+    of its located sales), sales count and search key; communes left without
+    sales are removed. The other columns (population, income...) are kept.
+    With ``department``, only its communes are refreshed. Runs in one
+    transaction. Returns the number of communes written.
+    """
+    where, params = ("AND code_departement = ?", [department]) if department else ("", [])
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(
+            f"""
+            DELETE FROM communes
+            WHERE code_commune NOT IN (
+                SELECT code_commune FROM mutations WHERE code_commune IS NOT NULL {where}
+            ) {where}
+            """,
+            params * 2,
+        )
+        written = con.execute(
+            f"""
+            INSERT INTO communes (
+                code_commune, nom_commune, code_departement, latitude, longitude,
+                nb_transactions, nom_recherche
+            )
+            {_COMMUNES_SELECT.format(where=where)}
+            ON CONFLICT (code_commune) DO UPDATE SET
+                nom_commune = excluded.nom_commune,
+                code_departement = excluded.code_departement,
+                latitude = excluded.latitude,
+                longitude = excluded.longitude,
+                nb_transactions = excluded.nb_transactions,
+                nom_recherche = excluded.nom_recherche
+            """,
+            params,
+        ).fetchone()[0]
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+    logger.info(
+        "Refreshed communes%s: %d rows",
+        f" for department {department}" if department else "",
+        written,
+    )
+    return written
@@ -0,0 +1,394 @@
+"""Comparable sales — the k nearest neighbours of a property among the located, priced sales.
+
+Sales are points in a normalised feature space (position, log surface, rooms,
+date) where a difference of ``LOCATION_KM``, ``SURFACE_RATIO``, ``ROOMS`` or
+``YEARS`` counts as a distance of one. There is one k-d tree per department ×
+property type, built from ``mutations`` after each department load and saved
+as plain ``.npy`` arrays (points reordered leaf by leaf, node bounds, payload
+columns). The engine memory-maps them: opening the index reads no data, and a
+search touches only the pages of the nodes and leaves it visits.
+"""
+
+import heapq
+import json
+import logging
+import math
+import shutil
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date
+from pathlib import Path
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from moneyplot.transform.geo import EARTH_RADIUS_M
+from moneyplot.transform.rollups import KM_PER_DEGREE_LAT
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = Path(__file__).resolve().parents[3] / "data" / "comparables"
+
+# Index file listing every tree: its size, root bounds and input fingerprint
+MANIFEST = "manifest.json"
+
+# Property types indexed → directory name of their trees
+TYPES = {"Appartement": "appartement", "Maison": "maison"}
+
+# Feature scales: a difference of this size counts as a distance of one
+LOCATION_KM = 0.5
+SURFACE_RATIO = 1.2  # 20 % larger or smaller
+ROOMS = 1.0
+YEARS = 2.0
+
+# Most points per leaf: leaves are scanned in one vectorised pass
+LEAF_SIZE = 32
+
+DEFAULT_K = 20
+
+# Columns stored with the points and returned with the comparables
+PAYLOAD_COLUMNS = [
+    "id_mutation", "date_mutation", "code_commune", "valeur_fonciere", "surface_reelle_bati",
+    "nombre_pieces", "prix_m2", "latitude", "longitude",
+]
+
+_SALES_SELECT = f"""
+    SELECT type_local, {", ".join(PAYLOAD_COLUMNS)}
+    FROM mutations
+    WHERE code_departement = ?
+      AND type_local IN ('Appartement', 'Maison')
+      AND latitude IS NOT NULL AND longitude IS NOT NULL
+      AND surface_reelle_bati > 0 AND nombre_pieces IS NOT NULL AND prix_m2 IS NOT NULL
+"""
+
+_EPOCH = np.datetime64("1970-01-01", "D")
+
+
+def features(
+    latitude: np.ndarray,
+    longitude: np.ndarray,
+    surface: np.ndarray,
+    rooms: np.ndarray,
+    days: np.ndarray,
+) -> np.ndarray:
+    """Normalised feature vectors (n × 5); ``days`` counts days since 1970-01-01."""
+    km_lon = KM_PER_DEGREE_LAT * np.cos(np.radians(latitude))
+    return np.column_stack([
+        longitude * km_lon / LOCATION_KM,
+        latitude * KM_PER_DEGREE_LAT / LOCATION_KM,
+        np.log(surface) / math.log(SURFACE_RATIO),
+        rooms / ROOMS,
+        days / 365.25 / YEARS,
+    ]).astype(np.float32)
+
+
+# ── Build ───────────────────────────────────────────────────────────────────
+
+
+def refresh_comparables(
+    con: duckdb.DuckDBPyConnection,
+    department: str | None = None,
+    directory: Path | None = None,
+) -> int:
+    """Rebuild the comparables trees of a department (all departments by default).
+
+    A department whose sales have not changed since its trees were built (same
+    fingerprint) is skipped; departments no longer in ``mutations`` are removed.
+    Returns the number of sales indexed.
+    """
+    directory = directory or INDEX_DIR
+    directory.mkdir(parents=True, exist_ok=True)
+    manifest = _read_manifest(directory)
+
+    if department is None:
+        departments = [r[0] for r in con.execute(
+            "SELECT DISTINCT code_departement FROM mutations ORDER BY 1"
+        ).fetchall()]
+        for key in [k for k in manifest if k.split("/")[0] not in departments]:
+            shutil.rmtree(directory / key, ignore_errors=True)
+            del manifest[key]
+    else:
+        departments = [department]
+
+    indexed = 0
+    for dept in departments:
+        fingerprint = str(con.execute(
+            "SELECT sum(hash(mutations))::HUGEINT FROM mutations WHERE code_departement = ?",
+            [dept],
+        ).fetchone()[0])
+        keys = [f"{dept}/{slug}" for slug in TYPES.values()]
+        if all(manifest.get(k, {}).get("fingerprint") == fingerprint for k in keys):
+            logger.info("Comparables for department %s unchanged", dept)
+            continue
+
+        sales = con.execute(_SALES_SELECT, [dept]).fetchnumpy()
+        built = 0
+        for type_local, slug in TYPES.items():
+            key = f"{dept}/{slug}"
+            rows = np.asarray(sales["type_local"] == type_local)
+            if not rows.any():
+                shutil.rmtree(directory / key, ignore_errors=True)
+                manifest.pop(key, None)
+                continue
+            manifest[key] = _build_tree(
+                {c: np.asarray(sales[c])[rows] for c in PAYLOAD_COLUMNS}, directory / key
+            )
+            manifest[key]["fingerprint"] = fingerprint
+            built += manifest[key]["size"]
+        _write_manifest(directory, manifest)
+        indexed += built
+        logger.info("Built comparables for department %s: %d sales", dept, built)
+    return indexed
+
+
+def _build_tree(columns: dict[str, np.ndarray], path: Path) -> dict:
+    """Build one k-d tree and save it under ``path``; return its manifest entry.
+
+    Nodes split their points at the median of their widest dimension until at
+    most ``LEAF_SIZE`` remain. Points and payload are then reordered so every
+    node covers a contiguous slice [start, end).
+    """
+    dates = columns["date_mutation"].astype("datetime64[D]")
+    points = features(
+        columns["latitude"],
+        columns["longitude"],
+        columns["surface_reelle_bati"],
+        columns["nombre_pieces"],
+        (dates - _EPOCH).astype(np.float64),
+    )
+    order = np.arange(len(points))
+    # Per node: start, end, left child, right child (-1 for leaves); bounds (lo, hi)
+    nodes, bounds = [], []
+    stack = [(0, len(points), -1, 0)]
+    while stack:
+        start, end, parent, side = stack.pop()
+        node = len(nodes)
+        if parent >= 0:
+            nodes[parent][2 + side] = node
+        idx = order[start:end]
+        block = points[idx]
+        lo, hi = block.min(axis=0), block.max(axis=0)
+        nodes.append([start, end, -1, -1])
+        bounds.append((lo, hi))
+        if end - start <= LEAF_SIZE:
+            continue
+        dim = int(np.argmax(hi - lo))
+        mid = (start + end) // 2
+        order[start:end] = idx[np.argpartition(block[:, dim], mid - start)]
+        stack.append((mid, end, node, 1))
+        stack.append((start, mid, node, 0))
+
+    tmp = path.with_name(path.name + ".part")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    np.save(tmp / "points.npy", points[order])
+    np.save(tmp / "nodes.npy", np.asarray(nodes, dtype=np.int32))
+    np.save(tmp / "bounds.npy", np.asarray(bounds, dtype=np.float32))
+    for name, values in columns.items():
+        if name == "date_mutation":
+            values = dates
+        elif values.dtype == object:
+            values = values.astype(str)
+        np.save(tmp / f"{name}.npy", values[order])
+    _swap_directory(tmp, path)
+
+    return {
+        "size": len(points),
+        "lo": bounds[0][0].tolist(),
+        "hi": bounds[0][1].tolist(),
+        "built_at": time.time(),
+    }
+
+
+def _swap_directory(new: Path, target: Path) -> None:
+    """Replace ``target`` by ``new``; readers of the old files keep their mappings."""
+    old = target.with_name(target.name + ".old")
+    shutil.rmtree(old, ignore_errors=True)
+    if target.exists():
+        target.rename(old)
+    new.rename(target)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def _read_manifest(directory: Path) -> dict[str, dict]:
+    path = directory / MANIFEST
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def _write_manifest(directory: Path, manifest: dict[str, dict]) -> None:
+    path = directory / MANIFEST
+    tmp = path.with_name(path.name + ".part")
+    tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    tmp.replace(path)
+
+
+# ── Search ──────────────────────────────────────────────────────────────────
+
+
+@dataclass
+class _Tree:
+    """A k-d tree's arrays, memory-mapped."""
+
+    built_at: float
+    points: np.ndarray
+    nodes: np.ndarray
+    lo: np.ndarray
+    hi: np.ndarray
+    payload: dict[str, np.ndarray]
+
+
+class ComparablesIndex:
+    """Searches the saved trees; reloads those rebuilt since they were opened.
+
+    Trees are opened lazily, on the first search that may reach them, and
+    shared by the threads of the process.
+    """
+
+    def __init__(self, directory: Path | None = None) -> None:
+        self.directory = directory or INDEX_DIR
+        self._manifest: dict[str, dict] = {}
+        self._manifest_mtime = None
+        self._trees: dict[str, _Tree] = {}
+        self._lock = threading.Lock()
+
+    def search(
+        self,
+        latitude: float,
+        longitude: float,
+        surface: float,
+        nombre_pieces: int,
+        type_local: str,
+        on: date | None = None,
+        k: int = DEFAULT_K,
+    ) -> pd.DataFrame:
+        """The ``k`` sales most comparable to a property sold ``on`` (today by default).
+
+        Columns: the ``PAYLOAD_COLUMNS``, distance_m (as the crow flies) and
+        ecart (distance in the normalised space, 0 for an identical sale).
+        """
+        slug = TYPES[type_local]
+        days = ((np.datetime64(on or date.today(), "D") - _EPOCH).astype(np.float64))
+        query = features(
+            np.array([latitude]), np.array([longitude]), np.array([surface], dtype=float),
+            np.array([nombre_pieces], dtype=float), np.array([days]),
+        )[0]
+
+        # Max-heap of the best candidates so far: (-squared distance, tree key, position)
+        best: list[tuple[float, str, int]] = []
+        for key, root_d2 in self._candidate_trees(slug, query):
+            if len(best) == k and root_d2 >= -best[0][0]:
+                break
+            self._search_tree(key, self._tree(key), query, k, best)
+
+        best.sort(key=lambda c: -c[0])
+        rows = {c: [] for c in PAYLOAD_COLUMNS}
+        for _, key, pos in best:
+            payload = self._trees[key].payload
+            for c in PAYLOAD_COLUMNS:
+                rows[c].append(payload[c][pos])
+        df = pd.DataFrame(rows)
+        df["type_local"] = type_local
+        df["distance_m"] = _haversine_m(latitude, longitude, df["latitude"], df["longitude"])
+        df["ecart"] = np.sqrt([-c[0] for c in best])
+        return df
+
+    def _candidate_trees(self, slug: str, query: np.ndarray) -> list[tuple[str, float]]:
+        """Trees of the type, closest root bounds first."""
+        self._reload_manifest()
+        candidates = [
+            (key, _box_d2(query, np.asarray(e["lo"]), np.asarray(e["hi"])))
+            for key, e in self._manifest.items()
+            if key.endswith(f"/{slug}")
+        ]
+        return sorted(candidates, key=lambda c: c[1])
+
+    def _search_tree(
+        self, key: str, tree: _Tree, query: np.ndarray, k: int, best: list
+    ) -> None:
+        """Best-first descent: nodes by distance to their bounds, pruned by the k-th best."""
+        frontier = [(_box_d2(query, tree.lo[0], tree.hi[0]), 0)]
+        while frontier:
+            d2, node = heapq.heappop(frontier)
+            if len(best) == k and d2 >= -best[0][0]:
+                break
+            start, end, left, right = tree.nodes[node]
+            if left < 0:
+                dists = ((tree.points[start:end] - query) ** 2).sum(axis=1)
+                for i in np.argsort(dists)[:k]:
+                    if len(best) < k:
+                        heapq.heappush(best, (-float(dists[i]), key, start + int(i)))
+                    elif dists[i] < -best[0][0]:
+                        heapq.heapreplace(best, (-float(dists[i]), key, start + int(i)))
+                    else:
+                        break
+                continue
+            for child in (left, right):
+                heapq.heappush(frontier, (_box_d2(query, tree.lo[child], tree.hi[child]), child))
+
+    def _reload_manifest(self) -> None:
+        path = self.directory / MANIFEST
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._manifest_mtime:
+            return
+        with self._lock:
+            self._manifest = _read_manifest(self.directory) if mtime else {}
+            self._manifest_mtime = mtime
+            # Trees rebuilt or removed since they were opened
+            for key, tree in list(self._trees.items()):
+                if self._manifest.get(key, {}).get("built_at") != tree.built_at:
+                    del self._trees[key]
+
+    def _tree(self, key: str) -> _Tree:
+        tree = self._trees.get(key)
+        if tree is None:
+            path = self.directory / key
+            bounds = np.load(path / "bounds.npy", mmap_mode="r")
+            tree = _Tree(
+                built_at=self._manifest[key]["built_at"],
+                points=np.load(path / "points.npy", mmap_mode="r"),
+                nodes=np.load(path / "nodes.npy", mmap_mode="r"),
+                lo=bounds[:, 0],
+                hi=bounds[:, 1],
+                payload={c: np.load(path / f"{c}.npy", mmap_mode="r") for c in PAYLOAD_COLUMNS},
+            )
+            with self._lock:
+                self._trees[key] = tree
+        return tree
+
+
+_default_index: ComparablesIndex | None = None
+
+
+def find_comparables(
+    latitude: float,
+    longitude: float,
+    surface: float,
+    nombre_pieces: int,
+    type_local: str,
+    on: date | None = None,
+    k: int = DEFAULT_K,
+) -> pd.DataFrame:
+    """Search the process-wide index of ``INDEX_DIR`` (see ``ComparablesIndex.search``)."""
+    global _default_index
+    if _default_index is None:
+        _default_index = ComparablesIndex()
+    return _default_index.search(latitude, longitude, surface, nombre_pieces, type_local, on, k)
+
+
+def _box_d2(query: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> float:
+    """Squared distance from ``query`` to the box [lo, hi] (0 inside)."""
+    gap = np.maximum(lo - query, 0) + np.maximum(query - hi, 0)
+    return float(gap @ gap)
+
+
+def _haversine_m(lat: float, lon: float, lats: pd.Series, lons: pd.Series) -> np.ndarray:
+    lat1, lat2 = math.radians(lat), np.radians(lats.to_numpy(dtype=float))
+    dlat = lat2 - lat1
+    dlon = np.radians(lons.to_numpy(dtype=float) - lon)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
@@ -1,6 +1,11 @@
 """Clean and transform raw DVF data."""
 
 import logging
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from dataclasses import dataclass
 from pathlib import Path
 
 import duckdb
@@ -11,103 +16,406 @@ logger = logging.getLogger(__name__)
 RAW_DIR = Path(__file__).resolve().parents[3] / "data" / "raw" / "dvf"
 PROCESSED_DIR = Path(__file__).resolve().parents[3] / "data" / "processed"
 
+# Cleaned DVF dataset, hive-partitioned as annee=YYYY/code_departement=DD/
+DVF_CLEAN_DIR = PROCESSED_DIR / "dvf_clean"
+
+# Partition columns are encoded in the directory names, not in the files
+HIVE_TYPES = {"annee": "INTEGER", "code_departement": "VARCHAR"}
+
+# Rows are sorted by commune and date inside each partition; a few row groups
+# per department-year lets commune or date filters skip most of a file.
+ROW_GROUP_SIZE = 32_768
+
+# Column order of the mutations table
+MUTATIONS_COLUMNS = [
+    "id_mutation",
+    "date_mutation",
+    "nature_mutation",
+    "valeur_fonciere",
+    "code_departement",
+    "code_commune",
+    "nom_commune",
+    "code_postal",
+    "id_parcelle",
+    "type_local",
+    "surface_reelle_bati",
+    "nombre_pieces",
+    "surface_terrain",
+    "longitude",
+    "latitude",
+    "prix_m2",
+    "annee",
+    "trimestre",
+]
+
 # Property types we care about
 TYPES_LOCAL = {"Maison", "Appartement"}
 
+# Full geo-dvf CSV layout with explicit types. Declaring it skips type sniffing,
+# keeps codes such as '01' or '2A' as text and lets DuckDB parse only the
+# columns the cleaning query projects.
+DVF_CSV_COLUMNS = {
+    "id_mutation": "VARCHAR",
+    "date_mutation": "DATE",
+    "numero_disposition": "VARCHAR",
+    "nature_mutation": "VARCHAR",
+    "valeur_fonciere": "DOUBLE",
+    "adresse_numero": "VARCHAR",
+    "adresse_suffixe": "VARCHAR",
+    "adresse_nom_voie": "VARCHAR",
+    "adresse_code_voie": "VARCHAR",
+    "code_postal": "VARCHAR",
+    "code_commune": "VARCHAR",
+    "nom_commune": "VARCHAR",
+    "code_departement": "VARCHAR",
+    "ancien_code_commune": "VARCHAR",
+    "ancien_nom_commune": "VARCHAR",
+    "id_parcelle": "VARCHAR",
+    "ancien_id_parcelle": "VARCHAR",
+    "numero_volume": "VARCHAR",
+    "lot1_numero": "VARCHAR",
+    "lot1_surface_carrez": "DOUBLE",
+    "lot2_numero": "VARCHAR",
+    "lot2_surface_carrez": "DOUBLE",
+    "lot3_numero": "VARCHAR",
+    "lot3_surface_carrez": "DOUBLE",
+    "lot4_numero": "VARCHAR",
+    "lot4_surface_carrez": "DOUBLE",
+    "lot5_numero": "VARCHAR",
+    "lot5_surface_carrez": "DOUBLE",
+    "nombre_lots": "INTEGER",
+    "code_type_local": "VARCHAR",
+    "type_local": "VARCHAR",
+    "surface_reelle_bati": "DOUBLE",
+    "nombre_pieces_principales": "INTEGER",
+    "code_nature_culture": "VARCHAR",
+    "nature_culture": "VARCHAR",
+    "code_nature_culture_speciale": "VARCHAR",
+    "nature_culture_speciale": "VARCHAR",
+    "surface_terrain": "DOUBLE",
+    "longitude": "DOUBLE",
+    "latitude": "DOUBLE",
+}
+
+# Memory cap of the cleaning connection; the dedup aggregate spills past it
+DUCKDB_MEMORY_LIMIT = "2GB"
 
-def clean_dvf(raw_dir: Path | None = None, output_dir: Path | None = None) -> Path:
-    """Read raw DVF CSVs, clean, and write a single Parquet file.
+# Raw CSVs are named dvf_{year}_{dept}.csv.gz
+RAW_CSV_GLOB = "dvf_*_*.csv.gz"
 
-    Steps:
-    1. Read all department CSVs into DuckDB (in-memory)
+
+def clean_dvf(
+    raw_dir: Path | None = None,
+    output_dir: Path | None = None,
+    department: str | None = None,
+    memory_limit: str = DUCKDB_MEMORY_LIMIT,
+    threads: int | None = None,
+) -> Path:
+    """Stream raw DVF CSVs through the cleaning query into the partitioned dataset.
+
+    Steps, run as one DuckDB pipeline from CSV to Parquet:
+    1. Read the department CSVs with the explicit DVF schema, projecting only
+       the columns of the mutations table
     2. Filter to sales (Vente) of houses and apartments
-    3. Deduplicate by id_mutation (keep one row per mutation with aggregated surfaces)
+    3. Deduplicate by id_mutation + type_local (keep the largest surface)
     4. Compute prix/m²
-    5. Write to Parquet
+    5. Write to Parquet, partitioned by annee and code_departement
+
+    Nothing is materialised in between: only the filtered, projected rows are
+    held by the dedup aggregate, which spills to ``output_dir`` past
+    ``memory_limit``. Each partition is then rewritten sorted by commune and
+    date, so that sort never covers more than one department-year.
+
+    With ``department``, only that department's CSVs are read and only its
+    partitions are replaced. Mutations never cross departments, so the
+    per-department outputs together match an all-France run (see
+    ``clean_dvf_sharded``). ``threads`` caps DuckDB's threads (default: all
+    cores). Returns the dataset directory (see ``read_dvf_clean``).
     """
     raw = raw_dir or RAW_DIR
-    out = (output_dir or PROCESSED_DIR) / "dvf_clean.parquet"
-    out.parent.mkdir(parents=True, exist_ok=True)
+    out = output_dir or DVF_CLEAN_DIR
+    staging = out / f".staging_{department or 'all'}"
+    # One spill directory per run: DuckDB deletes it on close, under any
+    # concurrent run of another department
+    spill = out / f".duckdb_tmp_{department or 'all'}"
+    shutil.rmtree(staging, ignore_errors=True)
+    out.mkdir(parents=True, exist_ok=True)
 
-    csv_pattern = str(raw / "dvf_*.csv.gz")
-    logger.info("Reading DVF CSVs from %s", csv_pattern)
+    csv_pattern = str(raw / f"dvf_*_{department or '*'}.csv.gz")
+    logger.info("Cleaning DVF CSVs from %s", csv_pattern)
 
     con = duckdb.connect()
+    con.execute(f"SET memory_limit = '{memory_limit}'")
+    con.execute(f"SET temp_directory = '{spill}'")
+    if threads:
+        con.execute(f"SET threads = {int(threads)}")
+    # Row order is irrelevant here and keeping it forces extra buffering
+    con.execute("SET preserve_insertion_order = false")
 
-    # Read all CSVs at once via glob — DuckDB handles gzip natively
-    con.execute(f"""
-        CREATE TABLE raw_dvf AS
-        SELECT * FROM read_csv('{csv_pattern}',
-            auto_detect=true,
-            ignore_errors=true,
-            header=true
-        )
-    """)
-
-    row_count = con.execute("SELECT count(*) FROM raw_dvf").fetchone()[0]
-    logger.info("Loaded %d raw rows", row_count)
-
-    # Clean: filter to Vente, relevant property types, deduplicate mutations
-    con.execute("""
-        CREATE TABLE cleaned AS
-        SELECT
-            id_mutation,
-            date_mutation,
-            nature_mutation,
-            valeur_fonciere,
-            code_departement,
-            code_commune,
-            nom_commune,
-            code_postal,
-            id_parcelle,
-            type_local,
-            surface_reelle_bati,
-            nombre_pieces_principales AS nombre_pieces,
-            surface_terrain,
-            longitude,
-            latitude,
-            -- Compute prix/m²
-            CASE
-                WHEN surface_reelle_bati > 0 THEN valeur_fonciere / surface_reelle_bati
-                ELSE NULL
-            END AS prix_m2,
-            YEAR(date_mutation) AS annee,
-            QUARTER(date_mutation) AS trimestre
-        FROM (
-            SELECT *,
-                ROW_NUMBER() OVER (
-                    PARTITION BY id_mutation, type_local
-                    ORDER BY surface_reelle_bati DESC NULLS LAST
-                ) AS rn
-            FROM raw_dvf
-            WHERE nature_mutation = 'Vente'
-              AND type_local IN ('Maison', 'Appartement')
-              AND valeur_fonciere > 0
-              AND valeur_fonciere < 10000000
-        )
-        WHERE rn = 1
-    """)
-
-    clean_count = con.execute("SELECT count(*) FROM cleaned").fetchone()[0]
+    # DuckDB reads the gzipped CSVs natively and streams them through the query.
+    # The dedup keeps, per (id_mutation, type_local), the row with the largest
+    # surface (NULL surfaces last) via a spillable hash aggregate.
+    clean_count = con.execute(f"""
+        COPY (
+            WITH sales AS (
+                SELECT
+                    id_mutation,
+                    date_mutation,
+                    nature_mutation,
+                    valeur_fonciere,
+                    code_departement,
+                    code_commune,
+                    nom_commune,
+                    code_postal,
+                    id_parcelle,
+                    type_local,
+                    surface_reelle_bati,
+                    nombre_pieces_principales AS nombre_pieces,
+                    surface_terrain,
+                    longitude,
+                    latitude,
+                    -- Compute prix/m²
+                    CASE
+                        WHEN surface_reelle_bati > 0 THEN valeur_fonciere / surface_reelle_bati
+                        ELSE NULL
+                    END AS prix_m2,
+                    YEAR(date_mutation) AS annee,
+                    QUARTER(date_mutation) AS trimestre
+                FROM read_csv('{csv_pattern}',
+                    columns={DVF_CSV_COLUMNS},
+                    auto_detect=false,
+                    header=true,
+                    ignore_errors=true
+                )
+                WHERE nature_mutation = 'Vente'
+                  AND type_local IN ('Maison', 'Appartement')
+                  AND valeur_fonciere > 0
+                  AND valeur_fonciere < 10000000
+            )
+            SELECT UNNEST(mutation)
+            FROM (
+                SELECT arg_max(sales, COALESCE(surface_reelle_bati, -1)) AS mutation
+                FROM sales
+                GROUP BY id_mutation, type_local
+            )
+        ) TO '{staging}' (FORMAT PARQUET, PARTITION_BY (annee, code_departement))
+    """).fetchone()[0]
     logger.info("Cleaned dataset: %d rows", clean_count)
 
-    # Write to Parquet
-    con.execute(f"COPY cleaned TO '{out}' (FORMAT PARQUET, COMPRESSION ZSTD)")
-    logger.info("Written to %s", out)
+    # Replace the previous partitions of the cleaned departments
+    con.execute("SET preserve_insertion_order = true")
+    stale = set(out.glob(f"annee=*/code_departement={department or '*'}"))
+    written = set()
+    for partition in sorted(staging.glob("annee=*/code_departement=*")):
+        target = out / partition.relative_to(staging)
+        target.mkdir(parents=True, exist_ok=True)
+        tmp = target / "data_0.parquet.part"
+        con.execute(f"""
+            COPY (
+                SELECT * FROM read_parquet('{partition}/*.parquet')
+                ORDER BY code_commune, date_mutation
+            ) TO '{tmp}' (FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE {ROW_GROUP_SIZE})
+        """)
+        tmp.replace(target / "data_0.parquet")
+        written.add(target)
+    for partition in stale - written:
+        shutil.rmtree(partition)
 
+    shutil.rmtree(staging)
     con.close()
+    shutil.rmtree(spill, ignore_errors=True)
+    logger.info("Written %d partitions to %s", len(written), out)
     return out
 
 
-def load_parquet_to_duckdb(
-    parquet_path: Path, target_con: duckdb.DuckDBPyConnection
-) -> int:
-    """Load the cleaned Parquet file into the persistent DuckDB mutations table."""
-    target_con.execute("DELETE FROM mutations")
-    target_con.execute(f"""
-        INSERT INTO mutations
-        SELECT * FROM read_parquet('{parquet_path}')
+def clean_dvf_sharded(
+    raw_dir: Path | None = None,
+    output_dir: Path | None = None,
+    departments: list[str] | None = None,
+    workers: int | None = None,
+    memory_limit: str = DUCKDB_MEMORY_LIMIT,
+) -> Path:
+    """Clean each department in its own process, several at a time, into the dataset.
+
+    Same output as ``clean_dvf`` over the same CSVs, but the dedup never
+    spans more than one department: each worker runs ``clean_dvf`` for one
+    department with its own DuckDB capped at ``memory_limit`` and its share
+    of the cores, and writes only that department's partitions, so the
+    shards merge into the dataset without any further pass. Peak memory is
+    ``workers`` × the largest department's (at most ``memory_limit`` each),
+    whatever the number of departments.
+
+    ``departments`` defaults to every department with raw CSVs; in that case
+    the partitions of departments that no longer have any are removed, as an
+    all-France ``clean_dvf`` run would. ``workers`` defaults to one per core.
+    Returns the dataset directory.
+    """
+    raw = raw_dir or RAW_DIR
+    out = output_dir or DVF_CLEAN_DIR
+    sizes = _raw_sizes(raw)
+    selected = departments or list(sizes)
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(workers or cpus, len(selected)))
+    threads = max(1, cpus // workers)
+    out.mkdir(parents=True, exist_ok=True)
+    logger.info(
+        "Cleaning %d departments with %d workers (%d threads, %s each)",
+        len(selected), workers, threads, memory_limit,
+    )
+
+    # Largest departments first, so that the longest shards do not start last.
+    # spawn, not fork: workers must not inherit the caller's memory.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {
+            pool.submit(clean_dvf, raw, out, dept, memory_limit, threads): dept
+            for dept in sorted(selected, key=lambda d: sizes.get(d, 0), reverse=True)
+        }
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in pending:
+            future.cancel()
+        for future in done:
+            if future.exception() is not None:
+                raise RuntimeError(
+                    f"Cleaning department {futures[future]} failed"
+                ) from future.exception()
+
+    if departments is None:
+        for partition in out.glob("annee=*/code_departement=*"):
+            if partition.name.removeprefix("code_departement=") not in sizes:
+                shutil.rmtree(partition)
+    logger.info("Cleaned %d departments into %s", len(selected), out)
+    return out
+
+
+def _raw_sizes(raw_dir: Path) -> dict[str, int]:
+    """Compressed size of each department's raw CSVs, by department code."""
+    sizes: dict[str, int] = {}
+    for path in raw_dir.glob(RAW_CSV_GLOB):
+        dept = path.name.removesuffix(".csv.gz").split("_", 2)[2]
+        sizes[dept] = sizes.get(dept, 0) + path.stat().st_size
+    return sizes
+
+
+def read_dvf_clean(
+    con: duckdb.DuckDBPyConnection,
+    departments: list[str] | None = None,
+    years: list[int] | None = None,
+    dataset_dir: Path | None = None,
+) -> duckdb.DuckDBPyRelation:
+    """Return a relation over the cleaned DVF dataset, in mutations column order.
+
+    Department and year filters are pushed down to the hive partition columns,
+    so DuckDB only opens the matching files. Further filters applied to the
+    returned relation (e.g. ``rel.filter("code_commune = '75056'")``) are
+    pushed into the Parquet scan and use the row-group min/max statistics.
+    """
+    pattern = (dataset_dir or DVF_CLEAN_DIR) / "annee=*" / "code_departement=*" / "*.parquet"
+    # Literals are inlined (not bound) so the relation stays lazy and
+    # composable; parameterised relations are executed eagerly by DuckDB.
+    where = []
+    if departments:
+        codes = ", ".join("'" + d.replace("'", "''") + "'" for d in departments)
+        where.append(f"code_departement IN ({codes})")
+    if years:
+        where.append(f"annee IN ({', '.join(str(int(y)) for y in years)})")
+
+    return con.sql(f"""
+        SELECT {', '.join(MUTATIONS_COLUMNS)}
+        FROM read_parquet('{pattern}', hive_partitioning=true, hive_types={HIVE_TYPES})
+        {'WHERE ' + ' AND '.join(where) if where else ''}
     """)
-    count = target_con.execute("SELECT count(*) FROM mutations").fetchone()[0]
-    logger.info("Loaded %d rows into mutations table", count)
-    return count
+
+
+@dataclass
+class LoadStats:
+    """Row changes applied to the mutations table by one load."""
+
+    inserted: int
+    updated: int
+    deleted: int
+    row_count: int
+
+
+def load_parquet_to_duckdb(
+    target_con: duckdb.DuckDBPyConnection,
+    department: str | None = None,
+    dataset_dir: Path | None = None,
+) -> LoadStats:
+    """Merge the cleaned Parquet dataset into the persistent DuckDB mutations table.
+
+    The slice (one department, or everything) is diffed against the table on
+    its mutation key (id_mutation, type_local): only keys whose rows appeared,
+    changed or disappeared are deleted and re-inserted, so the rows written
+    scale with the size of the change rather than with the table. The merge
+    runs in one transaction, so readers always see a complete table.
+    """
+    where = "WHERE code_departement = ?" if department else ""
+    params = [department] if department else []
+    departments = [department] if department else None
+    staged = read_dvf_clean(target_con, departments, dataset_dir=dataset_dir)
+
+    target_con.execute("BEGIN TRANSACTION")
+    try:
+        target_con.execute(f"CREATE OR REPLACE TEMP TABLE _staged AS {staged.sql_query()}")
+        # Current rows absent from the new slice (deleted or old version)
+        target_con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE _stale AS
+            SELECT DISTINCT id_mutation, type_local FROM (
+                SELECT * FROM mutations {where}
+                EXCEPT
+                SELECT * FROM _staged
+            )
+        """, params)
+        # New rows absent from the current table (inserted or new version)
+        target_con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE _fresh AS
+            SELECT DISTINCT id_mutation, type_local FROM (
+                SELECT * FROM _staged
+                EXCEPT
+                SELECT * FROM mutations {where}
+            )
+        """, params)
+        inserted, updated, deleted = target_con.execute("""
+            SELECT
+                count(*) FILTER (WHERE s.id_mutation IS NULL),
+                count(*) FILTER (WHERE s.id_mutation IS NOT NULL AND f.id_mutation IS NOT NULL),
+                count(*) FILTER (WHERE f.id_mutation IS NULL)
+            FROM _fresh f
+            FULL OUTER JOIN _stale s USING (id_mutation, type_local)
+        """).fetchone()
+
+        # Replace every row of a changed key by the key's rows in the new slice
+        target_con.execute("""
+            CREATE OR REPLACE TEMP TABLE _changed AS
+            SELECT * FROM _stale UNION SELECT * FROM _fresh
+        """)
+        target_con.execute("""
+            DELETE FROM mutations
+            USING _changed c
+            WHERE mutations.id_mutation = c.id_mutation
+              AND mutations.type_local = c.type_local
+        """)
+        target_con.execute("""
+            INSERT INTO mutations
+            SELECT s.* FROM _staged s
+            SEMI JOIN _changed c USING (id_mutation, type_local)
+        """)
+        target_con.execute("COMMIT")
+    except Exception:
+        target_con.execute("ROLLBACK")
+        raise
+    finally:
+        for table in ("_staged", "_stale", "_fresh", "_changed"):
+            target_con.execute(f"DROP TABLE IF EXISTS {table}")
+
+    count = target_con.execute(f"SELECT count(*) FROM mutations {where}", params).fetchone()[0]
+    stats = LoadStats(inserted, updated, deleted, count)
+    logger.info(
+        "Merged mutations: %d inserted, %d updated, %d deleted (%d rows in slice)",
+        inserted,
+        updated,
+        deleted,
+        count,
+    )
+    return stats
@@ -6,36 +6,174 @@ import duckdb
 
 logger = logging.getLogger(__name__)
 
+# A DPE matches a sale when their surfaces differ by less than this (m²)
+SURFACE_TOLERANCE = 5
 
-def enrich_mutations_with_dpe(con: duckdb.DuckDBPyConnection) -> int:
-    """Create a view joining mutations with DPE data on code_commune.
+# Latest diagnostic per (commune, surface): the candidates a sale can match
+_DPE_CANDIDATES = """
+    SELECT DISTINCT ON (code_commune, surface_habitable)
+        code_commune,
+        surface_habitable,
+        classe_energie,
+        classe_ges,
+        annee_construction
+    FROM dpe
+    WHERE classe_energie IS NOT NULL AND surface_habitable IS NOT NULL {where}
+    ORDER BY code_commune, surface_habitable, date_etablissement DESC
+"""
 
-    This is a best-effort join since DPE records don't always have parcel IDs.
-    We join on commune + approximate surface match.
+# Nearest candidate in the commune on each side of the sale's surface, found by
+# two ASOF joins (sort-merge, no band join), then the closer one within tolerance.
+_ENRICHED_SELECT = """
+    WITH d AS ({candidates}),
+    below AS (
+        SELECT m.*,
+            d.surface_habitable AS _s_lo,
+            d.classe_energie AS _ce_lo, d.classe_ges AS _cg_lo, d.annee_construction AS _ac_lo
+        FROM (SELECT * FROM mutations {where}) m
+        ASOF LEFT JOIN d
+            ON m.code_commune = d.code_commune AND m.surface_reelle_bati >= d.surface_habitable
+    ),
+    both_sides AS (
+        SELECT b.*,
+            d.surface_habitable AS _s_hi,
+            d.classe_energie AS _ce_hi, d.classe_ges AS _cg_hi, d.annee_construction AS _ac_hi
+        FROM below b
+        ASOF LEFT JOIN d
+            ON b.code_commune = d.code_commune AND b.surface_reelle_bati <= d.surface_habitable
+    ),
+    nearest AS (
+        SELECT *,
+            CASE
+                WHEN _s_lo IS NULL THEN false
+                WHEN _s_hi IS NULL THEN true
+                ELSE surface_reelle_bati - _s_lo <= _s_hi - surface_reelle_bati
+            END AS _use_lo,
+            least(surface_reelle_bati - _s_lo, _s_hi - surface_reelle_bati) < {tolerance}
+                AS _matched
+        FROM both_sides
+    )
+    SELECT
+        COLUMNS(c -> NOT starts_with(c, '_')),
+        CASE WHEN _matched THEN (CASE WHEN _use_lo THEN _ce_lo ELSE _ce_hi END) END
+            AS classe_energie,
+        CASE WHEN _matched THEN (CASE WHEN _use_lo THEN _cg_lo ELSE _cg_hi END) END
+            AS classe_ges,
+        CASE WHEN _matched THEN (CASE WHEN _use_lo THEN _ac_lo ELSE _ac_hi END) END
+            AS annee_construction
+    FROM nearest
+"""
+
+
+def enrich_mutations_with_dpe(
+    con: duckdb.DuckDBPyConnection, communes: list[str] | None = None
+) -> int:
+    """Refresh the ``mutations_enriched`` table joining mutations with DPE data.
+
+    This is a best-effort join since DPE records don't always have parcel IDs:
+    each sale takes the DPE of its commune with the nearest surface, if within
+    ``SURFACE_TOLERANCE`` m². The table is materialised so dashboard queries
+    don't pay for the join.
+
+    Only stale communes are rebuilt: those listed in ``communes`` or, by default,
+    those whose mutations or DPE changed since the last refresh (detected from
+    per-commune fingerprints). The first call builds the whole table.
+    Returns the number of communes rebuilt.
     """
+    # Earlier versions created a view of the same name
+    if _exists(con, "duckdb_views", "view_name", "mutations_enriched"):
+        con.execute("DROP VIEW mutations_enriched")
+    con.execute("BEGIN TRANSACTION")
+    try:
+        _fingerprint_communes(con)
+        built = _exists(con, "duckdb_tables", "table_name", "mutations_enriched")
+        if not built:
+            con.execute("""
+                CREATE OR REPLACE TEMP TABLE _stale_communes AS
+                SELECT code_commune FROM _fingerprints
+                UNION
+                SELECT code_commune FROM enrichment_state
+            """)
+        elif communes is None:
+            # Communes whose fingerprint changed, appeared or disappeared
+            con.execute("""
+                CREATE OR REPLACE TEMP TABLE _stale_communes AS
+                SELECT code_commune FROM (
+                    SELECT * FROM _fingerprints EXCEPT SELECT * FROM enrichment_state
+                )
+                UNION
+                SELECT code_commune FROM (
+                    SELECT * FROM enrichment_state EXCEPT SELECT * FROM _fingerprints
+                )
+            """)
+        else:
+            con.execute(
+                "CREATE OR REPLACE TEMP TABLE _stale_communes AS "
+                "SELECT DISTINCT unnest(?::VARCHAR[]) AS code_commune",
+                [communes],
+            )
+        stale = con.execute("SELECT count(*) FROM _stale_communes").fetchone()[0]
+
+        if not built:
+            con.execute(f"CREATE TABLE mutations_enriched AS {_enriched_sql()}")
+        elif stale:
+            condition = "code_commune IN (SELECT code_commune FROM _stale_communes)"
+            con.execute(f"DELETE FROM mutations_enriched WHERE {condition}")
+            con.execute(f"INSERT INTO mutations_enriched {_enriched_sql(condition)}")
+
+        con.execute("""
+            DELETE FROM enrichment_state
+            WHERE code_commune IN (SELECT code_commune FROM _stale_communes)
+        """)
+        con.execute("""
+            INSERT INTO enrichment_state
+            SELECT * FROM _fingerprints SEMI JOIN _stale_communes USING (code_commune)
+        """)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        for table in ("_fingerprints", "_stale_communes"):
+            con.execute(f"DROP TABLE IF EXISTS {table}")
+
+    count = con.execute(
+        "SELECT count(*) FROM mutations_enriched WHERE classe_energie IS NOT NULL"
+    ).fetchone()[0]
+    logger.info("Enriched mutations: %d communes rebuilt, %d rows with DPE data", stale, count)
+    return stale
+
+
+def _enriched_sql(condition: str | None = None) -> str:
+    """Build the enrichment query, restricted to the rows matching ``condition`` if given."""
+    return _ENRICHED_SELECT.format(
+        candidates=_DPE_CANDIDATES.format(where=f"AND {condition}" if condition else ""),
+        where=f"WHERE {condition}" if condition else "",
+        tolerance=SURFACE_TOLERANCE,
+    )
+
+
+def _fingerprint_communes(con: duckdb.DuckDBPyConnection) -> None:
+    """Hash each commune's mutations and DPE rows into the ``_fingerprints`` temp table."""
     con.execute("""
-        CREATE OR REPLACE VIEW mutations_enriched AS
+        CREATE OR REPLACE TEMP TABLE _fingerprints AS
         SELECT
-            m.*,
-            d.classe_energie,
-            d.classe_ges,
-            d.annee_construction
-        FROM mutations m
-        LEFT JOIN (
-            SELECT DISTINCT ON (code_commune, surface_habitable)
-                code_commune,
-                surface_habitable,
-                classe_energie,
-                classe_ges,
-                annee_construction
-            FROM dpe
-            WHERE classe_energie IS NOT NULL
-            ORDER BY code_commune, surface_habitable, date_etablissement DESC
-        ) d
-        ON m.code_commune = d.code_commune
-           AND ABS(m.surface_reelle_bati - d.surface_habitable) < 5
+            code_commune,
+            coalesce(m.fp, 0) AS mutations_fp,
+            coalesce(d.fp, 0) AS dpe_fp
+        FROM (
+            SELECT code_commune, sum(hash(mutations))::HUGEINT AS fp
+            FROM mutations GROUP BY code_commune
+        ) m
+        FULL OUTER JOIN (
+            SELECT code_commune, sum(hash(dpe))::HUGEINT AS fp
+            FROM dpe GROUP BY code_commune
+        ) d USING (code_commune)
     """)
 
-    count = con.execute("SELECT count(*) FROM mutations_enriched WHERE classe_energie IS NOT NULL").fetchone()[0]
-    logger.info("Enriched mutations: %d rows with DPE data", count)
-    return count
+
+def _exists(con: duckdb.DuckDBPyConnection, catalog: str, column: str, name: str) -> bool:
+    """Whether a persistent object ``name`` is listed in a ``duckdb_*()`` catalog function."""
+    return con.execute(
+        f"SELECT count(*) FROM {catalog}() WHERE {column} = ? AND NOT temporary", [name]
+    ).fetchone()[0] > 0
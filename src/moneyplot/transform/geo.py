@@ -0,0 +1,112 @@
+"""Spatial index of the located sales — ``mutations_geo``, for bounding-box and radius search.
+
+Sales are binned on a fine square grid (same projection as the map grid) and
+stored sorted by grid row then column. DuckDB keeps the min/max of every
+column per row group (zone maps), so a search that filters on a range of grid
+cells skips every row group outside it and reads a few thousand rows, however
+many sales the table holds.
+"""
+
+import logging
+import math
+
+import duckdb
+
+from moneyplot.transform.rollups import KM_PER_DEGREE_LAT, KM_PER_DEGREE_LON
+
+logger = logging.getLogger(__name__)
+
+# Side of the index cells (m): small enough that a radius search reads few
+# rows outside the circle, large enough that each grid row holds many sales
+INDEX_CELL_M = 500
+
+# Mean Earth radius (m), for haversine distances
+EARTH_RADIUS_M = 6_371_008.8
+
+# Grid column / row of a point (SQL expressions over longitude / latitude)
+CELL_X_SQL = f"floor(longitude * {KM_PER_DEGREE_LON * 1000 / INDEX_CELL_M})::INTEGER"
+CELL_Y_SQL = f"floor(latitude * {KM_PER_DEGREE_LAT * 1000 / INDEX_CELL_M})::INTEGER"
+
+# Great-circle distance (m) of a sale from the point ({lat}, {lon}), SQL expressions
+DISTANCE_SQL = f"""
+    2 * {EARTH_RADIUS_M} * asin(sqrt(
+        pow(sin(radians(latitude - {{lat}}) / 2), 2)
+        + cos(radians({{lat}})) * cos(radians(latitude))
+          * pow(sin(radians(longitude - {{lon}}) / 2), 2)
+    ))
+"""
+
+_GEO_SELECT = f"""
+    SELECT
+        {CELL_Y_SQL} AS cell_y,
+        {CELL_X_SQL} AS cell_x,
+        latitude,
+        longitude,
+        id_mutation,
+        date_mutation,
+        code_departement,
+        code_commune,
+        nom_commune,
+        type_local,
+        valeur_fonciere,
+        surface_reelle_bati,
+        nombre_pieces,
+        prix_m2,
+        annee
+    FROM mutations
+    WHERE latitude BETWEEN -90 AND 90 AND longitude BETWEEN -180 AND 180 {{where}}
+    ORDER BY cell_y, cell_x
+"""
+
+
+def cell_range(
+    lon_min: float, lat_min: float, lon_max: float, lat_max: float
+) -> tuple[int, int, int, int]:
+    """Index cells covering a bounding box: (x_min, x_max, y_min, y_max), bounds included."""
+    kx = KM_PER_DEGREE_LON * 1000 / INDEX_CELL_M
+    ky = KM_PER_DEGREE_LAT * 1000 / INDEX_CELL_M
+    return (
+        math.floor(lon_min * kx),
+        math.floor(lon_max * kx),
+        math.floor(lat_min * ky),
+        math.floor(lat_max * ky),
+    )
+
+
+def radius_bbox(
+    latitude: float, longitude: float, radius_m: float
+) -> tuple[float, float, float, float]:
+    """Bounding box (lon_min, lat_min, lon_max, lat_max) of a circle on the sphere."""
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    # Near the poles the circle spans every longitude
+    cos_lat = math.cos(math.radians(min(abs(latitude) + dlat, 90)))
+    dlon = 180 if cos_lat < 1e-9 else min(180, dlat / cos_lat)
+    return longitude - dlon, latitude - dlat, longitude + dlon, latitude + dlat
+
+
+def refresh_geo_index(con: duckdb.DuckDBPyConnection, department: str | None = None) -> int:
+    """Refresh the ``mutations_geo`` table from the located sales of ``mutations``.
+
+    A full refresh rewrites the table in one global sort. With ``department``,
+    only its rows are replaced, appended sorted: each department's block stays
+    ordered, which is what row-group pruning needs. Runs in one transaction.
+    Returns the number of rows written.
+    """
+    where, params = ("AND code_departement = ?", [department]) if department else ("", [])
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"DELETE FROM mutations_geo WHERE true {where}", params)
+        written = con.execute(
+            f"INSERT INTO mutations_geo {_GEO_SELECT.format(where=where)}", params
+        ).fetchone()[0]
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+    logger.info(
+        "Refreshed geo index%s: %d rows",
+        f" for department {department}" if department else "",
+        written,
+    )
+    return written
@@ -0,0 +1,409 @@
+"""Pre-aggregated price rollups — the dashboard's statistics, computed once per load."""
+
+import logging
+import math
+from itertools import product
+
+import duckdb
+
+logger = logging.getLogger(__name__)
+
+# Columns identifying a cell at each geographic level; the others are NULL
+GEO_LEVELS = {
+    "commune": ["code_departement", "code_commune", "max(nom_commune)", "avg(latitude)",
+                "avg(longitude)"],
+    "departement": ["code_departement", "NULL", "NULL", "NULL", "NULL"],
+    "france": ["NULL", "NULL", "NULL", "NULL", "NULL"],
+}
+
+# Property type: one row per type, plus one over all types (type_local NULL)
+TYPE_GROUPINGS = [("type_local",), ()]
+
+# Periods: quarter, year (trimestre NULL) and all time (annee and trimestre NULL)
+PERIOD_GROUPINGS = [("annee", "trimestre"), ("annee",), ()]
+
+# Medians merged from sketches are within this relative error of the exact median
+SKETCH_RELATIVE_ACCURACY = 0.01
+
+# Sketches are log-scale histograms (DDSketch): a value x > 0 is counted in bucket
+# k = ceil(log_gamma(x)), whose estimate 2·gamma^k / (gamma + 1) is within the
+# relative accuracy of every value in the bucket. Zero/negative values go to k NULL.
+SKETCH_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+
+# Sketched medians: rollup column -> (mutations column, sketch column)
+SKETCHES = {
+    "prix_m2_median": ("prix_m2", "prix_m2_sketch"),
+    "surface_mediane": ("surface_reelle_bati", "surface_sketch"),
+    "prix_median": ("valeur_fonciere", "prix_sketch"),
+}
+
+# Side of the map grid cells (km), coarsest first
+GRID_SIZES_KM = (50, 20, 10, 5, 2)
+
+# Grid cells are squares on an equirectangular projection true at this latitude
+# (the middle of metropolitan France); overseas cells are slightly distorted.
+GRID_REFERENCE_LATITUDE = 46.5
+KM_PER_DEGREE_LAT = 111.2
+KM_PER_DEGREE_LON = KM_PER_DEGREE_LAT * math.cos(math.radians(GRID_REFERENCE_LATITUDE))
+
+# Grid cell of each located, priced sale at every grid size
+_GRID_BINS = """
+    SELECT
+        s.taille_km,
+        floor(m.longitude * {km_lon} / s.taille_km)::INTEGER AS cell_x,
+        floor(m.latitude * {km_lat} / s.taille_km)::INTEGER AS cell_y,
+        m.code_departement,
+        m.type_local,
+        m.annee,
+        m.prix_m2
+    FROM mutations m, (SELECT unnest({sizes}) AS taille_km) s
+    WHERE m.prix_m2 IS NOT NULL AND m.longitude IS NOT NULL AND m.latitude IS NOT NULL
+"""
+
+_GRID_SELECT = """
+    SELECT
+        taille_km,
+        cell_x,
+        cell_y,
+        type_local,
+        annee,
+        count(*) AS nb_transactions,
+        median(prix_m2) AS prix_m2_median,
+        cell_x * taille_km / {km_lon} AS lon_min,
+        cell_y * taille_km / {km_lat} AS lat_min,
+        (cell_x + 1) * taille_km / {km_lon} AS lon_max,
+        (cell_y + 1) * taille_km / {km_lat} AS lat_max,
+        NULL AS departements
+    FROM ({bins}) b {where}
+    GROUP BY GROUPING SETS (
+        (taille_km, cell_x, cell_y, type_local, annee),
+        (taille_km, cell_x, cell_y, type_local),
+        (taille_km, cell_x, cell_y, annee),
+        (taille_km, cell_x, cell_y)
+    )
+    ORDER BY taille_km, type_local, annee
+"""
+
+# Departments with sales in each cell, filled in after the statistics
+_GRID_DEPARTEMENTS = """
+    UPDATE prix_grille g SET departements = c.departements
+    FROM (
+        SELECT taille_km, cell_x, cell_y, list_sort(list(DISTINCT code_departement)) AS departements
+        FROM ({bins}) b {where}
+        GROUP BY taille_km, cell_x, cell_y
+    ) c
+    WHERE g.departements IS NULL
+      AND g.taille_km = c.taille_km AND g.cell_x = c.cell_x AND g.cell_y = c.cell_y
+"""
+
+_ROLLUP_SELECT = """
+    SELECT
+        '{niveau}' AS niveau,
+        {geo[0]} AS code_departement,
+        {geo[1]} AS code_commune,
+        {geo[2]} AS nom_commune,
+        type_local,
+        annee,
+        trimestre,
+        count(*) AS nb_transactions,
+        median(prix_m2) AS prix_m2_median,
+        avg(prix_m2) AS prix_m2_moyen,
+        median(surface_reelle_bati) AS surface_mediane,
+        median(valeur_fonciere) AS prix_median,
+        {geo[3]} AS latitude,
+        {geo[4]} AS longitude
+    FROM mutations
+    WHERE prix_m2 IS NOT NULL {where}
+    GROUP BY GROUPING SETS ({grouping_sets})
+    ORDER BY code_departement, code_commune
+"""
+
+
+# Sketches of the type × quarter cells of a level, from one scan of their sales
+# (cleaned sales always have a type_local)
+_SKETCH_UPDATE = """
+    UPDATE prix_rollups r SET {assignments}
+    FROM (
+        SELECT {key}, type_local, annee, trimestre, {sketch_lists}
+        FROM (
+            SELECT {key}, type_local, annee, trimestre, v.measure, v.k, count(*) AS n
+            FROM (
+                SELECT {key}, type_local, annee, trimestre, unnest([{buckets}]) AS v
+                FROM mutations
+                WHERE prix_m2 IS NOT NULL {where}
+            )
+            WHERE v IS NOT NULL
+            GROUP BY ALL
+        )
+        GROUP BY ALL
+    ) s
+    WHERE r.niveau = '{niveau}' {where_rollups}
+      AND r.{key} = s.{key} AND r.type_local = s.type_local
+      AND r.annee = s.annee AND r.trimestre = s.trimestre
+"""
+
+# Cells of a level merged from the type × quarter cells of the level below:
+# counts and means are exact, medians are read off the merged sketches, and the
+# merged type × quarter cells keep their sketch for the level above.
+_MERGED_SELECT = """
+    WITH cells AS (
+        SELECT * FROM prix_rollups
+        WHERE niveau = '{source}' AND type_local IS NOT NULL AND trimestre IS NOT NULL {where}
+    ),
+    stats AS (
+        SELECT {cell},
+               sum(nb_transactions) AS nb_transactions,
+               sum(prix_m2_moyen * nb_transactions) / sum(nb_transactions) AS prix_m2_moyen
+        FROM cells
+        GROUP BY GROUPING SETS ({grouping_sets})
+    ),
+    buckets AS (
+        SELECT {cell}, measure, k, sum(n) AS n
+        FROM ({unnested})
+        GROUP BY GROUPING SETS ({bucket_sets})
+    ),
+    sketches AS (
+        SELECT {cell}, {sketch_lists}
+        FROM buckets
+        WHERE type_local IS NOT NULL AND trimestre IS NOT NULL
+        GROUP BY {cell}
+    ),
+    ranked AS (
+        SELECT *,
+            sum(n) OVER (
+                PARTITION BY {cell}, measure ORDER BY k NULLS FIRST ROWS UNBOUNDED PRECEDING
+            ) AS cum,
+            sum(n) OVER (PARTITION BY {cell}, measure) AS total
+        FROM buckets
+    ),
+    -- Buckets holding the two middle values (the same one for an odd count)
+    middles AS (
+        SELECT {cell}, measure,
+            arg_min(k, cum) FILTER (WHERE cum > floor((total - 1) / 2)) AS k_lo,
+            arg_min(k, cum) FILTER (WHERE cum > ceil((total - 1) / 2)) AS k_hi
+        FROM ranked
+        GROUP BY {cell}, measure
+    ),
+    medians AS (
+        SELECT {cell}, {medians}
+        FROM (
+            SELECT *,
+                (coalesce(2 * pow({gamma}, k_lo) / ({gamma} + 1), 0)
+                 + coalesce(2 * pow({gamma}, k_hi) / ({gamma} + 1), 0)) / 2 AS median
+            FROM middles
+        )
+        GROUP BY {cell}
+    )
+    SELECT
+        '{niveau}' AS niveau,
+        {code_departement} AS code_departement,
+        NULL AS code_commune,
+        NULL AS nom_commune,
+        stats.type_local,
+        stats.annee,
+        stats.trimestre,
+        stats.nb_transactions,
+        medians.prix_m2_median,
+        stats.prix_m2_moyen,
+        medians.surface_mediane,
+        medians.prix_median,
+        NULL AS latitude,
+        NULL AS longitude,
+        COLUMNS(sketches.* EXCLUDE ({cell}))
+    FROM stats
+    LEFT JOIN medians ON {medians_join}
+    LEFT JOIN sketches ON {sketches_join}
+    ORDER BY code_departement
+"""
+
+
+def refresh_rollups(
+    con: duckdb.DuckDBPyConnection, department: str | None = None, approximate: bool = True
+) -> int:
+    """Recompute the ``prix_rollups`` table from ``mutations``.
+
+    Every cell holds medians, mean and count over the priced sales of one
+    geographic level × property type × period combination. Commune cells are
+    exact; commune and department × type × quarter cells also store mergeable
+    sketches of the columns in ``SKETCHES``. With ``approximate``, department
+    cells are merged from the commune sketches, and France cells from the
+    department sketches, instead of being recomputed from ``mutations``: counts
+    and means stay exact, medians are within ``SKETCH_RELATIVE_ACCURACY``.
+    With ``department``, only its commune and department cells are rebuilt,
+    plus the France cells, which depend on every department. Runs in one
+    transaction. Returns the number of rows written.
+    """
+    con.execute("BEGIN TRANSACTION")
+    try:
+        if department is None:
+            con.execute("DELETE FROM prix_rollups")
+        else:
+            con.execute(
+                "DELETE FROM prix_rollups WHERE code_departement = ? OR niveau = 'france'",
+                [department],
+            )
+        written = _insert_level(con, "commune", department)
+        _update_sketches(con, "commune", department)
+        if approximate:
+            written += _merge_level(con, "departement", "commune", department)
+            written += _merge_level(con, "france", "departement")
+        else:
+            # Department sketches are kept up to date for later approximate refreshes
+            written += _insert_level(con, "departement", department)
+            _update_sketches(con, "departement", department)
+            written += _insert_level(con, "france")
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+    logger.info(
+        "Refreshed price rollups%s (%s wide levels): %d rows",
+        f" for department {department}" if department else "",
+        "approximate" if approximate else "exact",
+        written,
+    )
+    return written
+
+
+def _insert_level(
+    con: duckdb.DuckDBPyConnection, niveau: str, department: str | None = None
+) -> int:
+    geo = GEO_LEVELS[niveau]
+    keys = [col for col in geo[:2] if col != "NULL"]
+    sets = [
+        f"({', '.join(keys + list(type_) + list(period))})"
+        for type_, period in product(TYPE_GROUPINGS, PERIOD_GROUPINGS)
+    ]
+    query = _ROLLUP_SELECT.format(
+        niveau=niveau,
+        geo=geo,
+        where="AND code_departement = ?" if department else "",
+        grouping_sets=", ".join(sets),
+    )
+    # Rows are ordered by geography so that dashboard lookups skip most row groups
+    return con.execute(
+        f"INSERT INTO prix_rollups BY NAME {query}", [department] if department else []
+    ).fetchone()[0]
+
+
+def _update_sketches(
+    con: duckdb.DuckDBPyConnection, niveau: str, department: str | None = None
+) -> None:
+    """Store the sketches of the type × quarter cells of a level (of one department if given)."""
+    buckets = ", ".join(
+        f"CASE WHEN {column} IS NOT NULL THEN {{'measure': '{sketch}', "
+        f"'k': CASE WHEN {column} > 0 "
+        f"THEN ceil(ln({column}) / ln({SKETCH_GAMMA}))::INTEGER END}} END"
+        for column, sketch in SKETCHES.values()
+    )
+    query = _SKETCH_UPDATE.format(
+        niveau=niveau,
+        key=GEO_LEVELS[niveau][1 if niveau == "commune" else 0],
+        assignments=", ".join(f"{sketch} = s.{sketch}" for _, sketch in SKETCHES.values()),
+        sketch_lists=_sketch_lists(),
+        buckets=buckets,
+        where="AND code_departement = ?" if department else "",
+        where_rollups="AND r.code_departement = ?" if department else "",
+    )
+    con.execute(query, [department] * 2 if department else [])
+
+
+def _merge_level(
+    con: duckdb.DuckDBPyConnection, niveau: str, source: str, department: str | None = None
+) -> int:
+    """Insert the cells of a level, merged from the sketches of the ``source`` level."""
+    keys = ["code_departement"] if niveau == "departement" else []
+    cell = keys + ["type_local", "annee", "trimestre"]
+    sets = [
+        keys + list(type_) + list(period)
+        for type_, period in product(TYPE_GROUPINGS, PERIOD_GROUPINGS)
+    ]
+    unnested = " UNION ALL ".join(
+        f"SELECT {', '.join(cell)}, '{sketch}' AS measure, s.k, s.n "
+        f"FROM (SELECT *, unnest({sketch}) AS s FROM cells)"
+        for _, sketch in SKETCHES.values()
+    )
+    query = _MERGED_SELECT.format(
+        niveau=niveau,
+        source=source,
+        where="AND code_departement = ?" if department else "",
+        cell=", ".join(cell),
+        grouping_sets=", ".join(f"({', '.join(s)})" for s in sets),
+        bucket_sets=", ".join(f"({', '.join(s + ['measure', 'k'])})" for s in sets),
+        unnested=unnested,
+        sketch_lists=_sketch_lists(),
+        medians=", ".join(
+            f"max(median) FILTER (WHERE measure = '{sketch}') AS {median}"
+            for median, (_, sketch) in SKETCHES.items()
+        ),
+        gamma=SKETCH_GAMMA,
+        code_departement="stats.code_departement" if keys else "NULL",
+        medians_join=" AND ".join(f"stats.{c} IS NOT DISTINCT FROM medians.{c}" for c in cell),
+        sketches_join=" AND ".join(f"stats.{c} IS NOT DISTINCT FROM sketches.{c}" for c in cell),
+    )
+    return con.execute(
+        f"INSERT INTO prix_rollups BY NAME {query}", [department] if department else []
+    ).fetchone()[0]
+
+
+def _sketch_lists() -> str:
+    """Aggregates folding (measure, k, n) bucket rows into one sketch column per measure."""
+    return ", ".join(
+        f"list({{'k': k, 'n': n}} ORDER BY k NULLS FIRST) FILTER (WHERE measure = '{sketch}') "
+        f"AS {sketch}"
+        for _, sketch in SKETCHES.values()
+    )
+
+
+def refresh_price_grid(con: duckdb.DuckDBPyConnection, department: str | None = None) -> int:
+    """Recompute the ``prix_grille`` table (map grid cells) from ``mutations``.
+
+    Every cell holds the exact median price per m² and count of the priced
+    sales located in it, for each grid size × property type × year. With
+    ``department``, only the cells holding its sales, before or after the load,
+    are rebuilt (from the sales of every department in them). Runs in one
+    transaction. Returns the number of rows written.
+    """
+    bins = _GRID_BINS.format(
+        km_lon=KM_PER_DEGREE_LON, km_lat=KM_PER_DEGREE_LAT, sizes=list(GRID_SIZES_KM)
+    )
+    where = "SEMI JOIN _touched_cells USING (taille_km, cell_x, cell_y)" if department else ""
+    select = _GRID_SELECT.format(
+        km_lon=KM_PER_DEGREE_LON, km_lat=KM_PER_DEGREE_LAT, bins=bins, where=where
+    )
+    con.execute("BEGIN TRANSACTION")
+    try:
+        if department is None:
+            con.execute("DELETE FROM prix_grille")
+        else:
+            con.execute(
+                f"""
+                CREATE OR REPLACE TEMP TABLE _touched_cells AS
+                SELECT DISTINCT taille_km, cell_x, cell_y FROM prix_grille
+                WHERE list_contains(departements, ?)
+                UNION
+                SELECT DISTINCT taille_km, cell_x, cell_y FROM ({bins})
+                WHERE code_departement = ?
+                """,
+                [department, department],
+            )
+            con.execute("""
+                DELETE FROM prix_grille g USING _touched_cells t
+                WHERE g.taille_km = t.taille_km AND g.cell_x = t.cell_x AND g.cell_y = t.cell_y
+            """)
+        written = con.execute(f"INSERT INTO prix_grille {select}").fetchone()[0]
+        con.execute(_GRID_DEPARTEMENTS.format(bins=bins, where=where))
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        con.execute("DROP TABLE IF EXISTS _touched_cells")
+
+    logger.info(
+        "Refreshed price grid%s: %d rows",
+        f" for department {department}" if department else "",
+        written,
+    )
+    return written
@@ -0,0 +1,91 @@
+"""Decoding of DPE API pages into the harvested Arrow schema."""
+
+import datetime
+
+import pytest
+
+from moneyplot.ingestion.dpe import DPE_SCHEMA, _decode_page
+
+
+def _record(**fields) -> dict:
+    return {
+        "identifiant_dpe": "2475E0000000A",
+        "code_insee_commune_actualise": "75056",
+        "classe_consommation_energie": "D",
+        "classe_estimation_ges": "C",
+        "annee_construction": 1975,
+        "surface_habitable_logement": 52.5,
+        "date_etablissement_dpe": "2024-03-14",
+        **fields,
+    }
+
+
+def _decoded(**fields) -> dict:
+    table = _decode_page([_record(**fields)])
+    assert table.schema == DPE_SCHEMA
+    return table.to_pylist()[0]
+
+
+def test_decodes_typed_record():
+    assert _decoded() == {
+        "id_dpe": "2475E0000000A",
+        "code_commune": "75056",
+        "id_parcelle": None,
+        "classe_energie": "D",
+        "classe_ges": "C",
+        "annee_construction": 1975,
+        "surface_habitable": 52.5,
+        "date_etablissement": datetime.date(2024, 3, 14),
+    }
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (1975.8, 1975),  # float year, truncated
+        ("1975", 1975),
+        (" 1975.0 ", 1975),
+        ("inconnu", None),  # non-numeric
+        ("", None),
+        (None, None),
+        ("99999999999", None),  # outside int32
+        (1e12, None),
+        (-5, None),
+        (3000, None),  # outside plausible years
+    ],
+)
+def test_year_values_that_do_not_parse_are_null(value, expected):
+    assert _decoded(annee_construction=value)["annee_construction"] == expected
+
+
+def test_out_of_range_year_does_not_fail_the_page():
+    page = [_record(annee_construction=y) for y in (1e12, "99999999999", 1930, "1890.5")]
+
+    years = _decode_page(page).column("annee_construction").to_pylist()
+
+    assert years == [None, None, 1930, 1890]
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        ("2024-01-05T10:00:00", datetime.date(2024, 1, 5)),
+        ("2024-02-30", None),  # impossible date
+        ("n/a", None),
+        (20240101, None),
+    ],
+)
+def test_dates(value, expected):
+    assert _decoded(date_etablissement_dpe=value)["date_etablissement"] == expected
+
+
+def test_field_mixing_numbers_and_strings_on_a_page():
+    page = [_record(surface_habitable_logement=v) for v in (60, "45.5", "abc", None)]
+
+    surfaces = _decode_page(page).column("surface_habitable").to_pylist()
+
+    assert surfaces == [60.0, 45.5, None, None]
+
+
+def test_empty_page():
+    assert _decode_page([]).num_rows == 0
@@ -0,0 +1,151 @@
+"""Incremental ECB sync: upsert of fetched rates and per-series sync state."""
+
+import datetime
+
+import duckdb
+import httpx
+import pytest
+
+from moneyplot.ingestion import http
+from moneyplot.ingestion.ecb import ECB_SERIES_KEY, SyncStats, sync_mortgage_rates
+from moneyplot.storage.schemas import create_tables
+
+# A series of another dataflow, fetched by its own request
+OTHER_KEY = "FM.M.U2.EUR.4F.KR.MRR_FR.LEV"
+
+
+class Server:
+    """Stand-in for the ECB data API, serving ``series`` as SDMX CSV by dataflow."""
+
+    def __init__(self, series: dict[str, dict[str, float]]) -> None:
+        self.series = series
+        self.failing: set[str] = set()
+        self.requests: list[httpx.Request] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        flow = request.url.path.split("/")[-2]
+        if flow in self.failing:
+            return httpx.Response(503)
+        rows = [
+            f"{key},{period},{value}"
+            for key, points in self.series.items() if key.startswith(f"{flow}.")
+            for period, value in points.items()
+        ]
+        if not rows:
+            return httpx.Response(404, text="No results found.")
+        return httpx.Response(200, text="\n".join(["KEY,TIME_PERIOD,OBS_VALUE", *rows]))
+
+
+@pytest.fixture(autouse=True)
+def no_rate_limit(monkeypatch):
+    monkeypatch.setattr(http, "host_bucket", lambda host: http.TokenBucket(1e6, 1))
+
+
+@pytest.fixture
+def con():
+    con = duckdb.connect()
+    create_tables(con)
+    yield con
+    con.close()
+
+
+def _sync(con, server: Server, **kwargs) -> SyncStats:
+    keys = sorted(server.series)
+    with http.make_client(cache=False, transport=httpx.MockTransport(server)) as client:
+        return sync_mortgage_rates(con, series=keys, client=client, **kwargs)
+
+
+def _rates(con) -> dict[tuple[str, str], float]:
+    rows = con.execute("SELECT serie, strftime(date, '%Y-%m'), taux FROM taux_hypothecaires")
+    return {(serie, period): taux for serie, period, taux in rows.fetchall()}
+
+
+def _state(con) -> dict[str, tuple[datetime.date, datetime.datetime]]:
+    rows = con.execute("SELECT serie, last_period, synced_at FROM ecb_sync_state").fetchall()
+    return {serie: (last_period, synced_at) for serie, last_period, synced_at in rows}
+
+
+def test_first_sync_inserts_history_and_records_state(con):
+    server = Server({
+        ECB_SERIES_KEY: {"2024-01": 3.9, "2024-02": 3.8},
+        OTHER_KEY: {"2024-01": 4.5},
+    })
+
+    stats = _sync(con, server)
+
+    assert stats == SyncStats(fetched=3, inserted=3, updated=0, row_count=3)
+    state = _state(con)
+    assert state[ECB_SERIES_KEY][0] == datetime.date(2024, 2, 1)
+    assert state[OTHER_KEY][0] == datetime.date(2024, 1, 1)
+    # Full history: no incremental parameters
+    assert all("updatedAfter" not in r.url.params for r in server.requests)
+
+
+def test_resync_inserts_new_and_replaces_revised_points(con):
+    server = Server({ECB_SERIES_KEY: {"2024-01": 3.9, "2024-02": 3.8}})
+    _sync(con, server)
+    server.series[ECB_SERIES_KEY] = {"2024-01": 3.9, "2024-02": 3.75, "2024-03": 3.7}
+
+    stats = _sync(con, server)
+
+    assert stats == SyncStats(fetched=3, inserted=1, updated=1, row_count=3)
+    assert _rates(con) == {
+        (ECB_SERIES_KEY, "2024-01"): 3.9,
+        (ECB_SERIES_KEY, "2024-02"): 3.75,
+        (ECB_SERIES_KEY, "2024-03"): 3.7,
+    }
+    params = server.requests[-1].url.params
+    assert params["startPeriod"] == "2023-02"
+    assert "updatedAfter" in params
+
+
+def test_nothing_updated_keeps_rows_and_advances_sync_time(con):
+    server = Server({ECB_SERIES_KEY: {"2024-01": 3.9, "2024-02": 3.8}})
+    _sync(con, server)
+    last_period, synced_at = _state(con)[ECB_SERIES_KEY]
+    server.series[ECB_SERIES_KEY] = {}  # the API answers 404
+
+    stats = _sync(con, server)
+
+    assert stats == SyncStats(fetched=0, inserted=0, updated=0, row_count=2)
+    new_period, new_synced_at = _state(con)[ECB_SERIES_KEY]
+    assert new_period == last_period
+    assert new_synced_at > synced_at
+
+
+def test_failed_series_keeps_its_state(con):
+    server = Server({
+        ECB_SERIES_KEY: {"2024-01": 3.9},
+        OTHER_KEY: {"2024-01": 4.5},
+    })
+    _sync(con, server)
+    before = _state(con)
+    server.series[ECB_SERIES_KEY]["2024-02"] = 3.8
+    server.series[OTHER_KEY]["2024-02"] = 4.5
+    server.failing.add("FM")
+
+    stats = _sync(con, server)
+
+    assert stats.failed == [OTHER_KEY]
+    assert stats.inserted == 1
+    after = _state(con)
+    assert after[OTHER_KEY] == before[OTHER_KEY]
+    assert after[ECB_SERIES_KEY][0] == datetime.date(2024, 2, 1)
+    assert after[ECB_SERIES_KEY][1] > before[ECB_SERIES_KEY][1]
+    assert (OTHER_KEY, "2024-02") not in _rates(con)
+
+
+def test_legacy_rows_without_serie_are_merged(con):
+    con.execute("""
+        INSERT INTO taux_hypothecaires VALUES
+            ('2024-01-01', 3.9, 'ECB', NULL),
+            ('2024-02-01', 3.8, 'ECB', NULL)
+    """)
+    server = Server({ECB_SERIES_KEY: {"2024-01": 3.9, "2024-02": 3.85, "2024-03": 3.7}})
+
+    stats = _sync(con, server)
+
+    assert stats == SyncStats(fetched=3, inserted=1, updated=1, row_count=3)
+    nulls = con.execute("SELECT count(*) FROM taux_hypothecaires WHERE serie IS NULL").fetchone()
+    assert nulls == (0,)
@@ -0,0 +1,137 @@
+"""Disk cache and rate limiting of the shared HTTP client, against a stand-in server."""
+
+import time
+
+import httpx
+import pytest
+
+from moneyplot.ingestion import http
+from moneyplot.ingestion.http import CACHE_ENV, CACHE_STATUS_HEADER, TokenBucket, make_client
+
+URL = "https://data.example.test/api/records"
+ETAG = '"v1"'
+
+
+class Server:
+    """Stand-in server answering with a fixed body and ETag, honouring If-None-Match."""
+
+    def __init__(self, body: bytes = b'{"results": [1, 2, 3]}') -> None:
+        self.body = body
+        self.requests: list[httpx.Request] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if request.headers.get("if-none-match") == ETAG:
+            return httpx.Response(304, headers={"ETag": ETAG})
+        return httpx.Response(200, headers={"ETag": ETAG}, content=self.body)
+
+
+class _BrokenStream(httpx.SyncByteStream):
+    """Body whose connection drops after the first chunk."""
+
+    def __iter__(self):
+        yield b'{"results": ['
+        raise httpx.ReadError("connection reset")
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv(CACHE_ENV, str(tmp_path))
+    # Fresh buckets, so that every test starts with a full burst
+    monkeypatch.setattr(http, "_buckets", {})
+    return tmp_path
+
+
+def _entries(cache_dir) -> list:
+    return list((cache_dir / "entries").glob("*/*.json"))
+
+
+def test_miss_then_hit():
+    server = Server()
+    with make_client(transport=httpx.MockTransport(server)) as client:
+        first = client.get(URL)
+        second = client.get(URL)
+
+    assert first.headers[CACHE_STATUS_HEADER] == "miss"
+    assert second.headers[CACHE_STATUS_HEADER] == "hit"
+    assert second.content == first.content == server.body
+    assert len(server.requests) == 1
+
+
+def test_stale_entry_is_revalidated_with_304():
+    server = Server()
+    with make_client(ttl=0, transport=httpx.MockTransport(server)) as client:
+        client.get(URL)
+        response = client.get(URL)
+
+    assert response.headers[CACHE_STATUS_HEADER] == "revalidated"
+    assert response.status_code == 200
+    assert response.content == server.body
+    assert server.requests[1].headers["if-none-match"] == ETAG
+
+
+def test_interrupted_stream_leaves_no_entry(cache_dir):
+    def handler(request):
+        return httpx.Response(200, stream=_BrokenStream())
+
+    with make_client(transport=httpx.MockTransport(handler)) as client:
+        with pytest.raises(httpx.ReadError):
+            client.get(URL)
+
+    assert _entries(cache_dir) == []
+    assert list((cache_dir / "objects").glob("**/*.part")) == []
+
+
+def test_abandoned_download_leaves_no_entry(cache_dir):
+    server = Server(body=b"x" * (3 * http.CHUNK_SIZE))
+    with make_client(transport=httpx.MockTransport(server)) as client:
+        with client.stream("GET", URL) as response:
+            next(response.iter_raw(1024))
+        assert _entries(cache_dir) == []
+        again = client.get(URL)
+
+    assert again.headers[CACHE_STATUS_HEADER] == "miss"
+    assert len(server.requests) == 2
+
+
+def test_no_store_bypasses_cache(cache_dir):
+    server = Server()
+    with make_client(transport=httpx.MockTransport(server)) as client:
+        for _ in range(2):
+            response = client.get(URL, headers={"Cache-Control": "no-store"})
+            assert CACHE_STATUS_HEADER not in response.headers
+
+    assert len(server.requests) == 2
+    assert _entries(cache_dir) == []
+
+
+def test_query_parameter_order_shares_entry():
+    server = Server()
+    with make_client(transport=httpx.MockTransport(server)) as client:
+        client.get(URL, params={"size": 100, "q": "75056"})
+        response = client.get(URL, params={"q": "75056", "size": 100})
+
+    assert response.headers[CACHE_STATUS_HEADER] == "hit"
+    assert len(server.requests) == 1
+
+
+def test_cache_disabled_through_environment(cache_dir, monkeypatch):
+    monkeypatch.setenv(CACHE_ENV, "off")
+    server = Server()
+    with make_client(transport=httpx.MockTransport(server)) as client:
+        client.get(URL)
+        client.get(URL)
+
+    assert len(server.requests) == 2
+    assert not (cache_dir / "entries").exists()
+
+
+def test_token_bucket_allows_burst_then_spaces_requests():
+    bucket = TokenBucket(rate=20.0, burst=3)
+
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    start = time.monotonic()
+    for _ in range(4):
+        bucket.acquire()
+    # 4 tokens at 20 per second, minus what refilled during the burst
+    assert time.monotonic() - start >= 0.15
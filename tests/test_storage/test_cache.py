@@ -0,0 +1,113 @@
+"""Query cache: invalidation by the data version, and the entry and size bounds."""
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pytest
+
+from moneyplot.storage.cache import MAX_BYTES, MAX_ENTRIES, QueryCache, cached_fetchdf, get_cache
+from moneyplot.storage.db import (
+    QueryProfiler,
+    get_read_connection,
+    publish_snapshot,
+    read_data_version,
+)
+
+QUERY = "SELECT a FROM t"
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "moneyplot.duckdb"
+    with duckdb.connect(str(path)) as con:
+        con.execute("CREATE TABLE t AS SELECT 1 AS a")
+    get_cache().clear()
+    yield path
+    get_cache().clear()
+
+
+def _write(path, value: int) -> None:
+    with duckdb.connect(str(path)) as con:
+        con.execute("UPDATE t SET a = ?", [value])
+
+
+def test_publish_bumps_the_data_version(db_path):
+    assert read_data_version(db_path) == "0"
+    first = publish_snapshot(db_path)
+    assert read_data_version(db_path) == first.stem
+    _write(db_path, 2)
+    second = publish_snapshot(db_path)
+    assert read_data_version(db_path) == second.stem != first.stem
+    # A snapshot's version is its own id, whatever is published after it
+    assert read_data_version(first) == first.stem
+
+
+def test_published_write_invalidates_cached_result(db_path):
+    publish_snapshot(db_path)
+    with get_read_connection(db_path) as con:
+        assert cached_fetchdf(con, QUERY)["a"].tolist() == [1]
+        assert cached_fetchdf(con, QUERY)["a"].tolist() == [1]
+    assert get_cache().stats().hits == 1
+
+    _write(db_path, 2)
+    publish_snapshot(db_path)
+    with get_read_connection(db_path) as con:
+        assert cached_fetchdf(con, QUERY)["a"].tolist() == [2]
+
+
+def test_profiler_records_only_the_page_queries(db_path):
+    publish_snapshot(db_path)
+    profiler = QueryProfiler()
+    with get_read_connection(db_path, profiler=profiler) as con:
+        con.execute("SELECT 42")  # left unfetched
+        cached_fetchdf(con, QUERY)
+        cached_fetchdf(con, QUERY)  # served from the cache
+
+    assert [(r.sql, r.rows) for r in profiler.records()] == [("SELECT 42", None), (QUERY, 1)]
+
+
+def test_live_database_result_is_keyed_by_published_version(db_path):
+    with duckdb.connect(str(db_path)) as con:
+        assert cached_fetchdf(con, QUERY)["a"].tolist() == [1]
+        con.execute("UPDATE t SET a = 2")
+        # Unpublished writes are not visible through the cache...
+        assert cached_fetchdf(con, QUERY)["a"].tolist() == [1]
+        con.execute("CHECKPOINT")
+    publish_snapshot(db_path)
+    with duckdb.connect(str(db_path)) as con:
+        # ...until the publish moves the version
+        assert cached_fetchdf(con, QUERY)["a"].tolist() == [2]
+
+
+def test_entry_bound_evicts_least_recently_used():
+    cache = QueryCache()
+    for i in range(MAX_ENTRIES):
+        cache.put(("q", i), pd.DataFrame({"a": [i]}))
+    cache.get(("q", 0))  # now the most recently used
+    cache.put(("q", MAX_ENTRIES), pd.DataFrame({"a": [MAX_ENTRIES]}))
+
+    assert cache.stats().entries == MAX_ENTRIES
+    assert cache.get(("q", 0)) is not None
+    assert cache.get(("q", 1)) is None
+    assert cache.get(("q", MAX_ENTRIES)) is not None
+
+
+def test_size_bound_evicts_oldest_entries():
+    cache = QueryCache()
+    frame = pd.DataFrame({"a": np.zeros(MAX_BYTES // 4 // 8)})  # a quarter of the bound
+    size = int(frame.memory_usage(deep=True).sum())
+    for i in range(5):
+        cache.put(("q", i), frame)
+
+    stats = cache.stats()
+    assert stats.bytes <= MAX_BYTES
+    assert stats.entries == MAX_BYTES // size
+    assert cache.get(("q", 0)) is None
+    assert cache.get(("q", 4)) is not None
+
+
+def test_result_larger_than_the_bound_is_not_cached():
+    cache = QueryCache(max_bytes=1024)
+    cache.put(("q",), pd.DataFrame({"a": np.zeros(1024)}))
+
+    assert cache.stats().entries == 0
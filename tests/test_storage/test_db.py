@@ -0,0 +1,53 @@
+"""Pooled read connections to the published snapshots."""
+
+import threading
+
+import duckdb
+import pytest
+
+from moneyplot.storage import db
+from moneyplot.storage.db import get_read_connection, publish_snapshot
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "moneyplot.duckdb"
+    with duckdb.connect(str(path)) as con:
+        con.execute("CREATE TABLE t AS SELECT 1 AS a")
+    publish_snapshot(path)
+    yield path
+    db._read_pool.pop(path, None)
+
+
+def test_superseded_connection_closes_with_its_last_cursor(db_path):
+    old = get_read_connection(db_path)
+    with duckdb.connect(str(db_path)) as con:
+        con.execute("UPDATE t SET a = 2")
+    publish_snapshot(db_path)
+
+    new = get_read_connection(db_path)
+
+    # The open cursor keeps reading the snapshot it started on
+    assert old.execute("SELECT a FROM t").fetchone() == (1,)
+    assert new.execute("SELECT a FROM t").fetchone() == (2,)
+    retired = old._pooled
+    old.close()
+    with pytest.raises(duckdb.ConnectionException):
+        retired.con.execute("SELECT 1")
+    new.close()
+
+
+def test_cursor_collected_while_pool_lock_is_held(db_path):
+    cursor = get_read_connection(db_path)
+
+    def collect():
+        # As when the garbage collector finalizes it inside get_read_connection
+        with db._read_pool_lock:
+            cursor.__del__()
+
+    thread = threading.Thread(target=collect, daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert db._read_pool[db_path].cursors == 0
@@ -0,0 +1,135 @@
+"""Comparable sales: k-d tree search against a brute-force scan, incremental rebuilds."""
+
+import json
+import os
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pytest
+
+from moneyplot.storage.schemas import create_tables
+from moneyplot.transform.comparables import (
+    _EPOCH,
+    MANIFEST,
+    TYPES,
+    ComparablesIndex,
+    features,
+    refresh_comparables,
+)
+
+K = 10
+
+
+def _sales(n: int = 3000, seed: int = 0) -> pd.DataFrame:
+    """Sales spread over two departments, around Paris and Lyon, in 2020-2024."""
+    rng = np.random.default_rng(seed)
+    dept = np.where(rng.random(n) < 0.7, "75", "69")
+    paris = dept == "75"
+    surface = np.round(rng.lognormal(4, 0.5, n), 1)
+    prix_m2 = rng.uniform(3000, 12000, n)
+    return pd.DataFrame({
+        "id_mutation": [f"M{i}" for i in range(n)],
+        "date_mutation": pd.Timestamp("2020-01-01") + pd.to_timedelta(
+            rng.integers(0, 5 * 365, n), unit="D"
+        ),
+        "nature_mutation": "Vente",
+        "valeur_fonciere": surface * prix_m2,
+        "code_departement": dept,
+        "code_commune": np.where(paris, "75056", "69123"),
+        "type_local": np.where(rng.random(n) < 0.6, "Appartement", "Maison"),
+        "surface_reelle_bati": surface,
+        "nombre_pieces": rng.integers(1, 7, n),
+        "prix_m2": prix_m2,
+        "latitude": np.where(paris, 48.86, 45.76) + rng.normal(0, 0.03, n),
+        "longitude": np.where(paris, 2.35, 4.84) + rng.normal(0, 0.04, n),
+    })
+
+
+@pytest.fixture
+def con():
+    con = duckdb.connect()
+    create_tables(con)
+    df = _sales()  # noqa: F841 (read by DuckDB)
+    con.execute("INSERT INTO mutations BY NAME SELECT * FROM df")
+    yield con
+    con.close()
+
+
+def _brute_force(con, lat, lon, surface, rooms, type_local, on) -> list[str]:
+    """Ids of the ``K`` sales of the type nearest in the normalised space, scanning them all."""
+    sales = con.execute("SELECT * FROM mutations WHERE type_local = ?", [type_local]).df()
+    days = (sales["date_mutation"].to_numpy().astype("datetime64[D]") - _EPOCH).astype(float)
+    points = features(
+        sales["latitude"].to_numpy(), sales["longitude"].to_numpy(),
+        sales["surface_reelle_bati"].to_numpy(), sales["nombre_pieces"].to_numpy(float), days,
+    )
+    query = features(
+        np.array([lat]), np.array([lon]), np.array([surface], dtype=float),
+        np.array([rooms], dtype=float),
+        np.array([(np.datetime64(on, "D") - _EPOCH).astype(float)]),
+    )[0]
+    nearest = np.argsort(((points - query) ** 2).sum(axis=1))[:K]
+    return sales["id_mutation"].iloc[nearest].tolist()
+
+
+def test_search_matches_brute_force(con, tmp_path):
+    refresh_comparables(con, directory=tmp_path)
+    index = ComparablesIndex(tmp_path)
+    rng = np.random.default_rng(1)
+
+    for _ in range(30):
+        lat, lon = (48.86, 2.35) if rng.random() < 0.6 else (45.76, 4.84)
+        lat, lon = lat + rng.normal(0, 0.05), lon + rng.normal(0, 0.05)
+        surface, rooms = float(rng.uniform(15, 200)), int(rng.integers(1, 7))
+        type_local = rng.choice(list(TYPES))
+        on = pd.Timestamp("2020-01-01") + pd.Timedelta(days=int(rng.integers(0, 2000)))
+
+        found = index.search(lat, lon, surface, rooms, type_local, on=on.date(), k=K)
+
+        assert found["id_mutation"].tolist() == _brute_force(
+            con, lat, lon, surface, rooms, type_local, on.date()
+        )
+        assert found["ecart"].is_monotonic_increasing
+        assert (found["type_local"] == type_local).all()
+
+
+def _built_at(directory) -> dict[str, float]:
+    manifest = json.loads((directory / MANIFEST).read_text())
+    return {key: entry["built_at"] for key, entry in manifest.items()}
+
+
+def test_unchanged_department_is_skipped(con, tmp_path):
+    assert refresh_comparables(con, directory=tmp_path) == 3000
+    built = _built_at(tmp_path)
+
+    assert refresh_comparables(con, directory=tmp_path) == 0
+    assert _built_at(tmp_path) == built
+
+    con.execute("""
+        DELETE FROM mutations WHERE id_mutation IN (
+            SELECT id_mutation FROM mutations WHERE code_departement = '69' LIMIT 3
+        )
+    """)
+    lyon = con.execute("SELECT count(*) FROM mutations WHERE code_departement = '69'").fetchone()
+
+    assert refresh_comparables(con, directory=tmp_path) == lyon[0]
+    rebuilt = {key for key, at in _built_at(tmp_path).items() if at != built[key]}
+    assert rebuilt == {f"69/{slug}" for slug in TYPES.values()}
+
+
+def test_open_index_picks_up_rebuilt_tree(con, tmp_path):
+    refresh_comparables(con, directory=tmp_path)
+    index = ComparablesIndex(tmp_path)
+    query = (48.86, 2.35, 60.0, 3, "Appartement")
+    nearest = index.search(*query, k=K + 1)["id_mutation"].tolist()
+
+    # The nearest sale is withdrawn and the department rebuilt
+    con.execute("DELETE FROM mutations WHERE id_mutation = ?", [nearest[0]])
+    refresh_comparables(con, department="75", directory=tmp_path)
+    # Bumped as a later write would, whatever the file system's timestamp resolution
+    manifest = tmp_path / MANIFEST
+    mtime = manifest.stat().st_mtime_ns + 10**9
+    os.utime(manifest, ns=(mtime, mtime))
+
+    assert index.search(*query, k=K)["id_mutation"].tolist() == nearest[1:]
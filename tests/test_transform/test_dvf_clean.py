@@ -0,0 +1,100 @@
+"""Incremental merge of the cleaned DVF dataset into the mutations table."""
+
+import datetime
+
+import duckdb
+import pandas as pd
+import pytest
+
+from moneyplot.storage.schemas import create_tables
+from moneyplot.transform.dvf_clean import MUTATIONS_COLUMNS, LoadStats, load_parquet_to_duckdb
+
+
+def _mutation(i: int, dept: str = "75", valeur: float = 300_000.0) -> dict:
+    surface = 40.0 + i
+    return {
+        "id_mutation": f"2024-{dept}-{i}",
+        "date_mutation": datetime.date(2024, 1 + i % 12, 1),
+        "nature_mutation": "Vente",
+        "valeur_fonciere": valeur,
+        "code_departement": dept,
+        "code_commune": f"{dept}001",
+        "nom_commune": "Commune",
+        "code_postal": f"{dept}000",
+        "id_parcelle": f"{dept}001000AB{i:04d}",
+        "type_local": "Appartement" if i % 2 else "Maison",
+        "surface_reelle_bati": surface,
+        "nombre_pieces": 1 + i % 5,
+        "surface_terrain": None,
+        "longitude": 2.35,
+        "latitude": 48.85,
+        "prix_m2": valeur / surface,
+        "annee": 2024,
+        "trimestre": 1 + (i % 12) // 3,
+    }
+
+
+def _write_dataset(path, rows: list[dict]) -> None:
+    """Write rows as the cleaned dataset (hive-partitioned by annee and code_departement)."""
+    df = pd.DataFrame(rows, columns=MUTATIONS_COLUMNS)  # noqa: F841 (read by DuckDB)
+    duckdb.sql(f"""
+        COPY (SELECT * FROM df)
+        TO '{path}' (FORMAT PARQUET, PARTITION_BY (annee, code_departement), OVERWRITE)
+    """)
+
+
+@pytest.fixture
+def con():
+    con = duckdb.connect()
+    create_tables(con)
+    yield con
+    con.close()
+
+
+def test_first_load_inserts_every_row(con, tmp_path):
+    _write_dataset(tmp_path, [_mutation(i) for i in range(10)])
+
+    stats = load_parquet_to_duckdb(con, dataset_dir=tmp_path)
+
+    assert stats == LoadStats(inserted=10, updated=0, deleted=0, row_count=10)
+
+
+def test_reload_of_unchanged_slice_writes_nothing(con, tmp_path):
+    _write_dataset(tmp_path, [_mutation(i) for i in range(10)])
+    load_parquet_to_duckdb(con, dataset_dir=tmp_path)
+
+    stats = load_parquet_to_duckdb(con, dataset_dir=tmp_path)
+
+    assert stats == LoadStats(inserted=0, updated=0, deleted=0, row_count=10)
+
+
+def test_reload_applies_altered_removed_and_new_rows(con, tmp_path):
+    _write_dataset(tmp_path, [_mutation(i) for i in range(10)])
+    load_parquet_to_duckdb(con, dataset_dir=tmp_path)
+
+    # Mutation 3 repriced, 7 and 8 withdrawn, 10 published
+    rows = [_mutation(i) for i in range(11) if i not in (7, 8)]
+    rows[3] = _mutation(3, valeur=350_000.0)
+    _write_dataset(tmp_path, rows)
+
+    stats = load_parquet_to_duckdb(con, dataset_dir=tmp_path)
+
+    assert stats == LoadStats(inserted=1, updated=1, deleted=2, row_count=9)
+    table = con.execute(
+        f"SELECT {', '.join(MUTATIONS_COLUMNS)} FROM mutations ORDER BY id_mutation"
+    ).df()
+    expected = pd.DataFrame(rows, columns=MUTATIONS_COLUMNS).sort_values("id_mutation")
+    assert table["id_mutation"].tolist() == expected["id_mutation"].tolist()
+    assert table.loc[table["id_mutation"] == "2024-75-3", "valeur_fonciere"].item() == 350_000.0
+
+
+def test_department_load_leaves_other_departments(con, tmp_path):
+    _write_dataset(tmp_path, [_mutation(i, d) for d, n in (("75", 5), ("13", 3)) for i in range(n)])
+    load_parquet_to_duckdb(con, dataset_dir=tmp_path)
+    _write_dataset(tmp_path, [_mutation(i, d) for d, n in (("75", 4), ("13", 2)) for i in range(n)])
+
+    stats = load_parquet_to_duckdb(con, department="13", dataset_dir=tmp_path)
+
+    assert stats == LoadStats(inserted=0, updated=0, deleted=1, row_count=2)
+    paris = con.execute("SELECT count(*) FROM mutations WHERE code_departement = '75'").fetchone()
+    assert paris == (5,)
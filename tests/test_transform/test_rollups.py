@@ -0,0 +1,83 @@
+"""Sketch-merged medians of the price rollups against the exact medians."""
+
+import duckdb
+import pytest
+
+from moneyplot.storage.schemas import create_tables
+from moneyplot.transform.rollups import SKETCH_RELATIVE_ACCURACY, SKETCHES, refresh_rollups
+
+# Rollup cells compared: every type × period cell of these levels
+COMPARED = """
+    SELECT niveau, code_departement, type_local, annee, trimestre, nb_transactions,
+        prix_m2_median, surface_mediane, prix_median
+    FROM prix_rollups
+    WHERE niveau IN ('departement', 'france')
+"""
+KEY = ["niveau", "code_departement", "type_local", "annee", "trimestre"]
+
+
+@pytest.fixture
+def con():
+    con = duckdb.connect()
+    create_tables(con)
+    # 3 departments × 4 communes × 2 types × 8 quarters, with spread-out
+    # pseudo-random surfaces and prices (hashes of the row number)
+    con.execute("""
+        INSERT INTO mutations (
+            id_mutation, date_mutation, nature_mutation, valeur_fonciere, code_departement,
+            code_commune, nom_commune, type_local, surface_reelle_bati, prix_m2, annee, trimestre
+        )
+        SELECT
+            'M' || i,
+            make_date(annee, trimestre * 3, 1),
+            'Vente',
+            surface * prix_m2,
+            dept,
+            dept || lpad((i % 4)::VARCHAR, 3, '0'),
+            'Commune ' || (i % 4),
+            CASE WHEN i % 3 = 0 THEN 'Maison' ELSE 'Appartement' END,
+            surface,
+            prix_m2,
+            annee,
+            trimestre
+        FROM (
+            SELECT
+                i,
+                ['01', '13', '75'][1 + i % 3] AS dept,
+                2022 + (i // 7) % 2 AS annee,
+                1 + (i // 11) % 4 AS trimestre,
+                15 + (hash(i) % 200)::DOUBLE AS surface,
+                1500 + (hash(i * 7919) % 9000)::DOUBLE AS prix_m2
+            FROM range(30000) t(i)
+        )
+    """)
+    yield con
+    con.close()
+
+
+def _cells(con: duckdb.DuckDBPyConnection, approximate: bool):
+    refresh_rollups(con, approximate=approximate)
+    return con.execute(COMPARED).df().set_index(KEY).sort_index()
+
+
+@pytest.mark.parametrize("niveau", ["departement", "france"])
+def test_merged_medians_within_relative_accuracy(con, niveau):
+    exact = _cells(con, approximate=False).xs(niveau, drop_level=False)
+    approx = _cells(con, approximate=True).xs(niveau, drop_level=False)
+
+    assert len(exact) > 0
+    assert approx.index.equals(exact.index)
+    # Counts are merged exactly
+    assert (approx["nb_transactions"] == exact["nb_transactions"]).all()
+    for median in SKETCHES:
+        error = ((approx[median] - exact[median]).abs() / exact[median]).max()
+        assert error <= SKETCH_RELATIVE_ACCURACY, median
+
+
+def test_department_refresh_matches_full_refresh(con):
+    refresh_rollups(con, approximate=True)
+    full = con.execute(COMPARED).df().set_index(KEY).sort_index()
+    refresh_rollups(con, department="13", approximate=True)
+    partial = con.execute(COMPARED).df().set_index(KEY).sort_index()
+
+    assert partial.equals(full)